@@ -0,0 +1,93 @@
+import os
+from collections import OrderedDict
+import numpy as np
+import soundfile as sf
+import librosa
+from resemblyzer.audio import normalize_volume, trim_long_silences
+from resemblyzer.hparams import audio_norm_target_dBFS
+
+import config
+import denoise_audio
+
+SR = config.VOICE_SAMPLE_RATE
+
+#one pass per sample: decode -> downmix -> resample -> denoise -> normalize -> VAD trim
+#the output is ready for encoder.embed_utterance (no preprocess_wav needed) and for augmentation
+
+
+class AudioFrontEnd:
+
+    def __init__(self, cache_size=64):
+        self.cache_size = cache_size
+        self._cache     = OrderedDict()
+
+    def _cached(self, key):
+        if key is None or key not in self._cache:
+            return None
+        self._cache.move_to_end(key)
+        return self._cache[key]
+
+    def _store(self, key, result):
+        if key is None:
+            return result
+        self._cache[key] = result
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def _decode(self, y, sr):
+        y = np.asarray(y, dtype=np.float32)
+        meta = {
+            "orig_sr":  sr,
+            "sr":       SR,
+            "channels": 1 if y.ndim == 1 else y.shape[1],
+            "raw_secs": y.shape[0] / sr,
+        }
+        #downmix before resampling so only one channel is resampled
+        if y.ndim > 1:
+            y = y.mean(axis=1)
+        if sr != SR:
+            y = librosa.resample(y, orig_sr=sr, target_sr=SR)
+        return y, meta
+
+    def _finish(self, y, meta, denoised):
+        wav = normalize_volume(y, audio_norm_target_dBFS, increase_only=True)
+        wav = trim_long_silences(wav).astype(np.float32)
+        meta["secs"]     = len(wav) / SR
+        meta["denoised"] = denoised
+        return wav, meta
+
+    def process(self, y, sr, denoise=True, key=None, noise_key=None):
+        #returns (wav, meta), wav is float32 mono at SR, normalized and silence-trimmed
+        hit = self._cached(key)
+        if hit is not None:
+            return hit
+
+        y, meta = self._decode(y, sr)
+        if denoise:
+            y, _ = denoise_audio.denoise_array(y, SR, noise_key=noise_key)
+        return self._store(key, self._finish(y, meta, denoise))
+
+    def process_batch(self, clips, noise_key=None):
+        #clips is a list of (y, sr) recorded in one session, denoised together with a shared noise profile
+        decoded = [self._decode(y, sr) for y, sr in clips]
+        cleaned = denoise_audio.denoise_batch([(y, SR) for y, _ in decoded], noise_key=noise_key)
+        return [self._finish(y, meta, True) for y, (_, meta) in zip(cleaned, decoded)]
+
+    def load(self, path, denoise=True):
+        #files are cached by path, size and mtime so a rewritten file is processed again
+        st  = os.stat(path)
+        key = (os.path.abspath(path), st.st_size, st.st_mtime_ns, denoise)
+        hit = self._cached(key)
+        if hit is not None:
+            return hit
+        y, sr = sf.read(str(path), dtype="float32")
+        wav, meta = self.process(y, sr, denoise=denoise)
+        meta["source"] = str(path)
+        return self._store(key, (wav, meta))
+
+    def clear(self):
+        self._cache.clear()
+
+
+frontend = AudioFrontEnd()
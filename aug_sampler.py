@@ -0,0 +1,97 @@
+import os
+import json
+import threading
+from pathlib import Path
+import numpy as np
+
+import config
+
+#adaptive choice of augmentation parameters: every (augmentation type, parameter bin) is an arm with a
+#Beta(1 + accepted, 1 + rejected) belief about how often its candidates pass the LOW_SIM/HIGH_SIM gate,
+#and each candidate comes from the arm with the highest draw (Thompson sampling), so arms that keep
+#getting rejected are tried less and less but never ruled out
+#counts are scaled down to AUG_SAMPLER_MEMORY per arm so the sampler follows a new microphone or camera,
+#and they are kept in models/aug_sampler_<name>.json across clips, users and runs; a save adds this
+#process's new counts to whatever is on disk, so pool workers and kiosks sharing models/ pool their
+#statistics (two saves racing can lose one of the deltas, which only costs a little learning)
+
+_save_lock = threading.Lock()
+
+
+class AugSampler:
+
+    def __init__(self, name, arms, path=None, memory=None):
+        #arms: {augmentation type: [parameter bin, ...]}, the bins are whatever the caller draws from
+        self.name   = name
+        self.arms   = [(t, i) for t, bins in arms.items() for i in range(len(bins))]
+        self.bins   = arms
+        self.path   = Path(path or config.MODELS_DIR / f"aug_sampler_{name}.json")
+        self.memory = memory or config.AUG_SAMPLER_MEMORY
+        self._lock  = threading.Lock()
+        self.counts = np.zeros((len(self.arms), 2))   #accepted, rejected
+        self._delta = np.zeros_like(self.counts)
+        self.counts = self._read()
+
+    def _key(self, arm):
+        return f"{arm[0]}:{json.dumps(self.bins[arm[0]][arm[1]])}"
+
+    def _read(self):
+        #counts on disk for the current arms; bins that changed since the file was written start fresh
+        counts = np.zeros((len(self.arms), 2))
+        try:
+            stored = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return counts
+        for k, arm in enumerate(self.arms):
+            c = stored.get(self._key(arm))
+            if isinstance(c, list) and len(c) == 2:
+                counts[k] = c
+        return self._cap(counts)
+
+    def _cap(self, counts):
+        total = counts.sum(axis=1, keepdims=True)
+        return counts * np.minimum(1.0, self.memory / np.maximum(total, 1e-9))
+
+    def choose(self):
+        #(type, bin index) for the next candidate
+        with self._lock:
+            draws = np.random.beta(1 + self.counts[:, 0], 1 + self.counts[:, 1])
+        return self.arms[int(np.argmax(draws))]
+
+    def bin(self, arm):
+        return self.bins[arm[0]][arm[1]]
+
+    def update(self, arm, accepted):
+        k = self.arms.index(arm)
+        col = 0 if accepted else 1
+        with self._lock:
+            self.counts[k, col] += 1
+            self._delta[k, col] += 1
+            self.counts[k] = self._cap(self.counts[k:k + 1])[0]
+
+    def acceptance(self):
+        #{arm key: posterior mean acceptance rate}
+        with self._lock:
+            a, r = self.counts[:, 0], self.counts[:, 1]
+            return {self._key(arm): float(m) for arm, m in zip(self.arms, (1 + a) / (2 + a + r))}
+
+    def save(self):
+        with self._lock:
+            delta, self._delta = self._delta, np.zeros_like(self._delta)
+        if not delta.any():
+            return
+        with _save_lock:
+            merged = self._cap(self._read() + delta)
+            try:
+                stored = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                stored = {}
+            stored.update({self._key(arm): [round(float(a), 3), round(float(r), 3)]
+                           for arm, (a, r) in zip(self.arms, merged)})
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(f"{self.path.stem}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(stored, indent=1))
+            os.replace(tmp, self.path)
+        with self._lock:
+            #what other processes learned meanwhile, plus what this one added since the delta was taken
+            self.counts = self._cap(merged + self._delta)
@@ -4,9 +4,9 @@ import numpy as np
 import librosa
 import soundfile as sf
 from resemblyzer import preprocess_wav
-from config import encoder
 import config
-import tempfile
+from audio_frontend import frontend
+from aug_sampler import AugSampler
 SR        = config.VOICE_SAMPLE_RATE
 RAW_DIR   = config.CLEAN_VOICE_DIR
 AUG_DIR   = config.AUG_VOICE_DIR
@@ -15,6 +15,15 @@ MAX_TRIES = config.MAX_TRIES
 LOW_SIM   = config.LOW_SIM
 HIGH_SIM  = config.HIGH_SIM
 
+#arms of the adaptive sampler: parameter bins per augmentation type, together they cover the blind ranges
+#(pitch in semitones, stretch rate, noise SNR in dB)
+VOICE_ARMS = {
+    "pitch":   [(-0.5, -0.25), (-0.25, 0.0), (0.0, 0.25), (0.25, 0.5)],
+    "stretch": [(0.8, 0.9), (0.9, 1.0), (1.0, 1.1), (1.1, 1.2)],
+    "noise":   [(17.0, 18.0), (18.0, 19.0), (19.0, 20.0)],
+}
+sampler = AugSampler("voice", VOICE_ARMS)
+
 #process one speaker or all speakers
 speaker = sys.argv[1] if len(sys.argv) > 1 else None
 
@@ -24,29 +33,76 @@ def cos_sim(a: np.ndarray, b: np.ndarray) -> float:
 
 
 def embed_augmented(y_aug: np.ndarray, sr: int) -> np.ndarray:
-    with tempfile.NamedTemporaryFile(suffix=".wav") as tmp:
-        sf.write(tmp.name, y_aug, sr)
-        wav_proc = preprocess_wav(tmp.name)
-        return encoder.embed_utterance(wav_proc)
+    #normalized and VAD-trimmed again even when the source clip already was: noise, pitch and stretch
+    #change its level and silences, and skipping this flips some LOW_SIM/HIGH_SIM decisions
+    #preprocess_wav accepts arrays directly, no need for a round trip through a wav file
+    wav_proc = preprocess_wav(y_aug.astype(np.float32), source_sr=sr)
+    return config.get_encoder().embed_utterance(wav_proc)
 
 
-def augment_clip(y: np.ndarray, sr: int) -> np.ndarray:
+def _blind_params():
     choice = np.random.choice(["stretch", "pitch", "noise"])
     if choice == "pitch":
-        n_steps = np.random.uniform(-0.5, 0.5)
-        return librosa.effects.pitch_shift(y, sr=sr, n_steps=n_steps)
-    elif choice == "stretch":
+        return choice, np.random.uniform(-0.5, 0.5)
+    if choice == "stretch":
         if np.random.rand() < 0.8:
-            rate = np.random.uniform(0.9, 1.1)
-        else:
-            rate = np.random.uniform(0.8, 1.2)
-        return librosa.effects.time_stretch(y, rate=rate)
+            return choice, np.random.uniform(0.9, 1.1)
+        return choice, np.random.uniform(0.8, 1.2)
+    return choice, np.random.uniform(17, 20)
+
+
+def augment_clip(y: np.ndarray, sr: int, choice: str = None, value: float = None) -> np.ndarray:
+    #choice/value come from the adaptive sampler, without them both are drawn blindly
+    if choice is None:
+        choice, value = _blind_params()
+    if choice == "pitch":
+        return librosa.effects.pitch_shift(y, sr=sr, n_steps=value)
+    elif choice == "stretch":
+        return librosa.effects.time_stretch(y, rate=value)
     else:
-        snr_db = np.random.uniform(17, 20)
+        snr_db = value
         rms = np.sqrt(np.mean(y**2))
         noise = np.random.randn(len(y)) * rms * 10**(-snr_db/20)
         return y + noise
 
+def augment_array(y: np.ndarray, sr: int, emb_o: np.ndarray, name: str = "clip",
+                  limit: int = N_AUG) -> list[tuple[np.ndarray, np.ndarray]]:
+    #returns up to `limit` accepted (augmented clip, embedding) pairs
+    kept  = []
+    tries = 0
+    #we have a maximum nr of tries to get a certain number of audio_augmented clips
+    while len(kept) < min(N_AUG, limit) and tries < MAX_TRIES:
+        tries += 1
+        arm = sampler.choose() if config.ADAPTIVE_AUG else None
+        if arm:
+            y_aug = augment_clip(y, sr, arm[0], np.random.uniform(*sampler.bin(arm)))
+        else:
+            y_aug = augment_clip(y, sr)
+        try:
+            emb_a = embed_augmented(y_aug, sr)
+        except Exception as e:
+            warnings.warn(f"⚠️ Embed failed on augment of {name}: {e}")
+            if arm:
+                sampler.update(arm, False)
+            continue
+
+        #check similarity between original and audio_augmented, if it is too low do not save it, to not confuse the model
+        sim = cos_sim(emb_o, emb_a)
+        ok  = LOW_SIM <= sim <= HIGH_SIM
+        if arm:
+            sampler.update(arm, ok)
+        if ok:
+            print(f" Kept {name} augment {len(kept)+1} (sim={sim:.3f})")
+            kept.append((y_aug, emb_a))
+        else:
+            print(f"Rejected {name} sim={sim:.3f}")
+
+    if config.ADAPTIVE_AUG:
+        sampler.save()
+    print(f"[Aug] {name}: {len(kept)} kept after {tries} encoder calls")
+    return kept
+
+
 def batch_augment(speaker: str = None):
     #either go through all files or only a user's files
     if speaker:
@@ -62,42 +118,22 @@ def batch_augment(speaker: str = None):
         out_dir.mkdir(parents=True, exist_ok=True)
 
         try:
-            #load the audio file into a NumPy array
-            y, _    = librosa.load(str(wav_path), sr=SR)
+            #load the (already denoised) file once, normalized and trimmed, and embed it
+            y, _    = frontend.load(wav_path, denoise=False)
             #compute speaker embedding
-            emb_o   = encoder.embed_utterance(preprocess_wav(str(wav_path)))
+            emb_o   = config.get_encoder().embed_utterance(y)
         except Exception as e:
             warnings.warn(f"⚠️ Failed to load/embed {wav_path.name}: {e}")
             continue
 
-        accepted = 0
-        tries    = 0
-        #we have a maximum nr of tries to get a certain number of audio_augmented clips
-        while accepted < N_AUG and tries < MAX_TRIES:
-            y_aug = augment_clip(y, SR)
-            try:
-                emb_a = embed_augmented(y_aug, SR)
-            except Exception as e:
-                warnings.warn(f"⚠️ Embed failed on augment of {wav_path.name}: {e}")
-                tries += 1
-                continue
-
-            #check similarity between original and audio_augmented, if it is too low do not save it, to not confuse the model
-            sim = cos_sim(emb_o, emb_a)
-            if LOW_SIM <= sim <= HIGH_SIM:
-                if len(list(out_dir.glob("*_aug*.wav"))) >= config.MAX_AUG_PER_USER:
-                    break
-                fname = f"{wav_path.stem}_aug{accepted+1}.wav"
-                out_path = out_dir / fname
-                sf.write(str(out_path), y_aug, SR)
-                print(f" Kept {fname} (sim={sim:.3f})")
-                accepted += 1
-            else:
-                print(f"Rejected {wav_path.name} sim={sim:.3f}")
-            tries += 1
-
-        if accepted < N_AUG:
-            warnings.warn(f" Only {accepted}/{N_AUG} augments passed for {wav_path.name}")
+        budget = config.MAX_AUG_PER_USER - len(list(out_dir.glob("*_aug*.wav")))
+        kept = augment_array(y, SR, emb_o, name=wav_path.name, limit=max(0, budget))
+        for i, (y_aug, _) in enumerate(kept, start=1):
+            fname = f"{wav_path.stem}_aug{i}.wav"
+            sf.write(str(out_dir / fname), y_aug, SR)
+
+        if len(kept) < N_AUG:
+            warnings.warn(f" Only {len(kept)}/{N_AUG} augments passed for {wav_path.name}")
 
 
 if __name__ == "__main__":
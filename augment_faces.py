@@ -5,6 +5,7 @@ import albumentations as A
 import sys
 
 import config
+from aug_sampler import AugSampler
 
 DATA_DIR      = config.PROC_FACE_DIR
 OUT_DIR       = config.AUG_FACE_DIR
@@ -14,109 +15,137 @@ LOW_SIM       = config.LOW_SIM
 HIGH_SIM      = config.HIGH_SIM
 FALLBACK_KEEP = 2
 
-if len(sys.argv) > 1:
-    user = sys.argv[1]
-    USERS = [user]
-else:
-    USERS = sorted(os.listdir(DATA_DIR))
-
 def cos_sim(a, b):
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
 
 
-aug = A.Compose([
-    A.Affine(rotate=(-15, 15),
-             translate_percent={"x": (-0.10,0.10),"y": (-0.10,0.10)},
-             scale=(0.9, 1.1), p=0.9),
-    A.OneOf([
-        A.OpticalDistortion(distort_limit=0.05),   # mimics lens distortion (lines and shapes shifted in non-linear way)
-        A.GridDistortion(num_steps=5, distort_limit=0.05),   # each grid point randomly
-        A.ElasticTransform(alpha=1, sigma=50),  # simulate elastic movements (facial muscle shifts)
-    ], p=0.3),
-    A.OneOf([
-        A.GaussianBlur(blur_limit=(3,7)),
-        A.MotionBlur(blur_limit=5),
-    ], p=0.3),
-    A.RandomBrightnessContrast(brightness_limit=0.2,
-                               contrast_limit=0.2, p=0.7),
-    A.HueSaturationValue(hue_shift_limit=20,
-                         sat_shift_limit=30,
-                         val_shift_limit=20, p=0.5),
-    A.RandomGamma(gamma_limit=(80,140), p=0.4),   # brightens or darkens midtones
-    A.GaussNoise(std_range=(10/255, 50/255), mean_range=(0.0, 0.0), p=0.4),  # pixel-level noise
-    A.CLAHE(clip_limit=2.0, p=0.3),   # enhances local contrast in small regions of the image (features more prominent)
-], p=1.0)
-
-
-os.makedirs(OUT_DIR, exist_ok=True)
-
-for user in USERS:
-    src = os.path.join(DATA_DIR, user)
-    dst = os.path.join(OUT_DIR, user)
-
-    if not os.path.isdir(src):
-        print(f"[WARNING] Source directory for user '{user}' does not exist. Skipping.")
-        continue
-    os.makedirs(dst, exist_ok=True)
-
-    img_list = glob.glob(f"{src}/*.jpg")
-    print(f"[DEBUG] Found {len(img_list)} images for user '{user}'.")
-
-    for img_path in img_list:
-        print(f"\n[DEBUG] Original image: {img_path}")
-        bgr = cv2.imread(img_path)
-        if bgr is None:
-            print(f"[ERROR] Failed to load image: {img_path}")
-            continue
+def build_aug(strength=1.0):
+    #the augmentation pipeline with every range scaled by strength, 1.0 is the original one
+    s = strength
+    return A.Compose([
+        A.Affine(rotate=(-15 * s, 15 * s),
+                 translate_percent={"x": (-0.10 * s, 0.10 * s), "y": (-0.10 * s, 0.10 * s)},
+                 scale=(1 - 0.1 * s, 1 + 0.1 * s), p=0.9),
+        A.OneOf([
+            A.OpticalDistortion(distort_limit=0.05 * s),   # mimics lens distortion (lines and shapes shifted in non-linear way)
+            A.GridDistortion(num_steps=5, distort_limit=0.05 * s),   # each grid point randomly
+            A.ElasticTransform(alpha=1 * s, sigma=50),  # simulate elastic movements (facial muscle shifts)
+        ], p=0.3),
+        A.OneOf([
+            A.GaussianBlur(blur_limit=(3, 3 + 2 * int(2 * s + 0.5))),
+            A.MotionBlur(blur_limit=max(3, 2 * int(2.5 * s) + 1)),
+        ], p=0.3),
+        A.RandomBrightnessContrast(brightness_limit=0.2 * s,
+                                   contrast_limit=0.2 * s, p=0.7),
+        A.HueSaturationValue(hue_shift_limit=round(20 * s),
+                             sat_shift_limit=round(30 * s),
+                             val_shift_limit=round(20 * s), p=0.5),
+        A.RandomGamma(gamma_limit=(100 - 20 * s, 100 + 40 * s), p=0.4),   # brightens or darkens midtones
+        A.GaussNoise(std_range=(min(10, 50 * s) / 255, 50 * s / 255), mean_range=(0.0, 0.0), p=0.4),  # pixel-level noise
+        A.CLAHE(clip_limit=1.0 + 1.0 * s, p=0.3),   # enhances local contrast in small regions of the image (features more prominent)
+    ], p=1.0)
+
+
+aug = build_aug(1.0)
+
+#arms of the adaptive sampler: a candidate is one pass of the whole pipeline, so the parameter bins
+#are strength levels of it rather than separate transforms; none goes past the original ranges (1.0)
+FACE_ARMS = {"strength": [0.25, 0.5, 0.75, 1.0]}
+_pipelines = {st: build_aug(st) for st in FACE_ARMS["strength"]}
+sampler = AugSampler("face", FACE_ARMS)
+
+
+def augment_image(bgr, emb_o=None, name="image"):
+    #returns the accepted (augmented bgr image, embedding) pairs for one processed face
+    if emb_o is None:
         rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
-
         locs = face_recognition.face_locations(rgb)
         if not locs:
-            print(f"[WARNING] No face in {user}/{os.path.basename(img_path)}, skipping")
-            continue
-
+            print(f"[WARNING] No face in {name}, skipping")
+            return []
         emb_o = face_recognition.face_encodings(rgb, known_face_locations=[locs[0]])[0]
 
-        kept_imgs = []
-        kept_sims = []
-        tries = 0
-        while (len(kept_imgs) < N_AUG) and (tries < MAX_TRIES):
-            tries += 1
-            aug_bgr = aug(image=bgr)["image"]
-            aug_rgb = cv2.cvtColor(aug_bgr, cv2.COLOR_BGR2RGB)
-
-            locs2 = face_recognition.face_locations(aug_rgb)
-            if not locs2:
-                print(f"[DEBUG] [SKIP] augment#{tries} for {img_path} (no face detected in augmented image)")
-                continue
+    kept_imgs = []
+    kept_sims = []
+    tries = 0
+    while (len(kept_imgs) < N_AUG) and (tries < MAX_TRIES):
+        tries += 1
+        arm = sampler.choose() if config.ADAPTIVE_AUG else None
+        pipeline = _pipelines[sampler.bin(arm)] if arm else aug
+        aug_bgr = pipeline(image=bgr)["image"]
+        aug_rgb = cv2.cvtColor(aug_bgr, cv2.COLOR_BGR2RGB)
+
+        locs2 = face_recognition.face_locations(aug_rgb)
+        if not locs2:
+            print(f"[DEBUG] [SKIP] augment#{tries} for {name} (no face detected in augmented image)")
+            if arm:
+                sampler.update(arm, False)
+            continue
 
-            emb_a = face_recognition.face_encodings(aug_rgb, known_face_locations=[locs2[0]])[0]
-            sim = cos_sim(emb_o, emb_a)
-            print(f"[DEBUG] augment#{tries}: cosine sim={sim:.3f}")
+        emb_a = face_recognition.face_encodings(aug_rgb, known_face_locations=[locs2[0]])[0]
+        sim = cos_sim(emb_o, emb_a)
+        print(f"[DEBUG] augment#{tries}: cosine sim={sim:.3f}")
+
+        kept_sims.append((sim, aug_bgr, emb_a))
+        if arm:
+            sampler.update(arm, LOW_SIM <= sim <= HIGH_SIM)
+        if LOW_SIM <= sim <= HIGH_SIM:
+            kept_imgs.append((aug_bgr, emb_a))
+            print(f"[DEBUG] augment#{tries}: accepted (SIM {LOW_SIM}–{HIGH_SIM}), total accepted: {len(kept_imgs)}")
+        else:
+            print(f"[DEBUG] augment#{tries}: similarity {sim:.3f} out of bounds [{LOW_SIM}, {HIGH_SIM}]")
+
+    # if none passed the filter, pick top 2
+    if not kept_imgs and kept_sims:
+        kept_sims.sort(key=lambda x: x[0], reverse=True)
+        for sim, img, emb in kept_sims[:FALLBACK_KEEP]:
+            kept_imgs.append((img, emb))
+        print(f"[DEBUG] Fallback accepted, sim={sim:.3f}")
+
+    if config.ADAPTIVE_AUG:
+        sampler.save()
+    print(f"kept {len(kept_imgs[:N_AUG])}/{N_AUG} after {tries} tries")
+    return kept_imgs[:N_AUG]
+
+
+def batch_augment(users):
+    os.makedirs(OUT_DIR, exist_ok=True)
+
+    for user in users:
+        src = os.path.join(DATA_DIR, user)
+        dst = os.path.join(OUT_DIR, user)
+
+        if not os.path.isdir(src):
+            print(f"[WARNING] Source directory for user '{user}' does not exist. Skipping.")
+            continue
+        os.makedirs(dst, exist_ok=True)
 
-            kept_sims.append((sim, aug_bgr))
-            if LOW_SIM <= sim <= HIGH_SIM:
-                kept_imgs.append(aug_bgr)
-                print(f"[DEBUG] augment#{tries}: accepted (SIM {LOW_SIM}–{HIGH_SIM}), total accepted: {len(kept_imgs)}")
-            else:
-                print(f"[DEBUG] augment#{tries}: similarity {sim:.3f} out of bounds [{LOW_SIM}, {HIGH_SIM}]")
+        img_list = glob.glob(f"{src}/*.jpg")
+        print(f"[DEBUG] Found {len(img_list)} images for user '{user}'.")
+
+        for img_path in img_list:
+            print(f"\n[DEBUG] Original image: {img_path}")
+            bgr = cv2.imread(img_path)
+            if bgr is None:
+                print(f"[ERROR] Failed to load image: {img_path}")
+                continue
 
+            kept = augment_image(bgr, name=f"{user}/{os.path.basename(img_path)}")
 
-        # if none passed the filter, pick top 2
-            if not kept_imgs and kept_sims:
-                kept_sims.sort(key=lambda x: x[0], reverse=True)
-                for sim, img in kept_sims[:FALLBACK_KEEP]:
-                    kept_imgs.append(img)
-                print(f"[DEBUG] Fallback accepted, sim={sim:.3f}")
+            # save
+            for i, (img_out, _) in enumerate(kept, start=1):
+                if len(glob.glob(f"{dst}/*_aug*.jpg")) >= config.MAX_AUG_PER_USER:
+                    break
+                fname = f"{os.path.splitext(os.path.basename(img_path))[0]}_aug{i}.jpg"
+                cv2.imwrite(os.path.join(dst, fname), img_out)
+                print(f"[DEBUG] Saved: {os.path.join(dst, fname)}")
 
-        # save
-        for i, img_out in enumerate(kept_imgs[:N_AUG], start=1):
-            if len(glob.glob(f"{dst}/*_aug*.jpg")) >= config.MAX_AUG_PER_USER:
-                break
-            fname = f"{os.path.splitext(os.path.basename(img_path))[0]}_aug{i}.jpg"
-            cv2.imwrite(os.path.join(dst, fname), img_out)
-            print(f"[DEBUG] Saved: {os.path.join(dst, fname)}")
+    print("\nAugmentation complete.")
 
-        print(f"kept {len(kept_imgs[:N_AUG])}/{N_AUG} after {tries} tries")
 
-print("\nAugmentation complete.")
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        USERS = [sys.argv[1]]
+    else:
+        USERS = sorted(os.listdir(DATA_DIR))
+    batch_augment(USERS)
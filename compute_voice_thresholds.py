@@ -1,45 +1,113 @@
+import argparse
 import joblib
 import numpy as np
-from scipy.spatial.distance import cosine
-from sklearn.metrics import roc_curve
+from concurrent.futures import ProcessPoolExecutor
 import config
+import emb_cache
+import model_files
+import resources
 from config import VOICE_MODEL_FILE
-from db import get_audio_embeddings, get_all_usernames
+from eer import ScoreHistogram
 
-def compute_thresholds():
-    voice_thresholds = {}
-    users = get_all_usernames()
-    for user in users:
-        embs = get_audio_embeddings(user)
-        if len(embs) < 2:
-            print(f"Skipping {user}: need >2 samples, got {len(embs)}")
+#per-user EER thresholds: genuine = every pair of the user's own samples, impostor = the user's first
+#sample against every sample of everyone else. Similarities are computed in blocks of users x bank rows
+#and go straight into fixed-resolution histograms, so memory is bounded by the block size instead of
+#growing with the number of score pairs; user blocks are independent and can run in worker processes
+BINS        = 2000     #over cosine [-1, 1]: thresholds are exact to 0.001
+BLOCK_USERS = 256      #users scored together
+BLOCK_ROWS  = 16_384   #bank rows per similarity block
+
+_bank = _starts = _ends = _owner = None
+
+
+def _init(bank, starts):
+    global _bank, _starts, _ends, _owner
+    _bank, _starts = bank, starts
+    _ends  = np.append(starts[1:], len(bank))
+    _owner = np.repeat(np.arange(len(starts)), _ends - starts)
+
+
+def _init_pool(bank, starts):
+    resources.init_worker()
+    _init(bank, starts)
+
+
+def _score_users(lo, hi):
+    #(lo, genuine counts, impostor counts) with one histogram row per user lo..hi-1
+    h = ScoreHistogram(bins=BINS)
+    n = hi - lo
+    gen = np.zeros((n, BINS), np.int64)
+    imp = np.zeros((n, BINS), np.int64)
+    for k, u in enumerate(range(lo, hi)):
+        own = _bank[_starts[u]:_ends[u]]
+        if len(own) < 2:
             continue
+        i, j = np.triu_indices(len(own), 1)
+        gen[k] = np.bincount(h.bin_index(np.einsum("ij,ij->i", own[i], own[j])), minlength=BINS)
+
+    first = _bank[_starts[lo:hi]]
+    users = np.arange(lo, hi)
+    rows  = np.arange(n)[:, None] * BINS
+    for c0 in range(0, len(_bank), BLOCK_ROWS):
+        sims  = first @ _bank[c0:c0 + BLOCK_ROWS].T
+        other = _owner[c0:c0 + BLOCK_ROWS][None, :] != users[:, None]
+        imp  += np.bincount((rows + h.bin_index(sims))[other], minlength=n * BINS).reshape(n, BINS)
+    return lo, gen, imp
+
+
+def compute_thresholds(model_file=VOICE_MODEL_FILE, workers=1, use_cache=True):
+    cols = emb_cache.load_columns("audio_embeddings", config.VOICE_EMB_DIM, use_cache)
+    #each user's rows contiguous and in insertion order, so a user's first sample comes first
+    order  = np.argsort(cols.user_idx, kind="stable")
+    sizes  = np.bincount(cols.user_idx, minlength=len(cols.users))
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+    labels = cols.users
+    #unit rows, so every similarity block is a plain matrix product
+    bank  = np.asarray(cols.X[order], np.float32)
+    bank /= np.maximum(np.linalg.norm(bank, axis=1, keepdims=True), 1e-12)
+
+    for user, n in zip(labels, sizes):
+        if n < 2:
+            print(f"Skipping {user}: need >=2 samples, got {n}")
+
+    blocks = [(lo, min(lo + BLOCK_USERS, len(labels))) for lo in range(0, len(labels), BLOCK_USERS)]
+    if workers > 1 and len(blocks) > 1:
+        pool = ProcessPoolExecutor(workers, initializer=_init_pool, initargs=(bank, starts))
+        results = pool.map(_score_users, *zip(*blocks))
+    else:
+        pool = None
+        _init(bank, starts)
+        results = (_score_users(lo, hi) for lo, hi in blocks)
+
+    voice_thresholds = {}
+    pooled = ScoreHistogram(bins=BINS)
+    try:
+        for lo, gen, imp in results:
+            for k, (g, i) in enumerate(zip(gen, imp)):
+                user = labels[lo + k]
+                if sizes[lo + k] < 2 or not i.any():
+                    continue
+                h = ScoreHistogram.from_counts(g, i)
+                pooled.merge(h)
+                _, voice_thresholds[user] = h.eer()
+                print(f"Threshold for {user}: {voice_thresholds[user]:.3f}")
+    finally:
+        if pool:
+            pool.shutdown()
+    if voice_thresholds:
+        eer, thr = pooled.eer()
+        print(f"Pooled EER over {len(voice_thresholds)} users: {eer:.3f} at {thr:.3f}")
 
-        genuine_sims = [
-            1 - cosine(embs[i], embs[j])
-            for i in range(len(embs))
-            for j in range(i+1, len(embs))
-        ]
-
-        impostor_sims = []
-        for other in users:
-            if other == user:
-                continue
-            for emb2 in get_audio_embeddings(other):
-                impostor_sims.append(1 - cosine(embs[0], emb2))
-
-        y_true  = np.array([1]*len(genuine_sims) + [0]*len(impostor_sims))
-        y_score = np.array(genuine_sims + impostor_sims)
-        fpr, tpr, thr = roc_curve(y_true, y_score)
-        idx = np.nanargmin(np.abs((1 - tpr) - fpr)) # finds the index where the difference between FAR and FRR is smallest
-        voice_thresholds[user] = float(thr[idx]) #takes that threshold
-        print(f"Threshold for {user}: {voice_thresholds[user]:.3f}")
-
-    data = joblib.load(VOICE_MODEL_FILE)
+    data = joblib.load(model_file)
     data["voice_thresholds"] = voice_thresholds
-    joblib.dump(data, VOICE_MODEL_FILE)
+    model_files.publish(data, model_file)
 
-    print(f"Updated {VOICE_MODEL_FILE} with per-user thresholds")
+    print(f"Updated {model_file} with per-user thresholds")
+    return voice_thresholds
 
 if __name__ == "__main__":
-    compute_thresholds()
+    ap = argparse.ArgumentParser(description="Recompute per-user voice thresholds")
+    ap.add_argument("--workers", type=int, default=1, help="processes scoring user blocks in parallel")
+    ap.add_argument("--no-cache", action="store_true", help="read the embeddings from the db again")
+    args = ap.parse_args()
+    compute_thresholds(workers=args.workers, use_cache=not args.no_cache)
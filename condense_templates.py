@@ -0,0 +1,274 @@
+import time
+import argparse
+import numpy as np
+
+import db
+import config
+import embeddings
+import emb_cache
+import model_files
+import train_classifiers
+from eer import ScoreHistogram
+
+#per-user template condensation: augmented embeddings are accepted up to HIGH_SIM from their original,
+#so many stored rows are near-duplicates; this keeps k representatives per user and modality
+#(farthest-point sampling in cosine space refined by a few k-medoids swaps, plus optionally a centroid row)
+#and flags the rest out of the template set, they stay in the db and can be brought back by re-running
+#before writing, one original per user (with its augmented copies) is held out, the rest is condensed
+#the same way, and the held-out originals are scored against the full and the condensed sets to report
+#the accuracy/EER delta and the scoring speedup
+#usage: python condense_templates.py [--k 8] [--no-centroid] [--modality audio face] [--dry-run] [--no-train]
+#                                    [--no-svm]
+
+DIM_FACE         = 128
+N_REFINE         = 5       #k-medoids swap rounds after the farthest-point seeding
+MAX_EVAL_QUERIES = 2_000
+QUERY_BLOCK      = 256
+#table, dim, score: voice is verified by cosine, faces by euclidean distance to the nearest template
+MODALITIES = {
+    "audio": ("audio_embeddings", config.VOICE_EMB_DIM, "cosine"),
+    "face":  ("face_embeddings",  DIM_FACE,             "euclidean"),
+}
+SCORE_RANGE = {"cosine": (-1.0, 1.0), "euclidean": (-2.0, 0.0)}
+#rows a user needs after condensing: the voice thresholds need a genuine pair, the face SVM a row per
+#calibration fold
+MIN_ROWS = {"audio": 2, "face": train_classifiers.MIN_TRAIN_ROWS}
+
+
+def _unit(X):
+    X = np.asarray(X, np.float32)
+    return X / np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+
+
+def select(X, k, refine=N_REFINE):
+    #sorted indices of k representative rows of X in cosine space
+    n = len(X)
+    if n <= k:
+        return np.arange(n)
+    U = _unit(X)
+    S = U @ U.T
+    #seed with the medoid, then repeatedly add the row least similar to everything chosen so far
+    chosen = [int(np.argmax(S.sum(axis=1)))]
+    best = S[chosen[0]].copy()
+    for _ in range(k - 1):
+        i = int(np.argmin(best))
+        chosen.append(i)
+        best = np.maximum(best, S[i])
+    chosen = np.array(chosen)
+    for _ in range(refine):
+        assign = np.argmax(S[:, chosen], axis=1)
+        new = chosen.copy()
+        for c in range(k):
+            members = np.flatnonzero(assign == c)
+            if len(members):
+                new[c] = members[np.argmax(S[np.ix_(members, members)].sum(axis=1))]
+        if np.array_equal(np.sort(new), np.sort(chosen)):
+            break
+        chosen = new
+    return np.sort(chosen)
+
+
+def condense(X, user_idx, n_users, k, centroid=True):
+    #(keep mask over the rows, centroid per user or None); users are processed one contiguous block at a time
+    keep  = np.zeros(len(X), bool)
+    cents = np.zeros((n_users, X.shape[1]), np.float32) if centroid else None
+    order = np.argsort(user_idx, kind="stable")
+    ends  = np.cumsum(np.bincount(user_idx, minlength=n_users))
+    for u, (a, b) in enumerate(zip(np.concatenate([[0], ends[:-1]]), ends)):
+        rows = order[a:b]
+        if not len(rows):
+            continue
+        Xu = np.asarray(X[rows], np.float32)
+        keep[rows[select(Xu, k)]] = True
+        if centroid:
+            cents[u] = Xu.mean(axis=0)
+    return keep, cents
+
+
+def _score(Q, bank, bank_user, metric):
+    #(users present in the bank, best score of every query against each of them)
+    order = np.argsort(bank_user, kind="stable")
+    bank, bank_user = bank[order], bank_user[order]
+    present, starts = np.unique(bank_user, return_index=True)
+    if metric == "cosine":
+        sims = _unit(Q) @ _unit(bank).T
+    else:
+        d2 = (Q ** 2).sum(1)[:, None] - 2 * Q @ bank.T + (bank ** 2).sum(1)[None]
+        sims = -np.sqrt(np.maximum(d2, 0))
+    return present, np.maximum.reduceat(sims, starts, axis=1)
+
+
+def _verify(Q, q_user, bank, bank_user, metric):
+    #(top-1 accuracy, score histogram, seconds spent scoring) of queries against a bank
+    hist = ScoreHistogram(*SCORE_RANGE[metric])
+    hits, secs = 0, 0.0
+    for lo in range(0, len(Q), QUERY_BLOCK):
+        t0 = time.perf_counter()
+        present, S = _score(Q[lo:lo + QUERY_BLOCK], bank, bank_user, metric)
+        secs += time.perf_counter() - t0
+        truth = q_user[lo:lo + QUERY_BLOCK]
+        col = np.searchsorted(present, truth)
+        col = np.minimum(col, len(present) - 1)
+        own = present[col] == truth
+        rows = np.arange(len(S))
+        genuine = np.where(own, S[rows, col], -np.inf)
+        others = S.copy()
+        others[rows[own], col[own]] = -np.inf
+        hits += int(np.sum(own & (present[np.argmax(S, axis=1)] == truth)))
+        hist.add(np.clip(genuine, *SCORE_RANGE[metric]), others.max(axis=1))
+    return hits / max(len(Q), 1), hist, secs
+
+
+def _check_trainable(modality, before, after):
+    #raises before anything is written when condensing would leave a user too few rows to train on
+    need  = np.minimum(before, MIN_ROWS[modality])
+    short = np.flatnonzero(after < need)
+    if len(short):
+        raise ValueError(f"{modality}: {len(short)} users would keep fewer than {MIN_ROWS[modality]} rows, "
+                         f"raise --k")
+
+
+def _svm_scores(Xtr, ytr, Q, q_names):
+    #(top-1, EER) of the production face SVM trained on Xtr and scored on the held-out queries
+    _, m, _ = train_classifiers.evaluate("svm", Xtr, ytr, Q, q_names)
+    return m["accuracy"], m["eer"]
+
+
+def evaluate(cols, k, centroid, metric, seed=0, svm=False):
+    #held-out report: dict of row counts, top-1, EER and scoring time for the full and condensed sets,
+    #with svm also top-1 and EER of the face SVM trained on each
+    rng  = np.random.default_rng(seed)
+    X    = np.asarray(cols.X, np.float32)
+    key  = cols.user_idx.astype(np.int64) * max(len(cols.origs), 1) + cols.orig_codes
+    orig = np.flatnonzero(~cols.augmented)
+    perm = rng.permutation(orig)
+    #one original per user with at least two, so every queried user still has templates left
+    n_orig = np.bincount(cols.user_idx[orig], minlength=len(cols.users))
+    _, first = np.unique(cols.user_idx[perm], return_index=True)
+    picked = perm[first]
+    picked = picked[n_orig[cols.user_idx[picked]] >= 2]
+    if len(picked) > MAX_EVAL_QUERIES:
+        picked = rng.choice(picked, MAX_EVAL_QUERIES, replace=False)
+    held = np.isin(key, key[picked])
+
+    rest = ~held
+    Xr, ur = X[rest], cols.user_idx[rest]
+    keep, cents = condense(Xr, ur, len(cols.users), k, centroid)
+    Xc, uc = Xr[keep], ur[keep]
+    if centroid:
+        has = np.bincount(ur, minlength=len(cols.users)) > 0
+        Xc = np.vstack([Xc, cents[has]])
+        uc = np.concatenate([uc, np.flatnonzero(has)])
+
+    Q, qu = X[picked], cols.user_idx[picked]
+    full = _verify(Q, qu, Xr, ur, metric)
+    cond = _verify(Q, qu, Xc, uc, metric)
+    r = {"queries": len(Q), "rows": (len(Xr), len(Xc)),
+         "top1": (full[0], cond[0]), "eer": (full[1].eer()[0], cond[1].eer()[0]),
+         "secs": (full[2], cond[2])}
+    if svm:
+        names = np.array(cols.users, str)
+        r["svm"] = (_svm_scores(Xr, names[ur], Q, names[qu]), _svm_scores(Xc, names[uc], Q, names[qu]))
+    return r
+
+
+def condense_table(modality, k=None, centroid=None, dry_run=False, seed=0, svm=True):
+    table, dim, metric = MODALITIES[modality]
+    k = k or config.CONDENSE_K
+    centroid = config.CONDENSE_CENTROID if centroid is None else centroid
+    cols = db.load_embedding_columns(table, dim, template_set_only=False)
+    stored = np.array([o != db.CENTROID_ORIG_ID for o in cols.origs])[cols.orig_codes]
+    cols = db.Columns(cols.ids[stored], cols.X[stored], cols.user_idx[stored], cols.users,
+                      cols.orig_codes[stored], cols.origs, cols.augmented[stored], cols.scanned, cols.last_id)
+    if not len(cols.ids):
+        print(f"[Condense] {modality}: no embeddings")
+        return None
+
+    #checked before anything is evaluated or written
+    keep, cents = condense(cols.X, cols.user_idx, len(cols.users), k, centroid)
+    before = np.bincount(cols.user_idx, minlength=len(cols.users))
+    has = before > 0
+    _check_trainable(modality, before, np.bincount(cols.user_idx[keep], minlength=len(cols.users)) + has * centroid)
+
+    #the nearest-template numbers are what voice verification and the face index see, production face
+    #identification with FACE_ENGINE "svm" is checked with the SVM itself
+    svm = svm and modality == "face" and config.FACE_ENGINE == "svm"
+    r = evaluate(cols, k, centroid, metric, seed, svm)
+    speedup = r["secs"][0] / max(r["secs"][1], 1e-9)
+    print(f"[Condense] {modality}: {r['rows'][0]} -> {r['rows'][1]} templates on the held-out split "
+          f"(k={k}{' + centroid' if centroid else ''}), {r['queries']} queries")
+    print(f"[Condense] {modality}: top-1 {r['top1'][0]:.4f} -> {r['top1'][1]:.4f} "
+          f"({r['top1'][1] - r['top1'][0]:+.4f}), EER {r['eer'][0]:.4f} -> {r['eer'][1]:.4f} "
+          f"({r['eer'][1] - r['eer'][0]:+.4f}), scoring {r['secs'][0] * 1000:.0f} -> "
+          f"{r['secs'][1] * 1000:.0f} ms ({speedup:.1f}x)")
+    if "svm" in r:
+        (a0, e0), (a1, e1) = r["svm"]
+        print(f"[Condense] {modality}: SVM top-1 {a0:.4f} -> {a1:.4f} ({a1 - a0:+.4f}), "
+              f"EER {e0:.4f} -> {e1:.4f} ({e1 - e0:+.4f})")
+    if dry_run:
+        return r
+    blobs = [(u, embeddings.pack(c)) for u, c, h in zip(cols.users, cents, has) if h] if centroid else []
+    db.set_template_sets(table, cols.ids[keep], blobs)
+    emb_cache.EmbeddingCache(table, dim).clear()
+    print(f"[Condense] {modality}: {int(keep.sum())} of {len(keep)} rows kept"
+          f"{f', {len(blobs)} centroids' if blobs else ''}")
+    return r
+
+
+def condense_user(username, k=None, centroid=None, modalities=("audio", "face")):
+    #enrollment: condense one user's freshly stored rows, the rest of the table is left alone
+    k = k or config.CONDENSE_K
+    centroid = config.CONDENSE_CENTROID if centroid is None else centroid
+    for modality in modalities:
+        table, dim, _ = MODALITIES[modality]
+        rows = db.get_user_embedding_rows(table, username)
+        ids, vecs = [], []
+        for rid, _, _, blob in rows:
+            try:
+                v = embeddings.unpack(blob)
+            except ValueError:
+                continue
+            if v.size == dim and np.all(np.isfinite(v)):
+                ids.append(rid); vecs.append(v)
+        if not vecs:
+            continue
+        X = np.stack(vecs)
+        keep = np.asarray(ids)[select(X, k)]
+        _check_trainable(modality, np.array([len(ids)]), np.array([len(keep) + bool(centroid)]))
+        blobs = [(username, embeddings.pack(X.mean(axis=0)))] if centroid else []
+        db.set_template_sets(table, keep, blobs, usernames=[username])
+        #a swap of flagged rows can keep the row count, which is all the cache's staleness check sees
+        emb_cache.EmbeddingCache(table, dim).clear()
+        print(f"[Condense] {username} {modality}: {len(keep)} of {len(ids)} rows kept")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Keep a small representative template set per user")
+    ap.add_argument("--k", type=int, default=config.CONDENSE_K, help="templates kept per user and modality")
+    ap.add_argument("--no-centroid", action="store_true", help="do not add a centroid row per user")
+    ap.add_argument("--modality", nargs="*", default=list(MODALITIES), choices=list(MODALITIES))
+    ap.add_argument("--dry-run", action="store_true", help="only report, leave the template sets as they are")
+    ap.add_argument("--no-train", action="store_true", help="skip retraining after condensing")
+    ap.add_argument("--no-svm", action="store_true", help="skip the face SVM check of the condensed set")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    db.init_db()
+    #same lock as enrollment: the sets must not change under a running enrollment or training
+    with model_files.locked():
+        written = False
+        for modality in args.modality:
+            try:
+                condense_table(modality, args.k, not args.no_centroid, args.dry_run, args.seed, not args.no_svm)
+            except ValueError as e:
+                print(f"[Condense] {e}; template set left as it is")
+                continue
+            written = written or not args.dry_run
+        if written and not args.no_train:
+            #imported here, pipeline itself imports this module for CONDENSE_ON_ENROLL
+            import pipeline
+            import voice_index
+            print("[Condense] retraining on the condensed sets")
+            pipeline.train_face_model()
+            pipeline.train_voice_thresholds()
+            voice_index.build_from_db().save()
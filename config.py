@@ -1,13 +1,11 @@
 import db
 import joblib
-from resemblyzer import VoiceEncoder
+import model_files
+import resources
+import threading
 from pathlib import Path
 
-for bak in Path("models").glob("*.joblib.bak"):
-    try:
-        bak.unlink()
-    except Exception as e:
-        print(f"Could not remove {bak}: {e}")
+model_files.clear_stale_backups()
 
 BASE_DIR       = Path(__file__).parent
 RAW_FACE_DIR   = BASE_DIR / "data/images/images_raw"
@@ -21,6 +19,9 @@ AUG_VOICE_DIR        = BASE_DIR / "data/audio/audio_augmented"
 MODELS_DIR     = BASE_DIR / "models"
 VOICE_MODEL_FILE    = MODELS_DIR / "voice_thresholds.joblib"
 FACE_MODEL_FILE     = MODELS_DIR / "face_svm.joblib"
+VOICE_INDEX_FILE    = MODELS_DIR / "voice_index.joblib"
+FACE_INDEX_FILE     = MODELS_DIR / "face_index.joblib"
+EMB_CACHE_DIR       = MODELS_DIR / "cache"   # memory-mapped copies of the embedding tables for training jobs
 DB_PATH = str(BASE_DIR / "auth.db")
 
 MAX_AUG_PER_USER = 25
@@ -29,17 +30,98 @@ LOW_SIM        = 0.85
 HIGH_SIM       = 0.99
 N_AUG          = 5
 MAX_TRIES      = 15
+#augmentation type and parameter range are picked by aug_sampler.py from how often each one passed the
+#LOW_SIM/HIGH_SIM gate so far (models/aug_sampler_*.json), False samples them blindly
+ADAPTIVE_AUG       = True
+AUG_SAMPLER_MEMORY = 200   # accepted + rejected candidates remembered per arm
+
+#condense_templates.py keeps CONDENSE_K representative embeddings per user and modality (plus a centroid
+#row with CONDENSE_CENTROID), verification and training read only that set
+CONDENSE_K         = 8
+CONDENSE_CENTROID  = True
+CONDENSE_ON_ENROLL = False   # condense each new user right after enrollment
 
 OUTPUT_SIZE    = (160,160)
 MARGIN_FRAC    = 0.2
 DETECTION_MODEL= "hog"
+FAST_ALIGN     = True   # detect on a downscaled copy and warp only the output crop
+FACE_DETECT_SCALE = 0.5
+FACE_ENCODE_BATCH = 32  # aligned crops per ResNet batch at enrollment
 CAM_DEVICE     = 0
+MULTI_FACE     = False  # track every face in frame, authenticate the largest/most central stable one
+#"svm": calibrated closed-set SVM (face_svm.joblib), retrained on every enrollment
+#"index": nearest-template search over per-user centroids, re-ranking the FACE_INDEX_TOPK closest users
+FACE_ENGINE     = "svm"
+FACE_INDEX_TOPK = 10
 FRAME_SCALE    = 0.25
 
 RECORD_SEC     = 5
 VOICE_SAMPLE_RATE = 16000
 VOICE_MARGIN = 0.20
+VOICE_EMB_DIM = 256
+
+#on retry the modality that passed is kept this long and only the failed one is captured again
+RETRY_KEEP_SECS  = 10
+FACE_LOST_FRAMES = 5    # consecutive frames without a face before a kept face result is dropped
+
+#voice-only identification when no face has been recognized VOICE_ID_WAIT_MS after the voice sample:
+#the ANN index proposes VOICE_ID_CANDIDATES users from VOICE_ID_NPROBE lists, re-ranked by exact score;
+#the best user must have a computed voice threshold, clear it and beat the runner-up by VOICE_ID_MARGIN
+VOICE_FIRST_ID   = False
+VOICE_ID_WAIT_MS = 3000
+VOICE_ID_MARGIN  = 0.05
+VOICE_ID_NPROBE     = 8
+VOICE_ID_CANDIDATES = 5
+
+#storage format for new embedding rows: "float32", "float16" or "int8" (per-vector scaled)
+EMBEDDING_DTYPE = "float32"
+
+#enrollment keeps intermediate audio/images in memory, set PIPELINE_DEBUG_DUMP to also write them to the data dirs
+IN_MEMORY_PIPELINE  = True
+PIPELINE_DEBUG_DUMP = False
+
+#"gate": stationary spectral gate with a noise profile cached per (device, session)
+#"per_file": noisereduce on every file with its own first 0.5 s as noise
+DENOISE_MODE                  = "gate"
+NOISE_PROFILE_MAX_AGE         = 600   # seconds
+NOISE_PROFILE_MAX_MISMATCH_DB = 6.0   # mean abs difference of the noise spectra
+MIC_DEVICE                    = "default"
+
+#enrollment is queued in auth.db and trained in the background, the kiosk goes straight back to login
+#with ENROLL_WORKER_IN_APP=False a separate `python enroll_queue.py` process works off the queue
+ENROLL_IN_BACKGROUND = True
+ENROLL_WORKER_IN_APP = True
+ENROLL_STATUS_POLL_MS = 2000
+ENROLL_MAX_ATTEMPTS   = 3   # a job whose worker died this many times is marked failed instead of retried
+
+#thread budget per library (torch intra-op, OpenCV, BLAS) and process pool size, applied by resources.py
+#"interactive" while an authentication dialog is open, "background" while enrollment runs and nobody is
+#authenticating, "idle" otherwise (batch tools); a count <= 0 means "all cores but that many"
+THREAD_PROFILES = {
+    "idle":        {"torch": 0,  "cv2": 0,  "blas": 0,  "pool": 0},
+    "interactive": {"torch": -1, "cv2": 1,  "blas": 1,  "pool": 1},
+    "background":  {"torch": -1, "cv2": -1, "blas": -1, "pool": -1},
+}
+BACKGROUND_YIELD_SECS = 10   # longest an enrollment stage waits for a running authentication
+
+resources.setup(THREAD_PROFILES)
+
+#int8 dynamically quantized speaker encoder (CPU only), faster on kiosk CPUs
+#check the cosine to the float model with test/bench_quantized_encoder.py before enabling
+VOICE_ENCODER_QUANTIZED = False
+
+_encoder      = None
+_encoder_lock = threading.Lock()
+
 
-encoder = VoiceEncoder()
+def get_encoder():
+    #built on first use: pool workers import config for its paths and settings and never embed audio,
+    #they should not each load the model (plus a quantized copy)
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            import quantized_encoder
+            _encoder = quantized_encoder.load_encoder(VOICE_ENCODER_QUANTIZED)
+    return _encoder
 
 
@@ -0,0 +1,87 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+#a tiny dependency-graph scheduler: every stage is submitted as soon as all of its inputs exist,
+#independent branches run side by side on the executor
+
+
+class Stage:
+
+    def __init__(self, name, fn, deps=()):
+        #fn is called with the results of deps, in order; use top-level functions or
+        #functools.partial of them if the stages should run on a process pool
+        self.name = name
+        self.fn   = fn
+        self.deps = tuple(deps)
+
+
+class StageError(RuntimeError):
+
+    def __init__(self, stage, error):
+        super().__init__(f"stage '{stage}' failed: {error}")
+        self.stage = stage
+        self.error = error
+
+
+def _check(stages):
+    names = [s.name for s in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("duplicate stage names")
+    by_name = {s.name: s for s in stages}
+    for s in stages:
+        missing = [d for d in s.deps if d not in by_name]
+        if missing:
+            raise ValueError(f"stage '{s.name}' depends on unknown {missing}")
+
+    #kahn's algorithm, only to reject cycles before anything runs
+    indeg = {s.name: len(s.deps) for s in stages}
+    ready = [n for n, d in indeg.items() if d == 0]
+    seen  = 0
+    while ready:
+        n = ready.pop()
+        seen += 1
+        for s in stages:
+            if n in s.deps:
+                indeg[s.name] -= 1
+                if indeg[s.name] == 0:
+                    ready.append(s.name)
+    if seen != len(stages):
+        raise ValueError("stage graph has a cycle")
+    return by_name
+
+
+def run_dag(stages, executor=None, max_workers=None, verbose=True):
+    #returns {stage name: result}, raises StageError for the first stage that fails
+    by_name = _check(stages)
+    own     = executor is None
+    pool    = executor or ThreadPoolExecutor(max_workers=max_workers or len(stages))
+
+    results, running, started = {}, {}, {}
+    waiting = dict(by_name)
+    t0 = time.perf_counter()
+    try:
+        while waiting or running:
+            for name, s in list(waiting.items()):
+                if all(d in results for d in s.deps):
+                    del waiting[name]
+                    started[name] = time.perf_counter()
+                    running[pool.submit(s.fn, *(results[d] for d in s.deps))] = name
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = running.pop(fut)
+                try:
+                    results[name] = fut.result()
+                except Exception as e:
+                    for other in running:
+                        other.cancel()
+                    #let stages that already started finish before reporting
+                    wait(running)
+                    raise StageError(name, e) from e
+                if verbose:
+                    now = time.perf_counter()
+                    print(f"[DAG] {name} done in {now - started[name]:.2f}s (t={now - t0:.2f}s)")
+    finally:
+        if own:
+            pool.shutdown(wait=True)
+    return results
@@ -1,15 +1,16 @@
 import sqlite3
+import itertools
+import collections
 from pathlib import Path
 import numpy as np
+import time
 from datetime import datetime
+import embeddings
 
 DB_PATH = Path(__file__).parent / "auth.db"
 
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
+def _create_tables(cur):
     cur.execute("""
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -49,7 +50,129 @@ def init_db():
            )
        """)
 
+
+def _m1_embedding_indexes(conn):
+    #per-user lookups (get_audio_embeddings, delete_user_data) filter on user_id,
+    #is_augmented/orig_id are added so split and dedup queries are answered from the index
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_audio_embeddings_user
+            ON audio_embeddings(user_id, is_augmented, orig_id)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_face_embeddings_user
+            ON face_embeddings(user_id, is_augmented, orig_id)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_logs_username
+            ON logs(username, timestamp)
+    """)
+
+
+#layout of rows written before migration 2, as raw ndarray.tobytes()
+_LEGACY_DTYPES = {
+    "audio_embeddings": np.float32,
+    "face_embeddings":  np.float64,
+}
+
+
+def _is_valid_packed(blob) -> bool:
+    try:
+        embeddings.header(blob)
+        return True
+    except ValueError:
+        return False
+
+
+def _m2_packed_embeddings(conn):
+    #rewrite legacy rows in the self-describing format (float32, lossless for audio)
+    for table, legacy in _LEGACY_DTYPES.items():
+        updates = []
+        for rid, blob in conn.execute(f"SELECT id, embedding FROM {table}"):
+            if _is_valid_packed(blob):
+                continue
+            if len(blob) % np.dtype(legacy).itemsize:
+                print(f"[DB] {table} row {rid} has an unreadable embedding, left as is")
+                continue
+            vec = embeddings.from_legacy(blob, legacy)
+            updates.append((embeddings.pack(vec), rid))
+        conn.executemany(f"UPDATE {table} SET embedding = ? WHERE id = ?", updates)
+        print(f"[DB] converted {len(updates)} rows in {table}")
+
+
+def _m3_enroll_jobs(conn):
+    #enrollments are queued here and picked up by any worker sharing the db
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS enroll_jobs (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            username    TEXT    NOT NULL,
+            status      TEXT    NOT NULL DEFAULT 'queued',   -- queued | running | done | failed
+            attempts    INTEGER NOT NULL DEFAULT 0,
+            worker      TEXT,
+            error       TEXT,
+            created_at  REAL    NOT NULL,
+            updated_at  REAL    NOT NULL
+        )
+    """)
+    #at most one live job per username, also guards two kiosks picking the same new name
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_enroll_jobs_active
+            ON enroll_jobs(username) WHERE status IN ('queued', 'running')
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_enroll_jobs_status
+            ON enroll_jobs(status, id)
+    """)
+
+
+def _m4_template_sets(conn):
+    #condense_templates.py keeps a small representative set per user and modality, readers only see
+    #rows with in_template_set = 1; every existing and new row starts in the set
+    #idempotent like the other steps, a table that already has the column is left alone
+    for table in ("audio_embeddings", "face_embeddings"):
+        if any(col[1] == "in_template_set" for col in conn.execute(f"PRAGMA table_info({table})")):
+            continue
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN in_template_set INTEGER NOT NULL DEFAULT 1")
+
+
+#ordered schema migrations, PRAGMA user_version holds the last one applied
+#never edit or reorder a released step, append a new one instead
+MIGRATIONS = [
+    (1, _m1_embedding_indexes),
+    (2, _m2_packed_embeddings),
+    (3, _m3_enroll_jobs),
+    (4, _m4_template_sets),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    current = schema_version(conn)
+    for version, step in MIGRATIONS:
+        if version <= current:
+            continue
+        #each step and its version bump are committed together
+        conn.execute("BEGIN")
+        try:
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"[DB] migrated schema to version {version}")
+        current = version
+
+
+def init_db():
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    _create_tables(cur)
     conn.commit()
+    migrate(conn)
     conn.close()
 
 
@@ -114,6 +237,25 @@ def add_face_embedding(username, emb_blob, *, orig_id, is_augmented):
         """, (uid, orig_id, is_augmented, emb_blob))
         conn.commit()
 
+def add_user_embeddings(username: str, audio_rows, face_rows):
+    #rows are (orig_id, is_augmented, blob), all of a user's embeddings go in one transaction
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO users(username) VALUES(?)", (username,))
+            uid = conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()[0]
+            conn.executemany("""
+                INSERT INTO audio_embeddings (user_id, orig_id, is_augmented, embedding)
+                VALUES (?, ?, ?, ?)
+            """, [(uid, orig, aug, blob) for orig, aug, blob in audio_rows])
+            conn.executemany("""
+                INSERT INTO face_embeddings (user_id, orig_id, is_augmented, embedding)
+                VALUES (?, ?, ?, ?)
+            """, [(uid, orig, aug, blob) for orig, aug, blob in face_rows])
+    finally:
+        conn.close()
+
+
 def delete_user_data(username: str):
     with sqlite3.connect(DB_PATH) as conn:
         conn.execute("PRAGMA foreign_keys = ON")  # also delete related data
@@ -147,27 +289,60 @@ def log_attempt(username: str, method: str, ok: bool):
     con.close()
 
 
-def get_audio_embeddings(username: str, emb_dim: int = 256) -> list[np.ndarray]:
+def get_audio_embedding_blobs(username: str) -> list[bytes]:
     conn = sqlite3.connect(DB_PATH)
     cur  = conn.cursor()
     cur.execute("""
         SELECT a.embedding 
           FROM audio_embeddings a
           JOIN users u ON u.id = a.user_id
-         WHERE u.username = ?
+         WHERE u.username = ? AND a.in_template_set = 1
     """, (username,))
+    out = [bytes(blob) for (blob,) in cur.fetchall()]
+    conn.close()
+    return out
+
+
+def get_face_embedding_blobs(username: str) -> list[bytes]:
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute("""
+        SELECT f.embedding
+          FROM face_embeddings f
+          JOIN users u ON u.id = f.user_id
+         WHERE u.username = ? AND f.in_template_set = 1
+    """, (username,)).fetchall()
+    conn.close()
+    return [bytes(blob) for (blob,) in rows]
+
+
+def get_audio_embeddings(username: str, emb_dim: int = 256) -> list[np.ndarray]:
     out = []
-    for (blob,) in cur.fetchall():
-        if isinstance(blob, memoryview):  # sometimes blobs are returned as memory view
-            blob = blob.tobytes()
-        if len(blob) != emb_dim * 4:
+    for blob in get_audio_embedding_blobs(username):
+        try:
+            _, dim, _, _ = embeddings.header(blob)
+        except ValueError as e:
+            print(f"[DB] skipping audio embedding for {username}: {e}")
             continue
-        vec = np.frombuffer(blob, dtype=np.float32)
-        out.append(vec)
-    conn.close()
+        if dim != emb_dim:
+            continue
+        out.append(embeddings.unpack(blob))
     return out
 
 
+def get_all_audio_blobs():
+    #(username, blob) for every user, grouped by user
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute("""
+        SELECT u.username, a.embedding
+          FROM audio_embeddings a
+          JOIN users u ON u.id = a.user_id
+         WHERE a.in_template_set = 1
+         ORDER BY a.user_id
+    """).fetchall()
+    conn.close()
+    return [(name, bytes(blob)) for name, blob in rows]
+
+
 def get_all_face_rows():
     conn = sqlite3.connect(DB_PATH)
     rows = conn.execute(
@@ -179,12 +354,117 @@ def get_all_face_rows():
                f.embedding
           FROM face_embeddings f
           JOIN users u ON u.id = f.user_id
+         WHERE f.in_template_set = 1
         """
     ).fetchall()
     conn.close()
     return rows
 
 
+EMBEDDING_TABLES = ("audio_embeddings", "face_embeddings")
+
+#one embedding table as arrays: X[i] belongs to users[user_idx[i]], snapshot origs[orig_codes[i]];
+#scanned and last_id count every row read, including the undecodable ones left out of X
+Columns = collections.namedtuple("Columns", "ids X user_idx users orig_codes origs augmented scanned last_id")
+
+
+def load_embedding_columns(table: str, dim: int, after_id: int = 0, chunk: int = 4096,
+                           template_set_only: bool = True) -> Columns:
+    #streams the rows with id > after_id batch by batch into preallocated arrays, nothing is kept per row
+    if table not in EMBEDDING_TABLES:
+        raise ValueError(f"Unknown embedding table '{table}'")
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("BEGIN")   # count and rows from the same snapshot
+    query = f"FROM {table} e JOIN users u ON u.id = e.user_id WHERE e.id > ?"
+    if template_set_only:
+        query += " AND e.in_template_set = 1"
+    total = conn.execute(f"SELECT COUNT(*) {query}", (after_id,)).fetchone()[0]
+    cur = conn.execute(f"SELECT e.id, u.username, e.orig_id, e.is_augmented, e.embedding {query} ORDER BY e.id",
+                       (after_id,))
+
+    ids        = np.empty(total, np.int64)
+    X          = np.empty((total, dim), np.float32)
+    user_idx   = np.empty(total, np.int32)
+    orig_codes = np.empty(total, np.int32)
+    augmented  = np.empty(total, bool)
+    users, origs = {}, {}
+    n = scanned = 0
+    last_id = after_id
+    while rows := cur.fetchmany(chunk):
+        scanned += len(rows)
+        last_id  = rows[-1][0]
+        block, ok = embeddings.unpack_many([r[4] for r in rows], dim)
+        k = int(ok.sum())
+        keep = list(itertools.compress(rows, ok))
+        X[n:n + k]          = block[ok]
+        ids[n:n + k]        = [r[0] for r in keep]
+        user_idx[n:n + k]   = [users.setdefault(r[1], len(users)) for r in keep]
+        orig_codes[n:n + k] = [origs.setdefault(r[2], len(origs)) for r in keep]
+        augmented[n:n + k]  = [bool(r[3]) for r in keep]
+        n += k
+    conn.close()
+    return Columns(ids[:n], X[:n], user_idx[:n], list(users), orig_codes[:n], list(origs), augmented[:n],
+                   scanned, last_id)
+
+
+def count_embedding_rows(table: str, upto_id: int) -> int:
+    #template rows with id <= upto_id, a cache built up to that id is stale when this changes
+    #(rows were deleted or the template sets were condensed again)
+    if table not in EMBEDDING_TABLES:
+        raise ValueError(f"Unknown embedding table '{table}'")
+    conn = sqlite3.connect(DB_PATH)
+    n = conn.execute(f"SELECT COUNT(*) FROM {table} e JOIN users u ON u.id = e.user_id "
+                     f"WHERE e.id <= ? AND e.in_template_set = 1", (upto_id,)).fetchone()[0]
+    conn.close()
+    return n
+
+
+CENTROID_ORIG_ID = "centroid"   # orig_id of the mean-template row condense_templates.py may add per user
+
+
+def get_user_embedding_rows(table: str, username: str):
+    #(id, orig_id, is_augmented, blob) for all of a user's stored rows, in the template set or not,
+    #centroid rows excluded
+    if table not in EMBEDDING_TABLES:
+        raise ValueError(f"Unknown embedding table '{table}'")
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute(f"""
+        SELECT e.id, e.orig_id, e.is_augmented, e.embedding
+          FROM {table} e
+          JOIN users u ON u.id = e.user_id
+         WHERE u.username = ? AND e.orig_id != ?
+         ORDER BY e.id
+    """, (username, CENTROID_ORIG_ID)).fetchall()
+    conn.close()
+    return rows
+
+
+def set_template_sets(table: str, keep_ids, centroids=(), usernames=None):
+    #one transaction: rows in keep_ids form the template set, every other row stays stored but hidden
+    #from the readers; old centroid rows are replaced by centroids, (username, blob) pairs
+    #usernames limits the change to those users, None re-condenses the whole table
+    if table not in EMBEDDING_TABLES:
+        raise ValueError(f"Unknown embedding table '{table}'")
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        with conn:
+            if usernames is None:
+                conn.execute(f"DELETE FROM {table} WHERE orig_id = ?", (CENTROID_ORIG_ID,))
+                conn.execute(f"UPDATE {table} SET in_template_set = 0")
+            else:
+                uids = [(name,) for name in usernames]
+                conn.executemany(f"DELETE FROM {table} WHERE orig_id = '{CENTROID_ORIG_ID}' AND "
+                                 f"user_id = (SELECT id FROM users WHERE username = ?)", uids)
+                conn.executemany(f"UPDATE {table} SET in_template_set = 0 "
+                                 f"WHERE user_id = (SELECT id FROM users WHERE username = ?)", uids)
+            conn.executemany(f"UPDATE {table} SET in_template_set = 1 WHERE id = ?", ((int(i),) for i in keep_ids))
+            conn.executemany(f"INSERT INTO {table}(user_id, orig_id, is_augmented, embedding, in_template_set) "
+                             f"SELECT id, '{CENTROID_ORIG_ID}', 1, ?, 1 FROM users WHERE username = ?",
+                             ((blob, name) for name, blob in centroids))
+    finally:
+        conn.close()
+
+
 def get_all_usernames() -> list[str]:
     conn = sqlite3.connect(DB_PATH)
     cur  = conn.cursor()
@@ -192,3 +472,94 @@ def get_all_usernames() -> list[str]:
     rows = cur.fetchall()
     conn.close()
     return [r[0] for r in rows]
+
+
+def submit_enroll_job(username: str) -> int:
+    #raises sqlite3.IntegrityError when the user already has a queued or running job
+    now = time.time()
+    with sqlite3.connect(DB_PATH) as conn:
+        cur = conn.execute(
+            "INSERT INTO enroll_jobs(username, created_at, updated_at) VALUES (?, ?, ?)",
+            (username, now, now)
+        )
+        return cur.lastrowid
+
+
+def claim_enroll_job(worker: str, include_orphans: bool = False):
+    #atomically moves the oldest queued job to running and returns (id, username, attempts), or None
+    #include_orphans also takes over jobs left running by a dead worker, only pass it while
+    #holding the models/ lock (a live worker always holds it)
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, timeout=30)
+    try:
+        #IMMEDIATE takes the write lock up front, two workers can never claim the same row
+        conn.execute("BEGIN IMMEDIATE")
+        now = time.time()
+        where = "status IN ('queued', 'running')" if include_orphans else "status = 'queued'"
+        row = conn.execute(f"""
+            SELECT id, username, attempts FROM enroll_jobs
+             WHERE {where} ORDER BY id LIMIT 1
+        """).fetchone()
+        if row:
+            conn.execute("""
+                UPDATE enroll_jobs SET status = 'running', worker = ?, attempts = attempts + 1,
+                       updated_at = ? WHERE id = ?
+            """, (worker, now, row[0]))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    if not row:
+        return None
+    return row[0], row[1], row[2] + 1
+
+
+def fail_orphaned_enroll_jobs(max_attempts: int):
+    #jobs left running by a dead worker that already used max_attempts are marked failed instead of
+    #being claimed again, returns their [(id, username)]; same locking rule as include_orphans above
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, timeout=30)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(
+            "SELECT id, username, attempts FROM enroll_jobs WHERE status = 'running' AND attempts >= ?",
+            (max_attempts,)
+        ).fetchall()
+        for job_id, _, attempts in rows:
+            conn.execute(
+                "UPDATE enroll_jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                (f"worker died on all {attempts} attempts", time.time(), job_id)
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return [(job_id, username) for job_id, username, _ in rows]
+
+
+def finish_enroll_job(job_id: int, ok: bool, error: str = None):
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.execute(
+            "UPDATE enroll_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            ("done" if ok else "failed", error, time.time(), job_id)
+        )
+
+
+def get_enroll_job(job_id: int):
+    #(status, error) or None
+    conn = sqlite3.connect(DB_PATH)
+    row = conn.execute("SELECT status, error FROM enroll_jobs WHERE id = ?", (job_id,)).fetchone()
+    conn.close()
+    return row
+
+
+def enroll_pending(username: str) -> bool:
+    conn = sqlite3.connect(DB_PATH)
+    row = conn.execute(
+        "SELECT 1 FROM enroll_jobs WHERE username = ? AND status IN ('queued', 'running')",
+        (username,)
+    ).fetchone()
+    conn.close()
+    return row is not None
@@ -1,35 +1,132 @@
 import os
 import sys
+import time
 from glob import glob
 import noisereduce as nr
 import soundfile as sf
 import librosa
 import numpy as np
+from scipy.ndimage import uniform_filter
 import config
 RAW_DIR   = config.RAW_VOICE_DIR
 CLEAN_DIR = config.CLEAN_VOICE_DIR
 SR        = config.VOICE_SAMPLE_RATE
 
+NOISE_SECS   = 0.5
+N_FFT        = 512
+HOP          = 128
+N_STD_THRESH = 1.5
+MAX_AGE      = config.NOISE_PROFILE_MAX_AGE
+MAX_MISMATCH = config.NOISE_PROFILE_MAX_MISMATCH_DB
+
+#noise profiles per (device, session), recordings from the same mic in one session share a noise floor
+_profiles = {}
+
 #we can process one speaker or all
 speaker = sys.argv[1] if len(sys.argv) > 1 else None
 
-def denoise_file(in_path, out_path):
-    #audio data, sample rate
-    y, sr = sf.read(in_path)
+def _to_mono_sr(y, sr):
+    #convert stereo to mono if necessary
+    if y.ndim > 1:
+        y = np.mean(y, axis=1)
     #resample if the sampling rate is not 16000
     if sr != SR:
         y = librosa.resample(y, orig_sr=sr, target_sr=SR)
-        sr = SR
+    return y, SR
 
-    #convert stereo to mono if necessary
-    if y.ndim > 1:
-        y = np.mean(y, axis=1)
 
+def _denoise_per_file(y, sr):
     #use the first 0.5 seconds of the audio as noise
-    noise_clip = y[: int(0.5 * sr)]
-
+    noise_clip = y[: int(NOISE_SECS * sr)]
     #denoise audio
-    reduced = nr.reduce_noise(y=y, sr=sr, y_noise=noise_clip)
+    return nr.reduce_noise(y=y, sr=sr, y_noise=noise_clip)
+
+
+def _stft_db(y):
+    S  = librosa.stft(y, n_fft=N_FFT, hop_length=HOP)
+    db = librosa.amplitude_to_db(np.abs(S), ref=1.0, amin=1e-10, top_db=None)
+    return S, db
+
+
+def estimate_profile(noise_clip):
+    _, db = _stft_db(noise_clip)
+    mean = db.mean(axis=-1)
+    return {
+        "mean_db":   mean,
+        "thresh_db": mean + N_STD_THRESH * db.std(axis=-1),
+        "created":   time.monotonic(),
+    }
+
+
+def session_profile(key, y, sr):
+    #returns the cached profile for key, or None when this file should be denoised on its own
+    fresh = estimate_profile(y[: int(NOISE_SECS * sr)])
+    prof  = _profiles.get(key)
+    if prof is None:
+        _profiles[key] = fresh
+        return fresh
+
+    age      = time.monotonic() - prof["created"]
+    mismatch = float(np.mean(np.abs(fresh["mean_db"] - prof["mean_db"])))
+    if age > MAX_AGE or mismatch > MAX_MISMATCH:
+        print(f"[Denoise] profile for {key} is stale (age={age:.0f}s, mismatch={mismatch:.1f}dB), "
+              f"falling back to per-file mode")
+        _profiles[key] = fresh
+        return None
+    return prof
+
+
+def spectral_gate(ys, thresh_db):
+    #ys is (n,) or a batch (b, n) of equal-length clips, gated in a single stft/istft pass
+    S, db = _stft_db(ys)
+    mask = (db > thresh_db[:, None]).astype(np.float32)
+    #smooth the mask over neighbouring bins and frames to avoid musical noise
+    mask = uniform_filter(mask, size=(1,) * (mask.ndim - 2) + (3, 5))
+    return librosa.istft(S * mask, n_fft=N_FFT, hop_length=HOP, length=ys.shape[-1])
+
+
+def clear_profiles():
+    _profiles.clear()
+
+
+def denoise_array(y, sr, noise_key=None):
+    #noise_key=(device, session) enables the cached-profile spectral gate
+    y, sr = _to_mono_sr(y, sr)
+    if noise_key is None or config.DENOISE_MODE != "gate":
+        return _denoise_per_file(y, sr), sr
+
+    prof = session_profile(noise_key, y, sr)
+    if prof is None:
+        return _denoise_per_file(y, sr), sr
+    return spectral_gate(y.astype(np.float32), prof["thresh_db"]), sr
+
+
+def denoise_batch(clips, noise_key=None):
+    #clips is a list of (y, sr), clips of equal length share one gating pass
+    prepared = [_to_mono_sr(y, sr)[0].astype(np.float32) for y, sr in clips]
+    if noise_key is None or config.DENOISE_MODE != "gate":
+        return [_denoise_per_file(y, SR) for y in prepared]
+
+    out    = [None] * len(prepared)
+    groups = {}
+    for i, y in enumerate(prepared):
+        prof = session_profile(noise_key, y, SR)
+        if prof is None:
+            out[i] = _denoise_per_file(y, SR)
+        else:
+            groups.setdefault((len(y), id(prof)), (prof, []))[1].append(i)
+
+    for prof, idxs in groups.values():
+        gated = spectral_gate(np.stack([prepared[i] for i in idxs]), prof["thresh_db"])
+        for i, g in zip(idxs, gated):
+            out[i] = g
+    return out
+
+
+def denoise_file(in_path, out_path):
+    #audio data, sample rate
+    y, sr = sf.read(in_path)
+    reduced, sr = denoise_array(y, sr)
 
     #create directories if they dont exist already
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
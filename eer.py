@@ -0,0 +1,100 @@
+import numpy as np
+
+#equal-error-rate estimation in bounded memory: genuine and impostor scores go into fixed-resolution
+#histograms chunk by chunk instead of lists, histograms from different users/processes just add up
+#thresholds are bin edges, so the threshold is exact to within one bin width and the EER to within
+#the score mass of the bin where FAR and FRR cross (see test/bench_streaming_eer.py)
+
+
+class ScoreHistogram:
+
+    def __init__(self, lo=-1.0, hi=1.0, bins=2000):
+        self.lo, self.hi, self.bins = float(lo), float(hi), int(bins)
+        self.genuine  = np.zeros(self.bins, np.int64)
+        self.impostor = np.zeros(self.bins, np.int64)
+
+    @classmethod
+    def from_counts(cls, genuine, impostor, lo=-1.0, hi=1.0):
+        #wraps counts accumulated elsewhere, e.g. one row of a (users, bins) block
+        h = cls(lo, hi, len(genuine))
+        h.genuine  += np.asarray(genuine, np.int64)
+        h.impostor += np.asarray(impostor, np.int64)
+        return h
+
+    def bin_index(self, scores):
+        #bin of every score, same shape as scores; out-of-range scores land in the edge bins
+        s = np.asarray(scores, dtype=np.float64)
+        idx = np.floor((s - self.lo) * (self.bins / (self.hi - self.lo)))
+        return np.clip(np.nan_to_num(idx, nan=0), 0, self.bins - 1).astype(np.int64)
+
+    def _bin(self, scores):
+        s = np.asarray(scores, dtype=np.float64).ravel()
+        return np.bincount(self.bin_index(s[np.isfinite(s)]), minlength=self.bins)
+
+    def add(self, genuine=(), impostor=()):
+        if len(genuine):
+            self.genuine += self._bin(genuine)
+        if len(impostor):
+            self.impostor += self._bin(impostor)
+        return self
+
+    def merge(self, other):
+        if (other.lo, other.hi, other.bins) != (self.lo, self.hi, self.bins):
+            raise ValueError("Cannot merge histograms with different bins")
+        self.genuine  += other.genuine
+        self.impostor += other.impostor
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    @property
+    def edges(self):
+        return np.linspace(self.lo, self.hi, self.bins + 1)
+
+    def counts(self):
+        return int(self.genuine.sum()), int(self.impostor.sum())
+
+    def eer(self):
+        #returns (eer, threshold) for the rule "accept when score >= threshold"
+        n_gen, n_imp = self.counts()
+        if not n_gen or not n_imp:
+            raise ValueError("EER needs both genuine and impostor scores")
+        eer, thr = eer_from_counts(self.genuine[None], self.impostor[None], self.edges)
+        return float(eer[0]), float(thr[0])
+
+
+def eer_from_counts(genuine, impostor, edges):
+    #(eer, threshold) for every row of (rows, bins) genuine/impostor counts, nan where a row has no scores
+    genuine, impostor = np.atleast_2d(genuine), np.atleast_2d(impostor)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        #at edge k: FRR = genuine below it, FAR = impostors at or above it
+        zero = np.zeros((len(genuine), 1))
+        frr = np.hstack([zero, np.cumsum(genuine, axis=1)]) / genuine.sum(1, keepdims=True)
+        far = 1.0 - np.hstack([zero, np.cumsum(impostor, axis=1)]) / impostor.sum(1, keepdims=True)
+    gap = np.where(np.isnan(far - frr), np.inf, np.abs(far - frr))
+    #ties (e.g. a gap between perfectly separated scores) go to the highest threshold, like roc_curve
+    k = gap.shape[1] - 1 - np.argmin(gap[:, ::-1], axis=1)
+    rows = np.arange(len(k))
+    eer = (far[rows, k] + frr[rows, k]) / 2
+    thr = np.where(np.isnan(eer), np.nan, np.asarray(edges)[k])
+    return eer, thr
+
+
+def column_thresholds(scores, truth, lo=0.0, hi=1.0, bins=1000, chunk=256):
+    #one-vs-rest (eer, threshold) per column of an (n, classes) score matrix such as predict_proba,
+    #truth[i] is the true column of row i; columns are histogrammed chunk by chunk
+    scores = np.asarray(scores)
+    truth  = np.asarray(truth)
+    h = ScoreHistogram(lo, hi, bins)
+    eer = np.full(scores.shape[1], np.nan)
+    thr = np.full(scores.shape[1], np.nan)
+    for c0 in range(0, scores.shape[1], chunk):
+        block = scores[:, c0:c0 + chunk]
+        n = block.shape[1]
+        idx = h.bin_index(block) + np.arange(n)[None, :] * bins
+        own = truth[:, None] == np.arange(c0, c0 + n)[None, :]
+        gen = np.bincount(idx[own], minlength=n * bins).reshape(n, bins)
+        imp = np.bincount(idx[~own], minlength=n * bins).reshape(n, bins)
+        eer[c0:c0 + n], thr[c0:c0 + n] = eer_from_counts(gen, imp, h.edges)
+    return eer, thr
@@ -0,0 +1,129 @@
+import os
+from pathlib import Path
+import numpy as np
+
+import db
+import config
+
+#on-disk copy of an embedding table for training and threshold jobs: the embeddings live in a .npy file
+#that is memory-mapped on load, the other columns in a small .npz next to it
+#warm runs with an untouched database file never open SQLite; when rows were only added they are read
+#(id > last cached id) and appended to the .npy in place; a delete anywhere triggers a full rebuild
+#the .npy header is written with a fixed size so the row count can be rewritten without moving the data
+
+HEADER_LEN = 128
+
+
+def _npy_header(n, dim):
+    #a standard version 1.0 .npy header padded to HEADER_LEN bytes
+    d = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (n, dim)
+    body = d.encode("latin1").ljust(HEADER_LEN - 10 - 1) + b"\n"
+    return b"\x93NUMPY\x01\x00" + len(body).to_bytes(2, "little") + body
+
+
+class EmbeddingCache:
+
+    def __init__(self, table, dim, directory=None):
+        self.table, self.dim = table, dim
+        self.dir       = Path(directory or config.EMB_CACHE_DIR)
+        self.x_file    = self.dir / f"{table}.npy"
+        self.meta_file = self.dir / f"{table}.meta.npz"
+
+    def load(self) -> db.Columns:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        meta  = self._read_meta()
+        where = str(Path(db.DB_PATH).resolve())
+        #taken before any query, rows written meanwhile are picked up on the next run
+        mtime = os.stat(db.DB_PATH).st_mtime_ns
+        if meta is None or meta["db"] != where or meta["dim"] != self.dim:
+            return self._rebuild(where, mtime)
+        if meta["mtime"] == mtime:
+            return self._columns(meta)
+        if db.count_embedding_rows(self.table, meta["last_id"]) != meta["scanned"]:
+            print(f"[Cache] rows were deleted from {self.table}, rebuilding")
+            return self._rebuild(where, mtime)
+
+        new = db.load_embedding_columns(self.table, self.dim, after_id=meta["last_id"])
+        if new.scanned:
+            self._append(meta, new)
+            print(f"[Cache] appended {len(new.X)} rows to {self.table}, {meta['n']} cached")
+        meta["mtime"] = mtime
+        self._write_meta(meta)
+        return self._columns(meta)
+
+    def clear(self):
+        #forces a rebuild on the next load, for changes the row count check cannot see
+        for f in (self.meta_file, self.x_file):
+            f.unlink(missing_ok=True)
+
+    def _read_meta(self):
+        if not (self.meta_file.exists() and self.x_file.exists()):
+            return None
+        try:
+            with np.load(self.meta_file) as m:
+                meta = {k: m[k] for k in m.files}
+        except (OSError, ValueError):
+            return None
+        for k in ("dim", "mtime", "last_id", "scanned", "n"):
+            meta[k] = int(meta[k])
+        meta["db"]    = str(meta["db"])
+        meta["users"] = list(meta["users"])
+        meta["origs"] = list(meta["origs"])
+        return meta
+
+    def _write_meta(self, meta):
+        tmp = self.meta_file.with_name(self.meta_file.stem + ".tmp.npz")
+        np.savez(tmp, **{k: (np.array(v, str) if k in ("users", "origs") else v) for k, v in meta.items()})
+        os.replace(tmp, self.meta_file)
+
+    def _rebuild(self, where, mtime):
+        cols = db.load_embedding_columns(self.table, self.dim)
+        tmp = self.x_file.with_name(self.x_file.stem + ".tmp.npy")
+        with open(tmp, "wb") as f:
+            f.write(_npy_header(len(cols.X), self.dim))
+            f.write(np.ascontiguousarray(cols.X, "<f4").tobytes())
+        os.replace(tmp, self.x_file)
+        meta = {
+            "db": where, "dim": self.dim, "mtime": mtime, "scanned": cols.scanned, "n": len(cols.X),
+            "last_id": cols.last_id,
+            "ids": cols.ids, "user_idx": cols.user_idx, "users": cols.users,
+            "orig_codes": cols.orig_codes, "origs": cols.origs, "augmented": cols.augmented,
+        }
+        self._write_meta(meta)
+        print(f"[Cache] built {self.table}: {meta['n']} rows, {len(cols.users)} users")
+        return self._columns(meta)
+
+    def _append(self, meta, new):
+        #embeddings first, then the header, then the metadata; a crash in between leaves rows past
+        #meta["n"] that are never read and are overwritten by the next append
+        with open(self.x_file, "r+b") as f:
+            f.seek(HEADER_LEN + meta["n"] * self.dim * 4)
+            f.write(np.ascontiguousarray(new.X, "<f4").tobytes())
+            f.truncate()
+            f.seek(0)
+            f.write(_npy_header(meta["n"] + len(new.X), self.dim))
+
+        users = {u: i for i, u in enumerate(meta["users"])}
+        origs = {o: i for i, o in enumerate(meta["origs"])}
+        user_map = np.array([users.setdefault(u, len(users)) for u in new.users], np.int32)
+        orig_map = np.array([origs.setdefault(o, len(origs)) for o in new.origs], np.int32)
+        meta["users"], meta["origs"] = list(users), list(origs)
+        meta["ids"]        = np.concatenate([meta["ids"], new.ids])
+        meta["user_idx"]   = np.concatenate([meta["user_idx"], user_map[new.user_idx]]).astype(np.int32)
+        meta["orig_codes"] = np.concatenate([meta["orig_codes"], orig_map[new.orig_codes]]).astype(np.int32)
+        meta["augmented"]  = np.concatenate([meta["augmented"], new.augmented])
+        meta["n"]       += len(new.X)
+        meta["scanned"] += new.scanned
+        meta["last_id"]  = new.last_id
+
+    def _columns(self, meta):
+        X = np.load(self.x_file, mmap_mode="r")[:meta["n"]]
+        return db.Columns(meta["ids"], X, meta["user_idx"], meta["users"], meta["orig_codes"], meta["origs"],
+                          meta["augmented"], meta["scanned"], meta["last_id"])
+
+
+def load_columns(table, dim, use_cache=True):
+    #the table as db.Columns, through the cache unless use_cache is False
+    if use_cache:
+        return EmbeddingCache(table, dim).load()
+    return db.load_embedding_columns(table, dim)
@@ -0,0 +1,164 @@
+import struct
+import numpy as np
+
+#every stored embedding blob starts with a small header so readers never have to guess
+#magic (1B) | dtype code (1B) | dim (2B) | L2 norm of the original vector (f4) | scale (f4)
+MAGIC   = 0xE5
+_HEADER = struct.Struct("<BBHff")
+HEADER_SIZE = _HEADER.size
+
+#name -> (code, storage dtype)
+DTYPES = {
+    "float32": (1, np.float32),
+    "float16": (2, np.float16),
+    "int8":    (3, np.int8),    #per-vector scale, value = code * scale
+}
+_BY_CODE = {code: (name, dt) for name, (code, dt) in DTYPES.items()}
+
+
+def is_packed(blob) -> bool:
+    return len(blob) >= HEADER_SIZE and blob[0] == MAGIC and blob[1] in _BY_CODE
+
+
+def pack(vec: np.ndarray, dtype: str = "float32") -> bytes:
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported embedding dtype '{dtype}'")
+    code, dt = DTYPES[dtype]
+    v = np.asarray(vec, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(v))
+    if dtype == "int8":
+        peak  = float(np.max(np.abs(v))) if v.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        payload = np.clip(np.rint(v / scale), -127, 127).astype(np.int8)
+    else:
+        scale = 1.0
+        payload = v.astype(dt)
+    return _HEADER.pack(MAGIC, code, v.size, norm, scale) + payload.tobytes()
+
+
+def header(blob):
+    if isinstance(blob, memoryview):
+        blob = blob.tobytes()
+    if not is_packed(blob):
+        raise ValueError("Not a packed embedding blob")
+    _, code, dim, norm, scale = _HEADER.unpack_from(blob)
+    name, dt = _BY_CODE[code]
+    if len(blob) != HEADER_SIZE + dim * np.dtype(dt).itemsize:
+        raise ValueError(f"Truncated {name} embedding: {len(blob)} bytes for dim {dim}")
+    return name, dim, norm, scale
+
+
+def codes(blob) -> np.ndarray:
+    #the stored (compact) values, without dequantizing
+    name, dim, _, _ = header(blob)
+    return np.frombuffer(blob, dtype=DTYPES[name][1], count=dim, offset=HEADER_SIZE)
+
+
+def unpack(blob) -> np.ndarray:
+    if isinstance(blob, memoryview):
+        blob = blob.tobytes()
+    name, _, _, scale = header(blob)
+    v = codes(blob).astype(np.float32)
+    if name == "int8":
+        v *= scale
+    return v
+
+
+def unpack_many(blobs, dim: int):
+    #(float32 matrix (len(blobs), dim), mask of usable rows) for a batch of blobs; float32 rows of that dim,
+    #the common case, are decoded by one frombuffer over the joined blobs, anything else row by row
+    out  = np.zeros((len(blobs), dim), np.float32)
+    ok   = np.zeros(len(blobs), bool)
+    size = HEADER_SIZE + dim * 4
+    lead = _HEADER.pack(MAGIC, DTYPES["float32"][0], dim, 0.0, 0.0)[:4]
+    fast = [i for i, b in enumerate(blobs) if len(b) == size and b[:4] == lead]
+    if fast:
+        rows = np.dtype([("head", f"V{HEADER_SIZE}"), ("vec", "<f4", (dim,))])
+        out[fast] = np.frombuffer(b"".join(blobs[i] for i in fast), rows)["vec"]
+        ok[fast] = True
+    for i in np.flatnonzero(~ok):
+        try:
+            if header(blobs[i])[1] == dim:
+                out[i], ok[i] = unpack(blobs[i]), True
+        except ValueError:
+            pass
+    ok &= np.isfinite(out).all(axis=1)
+    return out, ok
+
+
+def from_legacy(blob, legacy_dtype) -> np.ndarray:
+    #rows written before the header existed were raw ndarray.tobytes()
+    if isinstance(blob, memoryview):
+        blob = blob.tobytes()
+    return np.frombuffer(blob, dtype=legacy_dtype)
+
+
+def stack(blobs, dim: int = None):
+    #bulk load into the compact form: (codes matrix, per-row scales, per-row norms)
+    #rows of a different dim are skipped, mixed dtypes are widened to float32
+    rows, scales, norms, kinds = [], [], [], set()
+    for blob in blobs:
+        if isinstance(blob, memoryview):
+            blob = blob.tobytes()
+        name, d, norm, scale = header(blob)
+        if dim is not None and d != dim:
+            continue
+        kinds.add(name)
+        rows.append(blob)
+        scales.append(scale)
+        norms.append(norm)
+
+    if not rows:
+        width = dim or 0
+        return (np.empty((0, width), np.float32),
+                np.empty(0, np.float32), np.empty(0, np.float32))
+
+    if len(kinds) == 1:
+        mat = np.stack([codes(b) for b in rows])
+    else:
+        mat = np.stack([unpack(b) for b in rows])
+        scales = [1.0] * len(rows)
+    return mat, np.asarray(scales, np.float32), np.asarray(norms, np.float32)
+
+
+def cosine_sims(query: np.ndarray, bank) -> np.ndarray:
+    #cosine similarity of one query against a stacked bank, computed on the stored codes:
+    #dot(q, code * scale) / (|q| * |v|) with the norm taken from the header
+    mat, scales, norms = bank
+    q = np.asarray(query, dtype=np.float32).ravel()
+    qn = float(np.linalg.norm(q))
+    if mat.shape[0] == 0 or not np.isfinite(qn) or qn == 0:
+        return np.empty(0, np.float32)
+    dots = mat.astype(np.float32, copy=False) @ q
+    denom = np.maximum(norms * qn, 1e-12)
+    return dots * scales / denom
+
+
+def labeled_stack(rows, dim: int):
+    #rows of (label, blob) -> (bank, starts, labels), each label's rows are contiguous in the bank
+    #and begin at starts[i], rows of another dim or with a broken header are left out
+    groups = {}
+    for label, blob in rows:
+        if isinstance(blob, memoryview):
+            blob = blob.tobytes()
+        try:
+            _, d, _, _ = header(blob)
+        except ValueError:
+            continue
+        if d == dim:
+            groups.setdefault(label, []).append(blob)
+    labels = list(groups)
+    sizes  = [len(groups[l]) for l in labels]
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64) if labels else np.empty(0, np.int64)
+    bank   = stack([b for l in labels for b in groups[l]], dim=dim)
+    return bank, starts, labels
+
+
+def best_per_label(sims: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    #max similarity within each contiguous label group, one reduceat over the whole bank
+    if not starts.size:
+        return np.empty(0, np.float32)
+    if not sims.size:
+        #silent or broken query (cosine_sims gave nothing): every label at the lowest similarity
+        return np.full(len(starts), -1.0, np.float32)
+    return np.maximum.reduceat(sims, starts)
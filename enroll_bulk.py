@@ -0,0 +1,121 @@
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import db
+import model_files
+import pipeline
+import resources
+import voice_index
+
+#headless bulk enrollment from an existing dataset laid out as <root>/<username>/*.wav and *.jpg
+#each user is embedded on a worker process and written by the parent in a single transaction,
+#finished users are appended to a checkpoint file so an interrupted run resumes where it stopped
+
+CHECKPOINT_NAME = ".enroll_bulk_checkpoint.jsonl"
+
+
+def load_checkpoint(path: Path) -> dict:
+    state = {}
+    if path.exists():
+        for line in path.read_text().splitlines():
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  #a torn last line from a crash
+            state[rec["user"]] = rec
+    return state
+
+
+def append_checkpoint(path: Path, rec: dict):
+    with open(path, "a") as f:
+        f.write(json.dumps(rec) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _embed(username, root):
+    audio_rows, face_rows, rejected = pipeline.embed_user(username, raw_voice_root=root, raw_face_root=root)
+    return username, audio_rows, face_rows, rejected
+
+
+def enroll_bulk(root: Path, users=None, workers=None, checkpoint: Path = None,
+                retry_failed=False, train=True):
+    checkpoint = checkpoint or root / CHECKPOINT_NAME
+    state = load_checkpoint(checkpoint)
+    if users is None:
+        users = sorted(p.name for p in root.iterdir() if p.is_dir())
+
+    todo = []
+    for u in users:
+        rec = state.get(u)
+        if rec and (rec["status"] == "done" or (rec["status"] == "failed" and not retry_failed)):
+            continue
+        #committed but not checkpointed (crash between the two), or enrolled some other way
+        if db.user_exists(u):
+            append_checkpoint(checkpoint, {"user": u, "status": "done", "note": "already in db"})
+            continue
+        todo.append(u)
+    print(f"[Bulk] {len(users)} users, {len(todo)} to enroll, {len(users) - len(todo)} done or skipped")
+
+    enrolled, failed = 0, 0
+    workers  = resources.pool_size(workers)
+    window   = workers * 2   #bound the embeddings held in memory
+    pending  = {}
+    queue    = list(reversed(todo))
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=resources.init_worker) as pool:
+        while queue or pending:
+            while queue and len(pending) < window:
+                u = queue.pop()
+                pending[pool.submit(_embed, u, root)] = u
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                u = pending.pop(fut)
+                try:
+                    _, audio_rows, face_rows, rejected = fut.result()
+                    if not audio_rows or not face_rows:
+                        raise RuntimeError(f"{len(audio_rows)} voice / {len(face_rows)} face embeddings")
+                    db.add_user_embeddings(u, audio_rows, face_rows)
+                except Exception as e:
+                    failed += 1
+                    print(f"[Bulk] {u} failed: {e}")
+                    append_checkpoint(checkpoint, {"user": u, "status": "failed", "error": str(e)})
+                    continue
+                enrolled += 1
+                append_checkpoint(checkpoint, {
+                    "user": u, "status": "done", "audio": len(audio_rows), "face": len(face_rows),
+                    "rejected_faces": rejected,
+                })
+                print(f"[Bulk] {u}: {len(audio_rows)} voice / {len(face_rows)} face embeddings "
+                      f"({enrolled + failed}/{len(todo)}, {time.perf_counter() - t0:.0f}s)")
+
+    #the face model and the voice thresholds are trained once for the whole population
+    if train and enrolled:
+        print("[Bulk] training face model and voice thresholds")
+        with model_files.locked():
+            pipeline.train_face_model()
+            pipeline.train_voice_thresholds()
+            voice_index.build_from_db().save()
+    print(f"[Bulk] enrolled {enrolled}, failed {failed}")
+    return enrolled, failed
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Enroll users in bulk from <root>/<username>/*.wav|*.jpg")
+    ap.add_argument("root", type=Path, help="dataset root directory")
+    ap.add_argument("--users", nargs="*", default=None, help="only these users")
+    ap.add_argument("--workers", type=int, default=None, help="worker processes")
+    ap.add_argument("--checkpoint", type=Path, default=None, help=f"checkpoint file (default <root>/{CHECKPOINT_NAME})")
+    ap.add_argument("--retry-failed", action="store_true", help="retry users that failed in a previous run")
+    ap.add_argument("--no-train", action="store_true", help="skip training at the end")
+    args = ap.parse_args()
+
+    db.init_db()
+    _, n_failed = enroll_bulk(args.root, args.users, args.workers, args.checkpoint,
+                              retry_failed=args.retry_failed, train=not args.no_train)
+    sys.exit(1 if n_failed else 0)
@@ -0,0 +1,116 @@
+import os
+import socket
+import sqlite3
+import time
+import argparse
+
+import config
+import model_files
+import pipeline
+import resources
+
+#enrollment jobs live in the enroll_jobs table, any process sharing auth.db and models/ can work them off:
+#the kiosk's own background thread or a headless `python enroll_queue.py` next to it
+#a worker holds the models/ lock for the whole job (backup -> embed -> train -> publish),
+#so two enrollments never interleave their training or their .bak files
+
+MODEL_FILES = [
+    config.FACE_MODEL_FILE,
+    config.FACE_INDEX_FILE,
+    config.VOICE_MODEL_FILE,
+    config.VOICE_INDEX_FILE,
+]
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def submit(username: str):
+    #returns the job id, or None if the user already has a job queued or running
+    try:
+        return config.db.submit_enroll_job(username)
+    except sqlite3.IntegrityError:
+        return None
+
+
+def status(job_id: int):
+    #"queued" | "running" | "done" | "failed", error is set for failed jobs
+    row = config.db.get_enroll_job(job_id)
+    if row is None:
+        return None, None
+    return row
+
+
+def enroll(username, steps=pipeline.enroll_and_train, db=None, encoder=None):
+    #caller holds model_files.locked(), raises after rolling back the db rows, folders and models
+    db = db or config.db
+    model_files.make_backups(MODEL_FILES)
+    try:
+        #background thread budget, an authentication opened meanwhile takes precedence
+        with resources.hold("background"):
+            steps(username, db, encoder)
+    except Exception:
+        try:
+            db.delete_user_data(username)
+            print(f"[Enroll] Rolled back DB rows for {username}")
+        except Exception as e:
+            print("[Enroll] DB rollback failed:", e)
+        pipeline.purge_user_folders(username)
+        model_files.restore_backups(MODEL_FILES)
+        raise
+    model_files.delete_backups(MODEL_FILES)
+    pipeline.purge_user_folders(username)
+
+
+def work_once(worker=None, lock_timeout=0):
+    #runs at most one job, returns (job_id, ok) or None when there was nothing to do
+    #with lock_timeout=0 a busy models/ lock just means another worker is on it, try later
+    try:
+        with model_files.locked(timeout=lock_timeout):
+            #every running job holds the lock, so one still marked running now belongs to a dead worker
+            #a job that keeps killing its worker is given up on after ENROLL_MAX_ATTEMPTS
+            for job_id, username in config.db.fail_orphaned_enroll_jobs(config.ENROLL_MAX_ATTEMPTS):
+                print(f"[Queue] job {job_id}: giving up on {username} after {config.ENROLL_MAX_ATTEMPTS} attempts")
+                config.db.delete_user_data(username)
+                pipeline.purge_user_folders(username)
+            job = config.db.claim_enroll_job(worker or worker_name(), include_orphans=True)
+            if job is None:
+                return None
+            job_id, username, attempts = job
+            print(f"[Queue] job {job_id}: enrolling {username} (attempt {attempts})")
+            if attempts > 1:
+                #a previous worker died part way, start from a clean slate
+                config.db.delete_user_data(username)
+            try:
+                enroll(username)
+            except Exception as e:
+                print(f"[Queue] job {job_id} failed: {e}")
+                config.db.finish_enroll_job(job_id, False, str(e))
+                return job_id, False
+            config.db.finish_enroll_job(job_id, True)
+            print(f"[Queue] job {job_id}: {username} enrolled")
+            return job_id, True
+    except TimeoutError:
+        return None
+
+
+def serve(poll=2.0, once=False):
+    worker = worker_name()
+    print(f"[Queue] worker {worker} waiting for enrollment jobs")
+    while True:
+        done = work_once(worker)
+        if done is None:
+            if once:
+                return
+            time.sleep(poll)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Work off queued enrollment jobs")
+    ap.add_argument("--poll", type=float, default=2.0, help="seconds between checks of an empty queue")
+    ap.add_argument("--once", action="store_true", help="exit once the queue is empty")
+    args = ap.parse_args()
+
+    config.db.init_db()
+    serve(args.poll, args.once)
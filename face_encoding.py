@@ -0,0 +1,79 @@
+import dlib
+import numpy as np
+import face_recognition.api as fr_api
+
+import config
+
+#batched 128-d encodings for crops whose face location is already known (aligned enrollment crops),
+#this skips the HOG pass face_recognition.face_encodings would run and feeds the ResNet in batches
+
+
+def crop_face_location(size=config.OUTPUT_SIZE, margin=config.MARGIN_FRAC):
+    #FacePreprocessor pads the face box by margin * side on every side before resizing,
+    #so without better information the face sits at margin / (1 + 2 * margin) from each edge
+    w, h = size
+    fx, fy = w * margin / (1 + 2 * margin), h * margin / (1 + 2 * margin)
+    return (int(round(fy)), int(round(w - fx)), int(round(h - fy)), int(round(fx)))
+
+
+def _shape(rgb, loc):
+    top, right, bottom, left = loc
+    return fr_api.pose_predictor_5_point(rgb, dlib.rectangle(left, top, right, bottom))
+
+
+def _check_shape(shape, loc, img_shape):
+    #a detector would have missed the face when its landmarks leave the crop or collapse
+    pts = np.array([(p.x, p.y) for p in shape.parts()], dtype=np.float32)
+    h, w = img_shape[:2]
+    if (pts[:, 0] < 0).any() or (pts[:, 0] >= w).any() or (pts[:, 1] < 0).any() or (pts[:, 1] >= h).any():
+        return "landmarks outside the crop"
+    #5-point model: 0-1 one eye's corners, 2-3 the other eye's corners, 4 below the nose
+    eye_a, eye_b, nose = pts[0:2].mean(axis=0), pts[2:4].mean(axis=0), pts[4]
+    box_w = loc[1] - loc[3]
+    if np.linalg.norm(eye_a - eye_b) < 0.15 * box_w:
+        return "eyes collapsed"
+    if nose[1] <= min(eye_a[1], eye_b[1]):
+        return "nose above the eyes"
+    return None
+
+
+def encode_crops(crops, locations=None, batch_size=None):
+    #crops: list of rgb images (None entries are reported), locations: per-crop (top, right, bottom, left)
+    #returns (encodings, rejected), encodings[i] is None for every index listed in rejected as (i, reason)
+    batch_size = batch_size or config.FACE_ENCODE_BATCH
+    default    = crop_face_location()
+    encodings  = [None] * len(crops)
+    rejected   = []
+
+    pending = []
+    for i, rgb in enumerate(crops):
+        if rgb is None:
+            rejected.append((i, "no aligned crop"))
+            continue
+        loc = locations[i] if locations is not None and locations[i] is not None else default
+        shape = _shape(rgb, loc)
+        why = _check_shape(shape, loc, rgb.shape)
+        if why:
+            rejected.append((i, why))
+            continue
+        dets = dlib.full_object_detections()
+        dets.append(shape)
+        pending.append((i, rgb, dets))
+
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        descs = fr_api.face_encoder.compute_face_descriptor(
+            [rgb for _, rgb, _ in chunk], [dets for _, _, dets in chunk], 1)
+        for (i, _, _), per_image in zip(chunk, descs):
+            encodings[i] = np.array(per_image[0])
+    return encodings, rejected
+
+
+def encode_faces(rgb, locations):
+    #several faces detected in one frame, encoded with a single descriptor call
+    if not locations:
+        return []
+    dets = dlib.full_object_detections()
+    for loc in locations:
+        dets.append(_shape(rgb, loc))
+    return [np.array(d) for d in fr_api.face_encoder.compute_face_descriptor(rgb, dets, 1)]
@@ -0,0 +1,167 @@
+import time
+import collections
+import joblib
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+
+import db
+import config
+import model_files
+import train_classifiers
+from train_classifiers import DIM_FACE
+
+#open-set face identification by nearest template, an alternative to the closed-set SVM:
+#the query is compared with every user's centroid, the top_k closest users are re-ranked exactly
+#by their nearest stored template, and the distance is turned into a score by a logistic calibration
+#adding a user only appends templates, nothing has to be retrained
+#loading, decoding and the train/validation split are train_classifiers', same as for the SVM
+
+MAX_CAL_QUERIES = 20_000   #validation queries used for calibration, bounds training time at scale
+
+
+class FaceIndex:
+
+    def __init__(self, top_k=None):
+        self.top_k     = top_k or config.FACE_INDEX_TOPK
+        self.classes_  = []
+        self.templates = np.empty((0, DIM_FACE), np.float32)
+        self.starts    = np.empty(0, np.int64)     #each class's templates are contiguous
+        self.counts    = np.empty(0, np.int64)
+        self.centroids = np.empty((0, DIM_FACE), np.float32)
+        self.coef      = (-10.0, 5.0)              #score = sigmoid(a * distance + b), set by calibrate()
+
+    def fit(self, X, y):
+        groups = collections.defaultdict(list)
+        for v, label in zip(np.asarray(X, np.float32), y):
+            groups[label].append(v)
+        self.classes_  = list(groups)
+        self.counts    = np.array([len(groups[c]) for c in self.classes_], np.int64)
+        self.starts    = np.concatenate([[0], np.cumsum(self.counts)[:-1]]).astype(np.int64)
+        self.templates = np.vstack([np.stack(groups[c]) for c in self.classes_])
+        self.centroids = np.stack([np.mean(groups[c], axis=0) for c in self.classes_]).astype(np.float32)
+        return self
+
+    def add_user(self, name, X):
+        #enrollment: one centroid and a block of templates, replaces the user's previous entry
+        X = np.asarray(X, np.float32)
+        if name in self.classes_:
+            i = self.classes_.index(name)
+            keep = np.ones(len(self.templates), bool)
+            keep[self.starts[i]:self.starts[i] + self.counts[i]] = False
+            self.templates = self.templates[keep]
+            self.counts    = np.delete(self.counts, i)
+            self.centroids = np.delete(self.centroids, i, axis=0)
+            del self.classes_[i]
+        self.classes_.append(name)
+        self.templates = np.vstack([self.templates, X])
+        self.counts    = np.append(self.counts, len(X))
+        self.starts    = np.concatenate([[0], np.cumsum(self.counts)[:-1]]).astype(np.int64)
+        self.centroids = np.vstack([self.centroids, X.mean(axis=0, keepdims=True)])
+
+    def nearest(self, X, top_k=None):
+        #(candidate class ids (n, k), min template distance (n, k)), closest first
+        X = np.atleast_2d(np.asarray(X, np.float32))
+        k = min(top_k or self.top_k, len(self.classes_))
+        #squared distances to every centroid as one matrix product
+        cd = (X ** 2).sum(1)[:, None] - 2 * X @ self.centroids.T + (self.centroids ** 2).sum(1)[None]
+        cand = np.argpartition(cd, k - 1, axis=1)[:, :k]
+        dists = np.empty(cand.shape, np.float32)
+        for r, (x, row) in enumerate(zip(X, cand)):
+            idx = np.concatenate([np.arange(self.starts[c], self.starts[c] + self.counts[c]) for c in row])
+            d = np.linalg.norm(self.templates[idx] - x, axis=1)
+            dists[r] = np.minimum.reduceat(d, np.concatenate([[0], np.cumsum(self.counts[row])[:-1]]))
+        order = np.argsort(dists, axis=1)
+        return np.take_along_axis(cand, order, 1), np.take_along_axis(dists, order, 1)
+
+    def score(self, d):
+        a, b = self.coef
+        return 1.0 / (1.0 + np.exp(-(a * np.asarray(d) + b)))
+
+    def calibrate(self, genuine_d, impostor_d):
+        d = np.concatenate([genuine_d, impostor_d]).reshape(-1, 1)
+        y = np.concatenate([np.ones(len(genuine_d)), np.zeros(len(impostor_d))])
+        lr = LogisticRegression(class_weight="balanced").fit(d, y)
+        self.coef = (float(lr.coef_[0, 0]), float(lr.intercept_[0]))
+
+    def predict_proba(self, X):
+        #same shape and meaning as the SVM's predict_proba, only the top_k candidates get a score
+        cand, dists = self.nearest(X)
+        out = np.zeros((len(cand), len(self.classes_)), np.float32)
+        np.put_along_axis(out, cand, self.score(dists).astype(np.float32), 1)
+        return out
+
+
+def train(rows=None, seed=0, use_cache=True):
+    #rows as returned by db.get_all_face_rows() (None reads the table through the embedding cache),
+    #returns the dict stored in FACE_INDEX_FILE
+    rng = np.random.default_rng(seed)
+    data = train_classifiers.load_data(rows, use_cache)
+    Xtr, ytr, Xvl, yvl = train_classifiers.split(data, seed)
+    _, _, yall, Xall = data
+
+    index = FaceIndex().fit(Xtr, ytr)
+    if len(Xvl) > MAX_CAL_QUERIES:
+        keep = rng.choice(len(Xvl), MAX_CAL_QUERIES, replace=False)
+        Xvl, yvl = Xvl[keep], yvl[keep]
+
+    cls_id = {c: i for i, c in enumerate(index.classes_)}
+    cand, dists = index.nearest(Xvl)
+    genuine_d, impostor_d, top1 = [], [], 0
+    per_class = collections.defaultdict(lambda: ([], []))
+    for x, user, row, d in zip(Xvl, yvl, cand, dists):
+        own = cls_id.get(user)
+        if own is None:
+            continue
+        top1 += int(row[0] == own)
+        s, n = index.starts[own], index.counts[own]
+        g = float(np.linalg.norm(index.templates[s:s + n] - x, axis=1).min())
+        genuine_d.append(g)
+        per_class[own][0].append(g)
+        for c, dc in zip(row, d):
+            if c != own:
+                impostor_d.append(float(dc))
+                per_class[c][1].append(float(dc))
+    print(f"[FaceIndex] validation top-1 accuracy {top1 / len(Xvl):.3f} on {len(Xvl)} queries")
+
+    index.calibrate(np.array(genuine_d), np.array(impostor_d))
+    global_thr, eer = train_classifiers.eer_threshold(index.score(genuine_d), index.score(impostor_d))
+    print(f"[FaceIndex] Equal-Error Rate = {eer:.3f}  |  threshold = {global_thr:.3f}")
+
+    class_thresholds = {}
+    for c, (g, imp) in per_class.items():
+        if g and imp:
+            thr, _ = train_classifiers.eer_threshold(index.score(g), index.score(imp))
+            class_thresholds[index.classes_[c]] = min(0.95, thr)
+
+    #every stored template is used for identification, the split above was only for calibration
+    deployed = FaceIndex(index.top_k).fit(Xall, yall)
+    deployed.coef = index.coef
+    return {
+        "model": deployed,
+        "classes": deployed.classes_,
+        "global_threshold": global_thr,
+        "class_thresholds": class_thresholds,
+    }
+
+
+def index_user(username):
+    #enrollment with FACE_ENGINE="index": the user's templates are appended to the published index,
+    #calibration and thresholds stay as they are (the new user gets the global threshold)
+    #the caller holds the models/ lock
+    data = joblib.load(config.FACE_INDEX_FILE)
+    vecs = [v for v in map(train_classifiers.decode, db.get_face_embedding_blobs(username)) if v is not None]
+    if not vecs:
+        raise RuntimeError(f"no usable face embeddings for {username}")
+    data["model"].add_user(username, np.stack(vecs))
+    data["classes"] = data["model"].classes_
+    data["class_thresholds"].pop(username, None)
+    model_files.publish(data, config.FACE_INDEX_FILE)
+    print(f"[FaceIndex] added {username} ({len(vecs)} templates), {len(data['classes'])} users")
+
+
+if __name__ == "__main__":
+    t0 = time.perf_counter()
+    data = train()
+    model_files.publish(data, config.FACE_INDEX_FILE)
+    print(f"Saved face index ({len(data['classes'])} users) in {time.perf_counter() - t0:.1f}s →",
+          config.FACE_INDEX_FILE)
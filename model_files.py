@@ -0,0 +1,106 @@
+import os
+import time
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+
+import joblib
+
+try:
+    import fcntl
+except ImportError:  #windows
+    fcntl = None
+    import msvcrt
+
+#everything that touches models/*.joblib from more than one process (kiosks sharing the directory,
+#enrollment workers) goes through here: an inter-process lock, atomic publish and the .bak backups
+#config imports this module, so it must not import config
+
+MODELS_DIR = Path(__file__).parent / "models"
+LOCK_FILE  = MODELS_DIR / ".models.lock"
+
+
+def _try_lock(fd):
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def locked(timeout=None, poll=0.2):
+    #exclusive lock held across backup -> train -> publish, timeout=None waits forever
+    #the lock belongs to the open file, so a crashed holder releases it automatically
+    MODELS_DIR.mkdir(parents=True, exist_ok=True)
+    fd = os.open(str(LOCK_FILE), os.O_RDWR | os.O_CREAT)
+    try:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not _try_lock(fd):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"models/ is locked by another enrollment ({LOCK_FILE})")
+            time.sleep(poll)
+        try:
+            yield
+        finally:
+            _unlock(fd)
+    finally:
+        os.close(fd)
+
+
+def publish(data, path):
+    #write next to the target and rename over it, readers see the old or the new model, never half of one
+    path = Path(path)
+    tmp  = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        joblib.dump(data, tmp)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def _bak(f):
+    return f.with_suffix(f.suffix + ".bak")
+
+
+def make_backups(files):
+    for f in files:
+        if f.exists():
+            shutil.copy2(f, _bak(f))
+
+
+def restore_backups(files):
+    for f in files:
+        if _bak(f).exists():
+            os.replace(_bak(f), f)
+
+
+def delete_backups(files):
+    for f in files:
+        if _bak(f).exists():
+            _bak(f).unlink()
+
+
+def clear_stale_backups():
+    #leftovers of a crashed enrollment, only safe to remove when nobody holds the lock
+    try:
+        with locked(timeout=0):
+            for bak in MODELS_DIR.glob("*.joblib.bak"):
+                try:
+                    bak.unlink()
+                except Exception as e:
+                    print(f"Could not remove {bak}: {e}")
+    except TimeoutError:
+        print("[Models] another enrollment is running, keeping its backups")
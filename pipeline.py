@@ -0,0 +1,327 @@
+import sys
+import shutil
+import subprocess
+from functools import partial
+from pathlib import Path
+import cv2
+import soundfile as sf
+import face_recognition
+
+import config
+import embeddings
+import augment_data
+import augment_faces
+import face_encoding
+from audio_frontend import frontend
+from preprocess_faces import FacePreprocessor
+from dag import Stage, run_dag
+import voice_index
+import face_index
+import resources
+from condense_templates import condense_user
+
+#in-memory enrollment: the raw captures are read once and every stage hands NumPy arrays to the next,
+#with dump=True the intermediates are also written in the same layout the on-disk scripts use
+
+
+def _dump_wav(root, username, fname, y, sr):
+    out_dir = root / username
+    out_dir.mkdir(parents=True, exist_ok=True)
+    sf.write(str(out_dir / fname), y, sr)
+
+
+def _dump_jpg(root, username, fname, img):
+    out_dir = root / username
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cv2.imwrite(str(out_dir / fname), img)
+
+
+def load_raw_audio(username, raw_root=config.RAW_VOICE_DIR):
+    clips = []
+    for wav_path in sorted((raw_root / username).glob("*.wav")):
+        y, sr = sf.read(str(wav_path))
+        clips.append((wav_path.stem, y, sr))
+    return clips
+
+
+def load_raw_faces(username, raw_root=config.RAW_FACE_DIR):
+    images = []
+    for img_path in sorted((raw_root / username).glob("*.jpg")):
+        img = cv2.imread(str(img_path))
+        #skip if the image is unreadable
+        if img is None:
+            print(f"[Face] could not read {img_path}")
+            continue
+        images.append((img_path.stem, img))
+    return images
+
+
+def audio_stage(username, clips, encoder=None, dump=False):
+    #returns (orig_id, is_augmented, embedding) rows for every clean and accepted augmented clip
+    encoder = encoder or config.get_encoder()
+    rows   = []
+    budget = config.MAX_AUG_PER_USER
+    #decoded, denoised, normalized and trimmed once, shared by embedding and augmentation
+    #the clips of one enrollment come from the same mic and session, so they share a noise profile
+    processed = frontend.process_batch([(y, sr) for _, y, sr in clips],
+                                       noise_key=(config.MIC_DEVICE, username))
+    for (stem, _, _), (clean, meta) in zip(clips, processed):
+        sr = meta["sr"]
+        if dump:
+            _dump_wav(config.CLEAN_VOICE_DIR, username, f"{stem}.wav", clean, sr)
+
+        emb_o = encoder.embed_utterance(clean)
+        rows.append((stem, 0, emb_o))
+
+        #the augmentation already embeds every candidate it accepts, those embeddings are reused as is
+        kept = augment_data.augment_array(clean, sr, emb_o, name=f"{stem}.wav", limit=budget)
+        budget -= len(kept)
+        for i, (y_aug, emb_a) in enumerate(kept, start=1):
+            rows.append((stem, 1, emb_a))
+            if dump:
+                _dump_wav(config.AUG_VOICE_DIR, username, f"{stem}_aug{i}.wav", y_aug, sr)
+    return rows
+
+
+def face_stage(username, images, preprocessor=None, dump=False):
+    #returns (rows, rejected): (orig_id, is_augmented, embedding) rows for every aligned and accepted
+    #augmented face, and (orig_id, reason) for every snapshot that produced no embedding
+    pre      = preprocessor or FacePreprocessor()
+    rows     = []
+    rejected = []
+    budget   = config.MAX_AUG_PER_USER
+
+    aligned = []
+    for stem, img in images:
+        face, loc = pre.process_image(img, with_location=True)
+        if face is None:
+            rejected.append((stem, "no face detected"))
+            continue
+        if dump:
+            _dump_jpg(config.PROC_FACE_DIR, username, f"{stem}.jpg", face)
+        aligned.append((stem, face, loc))
+
+    #the face location is carried over from the preprocessor, all crops go through the ResNet together
+    encs, bad = face_encoding.encode_crops([cv2.cvtColor(face, cv2.COLOR_BGR2RGB) for _, face, _ in aligned],
+                                           [loc for _, _, loc in aligned])
+    rejected.extend((aligned[i][0], why) for i, why in bad)
+
+    for (stem, face, _), enc in zip(aligned, encs):
+        if enc is None:
+            continue
+        rows.append((stem, 0, enc))
+
+        kept = augment_faces.augment_image(face, emb_o=enc, name=f"{username}/{stem}")
+        kept = kept[:max(0, budget)]
+        budget -= len(kept)
+        for i, (aug_img, emb_a) in enumerate(kept, start=1):
+            rows.append((stem, 1, emb_a))
+            if dump:
+                _dump_jpg(config.AUG_FACE_DIR, username, f"{stem}_aug{i}.jpg", aug_img)
+    return rows, rejected
+
+
+def pack_rows(rows):
+    return [(orig, is_aug, embeddings.pack(emb, config.EMBEDDING_DTYPE)) for orig, is_aug, emb in rows]
+
+
+def embed_user(username, raw_voice_root=config.RAW_VOICE_DIR, raw_face_root=config.RAW_FACE_DIR,
+               encoder=None, dump=False):
+    #runs every stage for one user and returns packed (audio_rows, face_rows, rejected faces)
+    audio_rows = audio_stage(username, load_raw_audio(username, raw_voice_root), encoder=encoder, dump=dump)
+    face_rows, rejected = face_stage(username, load_raw_faces(username, raw_face_root), dump=dump)
+    return pack_rows(audio_rows), pack_rows(face_rows), rejected
+
+
+def enroll_user(username, db=None, encoder=None, dump=None):
+    db   = db or config.db
+    dump = config.PIPELINE_DEBUG_DUMP if dump is None else dump
+
+    audio_rows, face_rows, rejected = embed_user(username, encoder=encoder, dump=dump)
+    for stem, why in rejected:
+        print(f"[Face] {stem} not embedded: {why}")
+
+    db.add_user_embeddings(username, audio_rows, face_rows)
+    print(f"[Voice] stored {len(audio_rows)} embeddings for {username}")
+    print(f"[Face] stored {len(face_rows)} embeddings for {username}")
+
+
+def enroll_on_disk(username, db=None, encoder=None):
+    #the script-based path: every stage writes its output under data/ and the next one reads it back
+    db      = db or config.db
+    encoder = encoder or config.get_encoder()
+    u       = username
+    subprocess.run([sys.executable, str(config.BASE_DIR / "denoise_audio.py"), u], check=True, env=resources.child_env())
+    subprocess.run([sys.executable, str(config.BASE_DIR / "augment_data.py"), u], check=True, env=resources.child_env())
+
+    for wav_path in (config.CLEAN_VOICE_DIR / u).glob("*.wav"):
+        wav, _ = frontend.load(wav_path, denoise=False)
+        emb = encoder.embed_utterance(wav)
+        db.add_audio_embedding(u, embeddings.pack(emb, config.EMBEDDING_DTYPE),
+                               orig_id=wav_path.stem, is_augmented=0)
+
+    aug_dir = config.AUG_VOICE_DIR / u
+    if aug_dir.exists():
+        for wav_path in aug_dir.glob("*.wav"):
+            wav, _ = frontend.load(wav_path, denoise=False)
+            emb = encoder.embed_utterance(wav)
+            db.add_audio_embedding(u, embeddings.pack(emb, config.EMBEDDING_DTYPE),
+                                   orig_id=wav_path.stem.split("_aug")[0], is_augmented=1)
+    else:
+        print(f"No augmented audio for {u}")
+
+    subprocess.run([sys.executable, str(config.BASE_DIR / "preprocess_faces.py"), u], check=True, env=resources.child_env())
+
+    face_dir = config.PROC_FACE_DIR / u
+    if not face_dir.exists():
+        print(f" No processed faces for {u}")
+        return
+
+    subprocess.run([sys.executable, str(config.BASE_DIR / "augment_faces.py"), u], check=True, env=resources.child_env())
+
+    crops = [(p, p.stem, 0) for p in face_dir.glob("*.jpg")]
+    aug_dir = config.AUG_FACE_DIR / u
+    if aug_dir.exists():
+        crops += [(p, p.stem.split("_aug")[0], 1) for p in aug_dir.glob("*.jpg")]
+    else:
+        print(f"No augmented faces for {u}")
+
+    #the face is detected again on every crop read back from disk: augmented crops were rotated, shifted
+    #and rescaled after alignment (as augment_faces did), and an original's box can differ from the nominal
+    #one; an original the detector misses is still encoded at the expected location (crop_face_location)
+    images, locs = [], []
+    for img_path, _, is_aug in crops:
+        rgb = face_recognition.load_image_file(str(img_path))
+        found = face_recognition.face_locations(rgb)
+        if not found and is_aug:
+            print(f"[Face] {img_path.name} not embedded: no face detected")
+            rgb = None
+        elif not found:
+            print(f"[Face] {img_path.name}: no face detected, using the nominal crop location")
+        images.append(rgb)
+        locs.append(found[0] if found else None)
+    keep  = [i for i, rgb in enumerate(images) if rgb is not None]
+    crops = [crops[i] for i in keep]
+    encs, rejected = face_encoding.encode_crops([images[i] for i in keep], [locs[i] for i in keep])
+    for (img_path, stem, is_aug), enc in zip(crops, encs):
+        if enc is None:
+            continue
+        db.add_face_embedding(u, embeddings.pack(enc, config.EMBEDDING_DTYPE),
+                              orig_id=stem, is_augmented=is_aug)
+        print(f"[Face] embedding {'AUG ' if is_aug else ''}{img_path.name}")
+    for i, why in rejected:
+        print(f"[Face] {crops[i][0].name} not embedded: {why}")
+
+
+def purge_user_folders(username: str):
+    for root in (
+        config.RAW_VOICE_DIR,
+        config.CLEAN_VOICE_DIR,
+        config.AUG_VOICE_DIR,
+        config.RAW_FACE_DIR,
+        config.PROC_FACE_DIR,
+        config.AUG_FACE_DIR,
+    ):
+        p = Path(root) / username
+        try:
+            if p.is_dir():
+                shutil.rmtree(p)
+                print(f"removed {p}")
+        except Exception as e:
+            print(f"Could not remove {p}: {e}")
+
+
+def train_face_model(username=None):
+    #the index engine only needs the new user's templates appended, a full fit is for the first build
+    if config.FACE_ENGINE == "index" and username and config.FACE_INDEX_FILE.exists():
+        face_index.index_user(username)
+        return
+    script = "face_index.py" if config.FACE_ENGINE == "index" else "train_classifier_svm.py"
+    subprocess.run([sys.executable, str(config.BASE_DIR / script)], check=True, env=resources.child_env())
+
+
+def train_voice_thresholds():
+    subprocess.run([sys.executable, str(config.BASE_DIR / "compute_voice_thresholds.py")], check=True, env=resources.child_env())
+
+
+def _embed_voice(username, encoder, dump, clips):
+    return pack_rows(audio_stage(username, clips, encoder=encoder, dump=dump))
+
+
+def _embed_faces(username, dump, images):
+    rows, rejected = face_stage(username, images, dump=dump)
+    for stem, why in rejected:
+        print(f"[Face] {stem} not embedded: {why}")
+    return pack_rows(rows)
+
+
+def _store(db, username, modality, rows):
+    db = db or config.db
+    if modality == "audio":
+        db.add_user_embeddings(username, rows, [])
+    else:
+        db.add_user_embeddings(username, [], rows)
+    label = "Voice" if modality == "audio" else "Face"
+    print(f"[{label}] stored {len(rows)} embeddings for {username}")
+    return len(rows)
+
+
+def _after(fn, *_):
+    return fn()
+
+
+def enrollment_graph(username, db=None, encoder=None, dump=False, train=True):
+    #voice and face branches share nothing until training, and each model only needs its own branch
+    stages = [
+        Stage("voice_load",  partial(load_raw_audio, username)),
+        Stage("voice_embed", partial(_embed_voice, username, encoder, dump), ["voice_load"]),
+        Stage("voice_store", partial(_store, db, username, "audio"), ["voice_embed"]),
+        Stage("face_load",   partial(load_raw_faces, username)),
+        Stage("face_embed",  partial(_embed_faces, username, dump), ["face_load"]),
+        Stage("face_store",  partial(_store, db, username, "face"), ["face_embed"]),
+    ]
+    voice_done, face_done = "voice_store", "face_store"
+    if config.CONDENSE_ON_ENROLL:
+        stages += [
+            Stage("voice_condense", partial(_after, partial(condense_user, username, modalities=("audio",))),
+                  ["voice_store"]),
+            Stage("face_condense",  partial(_after, partial(condense_user, username, modalities=("face",))),
+                  ["face_store"]),
+        ]
+        voice_done, face_done = "voice_condense", "face_condense"
+    if train:
+        stages += [
+            Stage("train_voice", partial(_after, train_voice_thresholds), [voice_done]),
+            Stage("voice_index", partial(_after, partial(voice_index.index_user, username)), [voice_done]),
+            Stage("train_face",  partial(_after, partial(train_face_model, username)), [face_done]),
+        ]
+    return stages
+
+
+def _yielding(name, fn, *args):
+    #a stage does not start while an authentication holds the CPU, up to BACKGROUND_YIELD_SECS
+    waited = resources.yield_to_interactive(config.BACKGROUND_YIELD_SECS)
+    if waited >= 0.1:
+        print(f"[DAG] {name} waited {waited:.1f}s for an authentication")
+    return fn(*args)
+
+
+def run_enrollment(username, db=None, encoder=None, dump=None, train=True, executor=None):
+    dump = config.PIPELINE_DEBUG_DUMP if dump is None else dump
+    stages = [Stage(s.name, partial(_yielding, s.name, s.fn), s.deps)
+              for s in enrollment_graph(username, db, encoder, dump, train)]
+    return run_dag(stages, executor=executor)
+
+
+def enroll_and_train(username, db=None, encoder=None):
+    #embeds, stores and retrains with whichever pipeline config selects
+    if config.IN_MEMORY_PIPELINE:
+        #both branches and their training steps run as a dependency graph
+        run_enrollment(username, db, encoder)
+    else:
+        enroll_on_disk(username, db, encoder)
+        if config.CONDENSE_ON_ENROLL:
+            condense_user(username)
+        train_face_model(username)
+        train_voice_thresholds()
+        voice_index.index_user(username)
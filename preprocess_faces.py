@@ -1,15 +1,23 @@
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import cv2
 import numpy as np
 import face_recognition
+import resources
 
-from config import RAW_FACE_DIR, PROC_FACE_DIR, OUTPUT_SIZE, MARGIN_FRAC, DETECTION_MODEL
+from config import (RAW_FACE_DIR, PROC_FACE_DIR, OUTPUT_SIZE, MARGIN_FRAC, DETECTION_MODEL,
+                    FAST_ALIGN, FACE_DETECT_SCALE)
 
 class FacePreprocessor:
 
-    def __init__(self, size=OUTPUT_SIZE, margin=MARGIN_FRAC, model=DETECTION_MODEL):
+    def __init__(self, size=OUTPUT_SIZE, margin=MARGIN_FRAC, model=DETECTION_MODEL,
+                 fast=FAST_ALIGN, detect_scale=FACE_DETECT_SCALE):
         self.size   = size
         self.margin = margin
         self.model  = model
+        self.fast   = fast
+        self.detect_scale = detect_scale
 
     def detect(self, rgb_img):
         boxes = face_recognition.face_locations(rgb_img, model=self.model)
@@ -19,6 +27,67 @@ class FacePreprocessor:
         lm = face_recognition.face_landmarks(rgb_img, boxes)[0]
         return boxes[0], lm
 
+    def detect_scaled(self, bgr_img):
+        #detect on a downscaled copy, then map box and landmarks back to full resolution
+        s = self.detect_scale
+        small = cv2.resize(bgr_img, (0, 0), fx=s, fy=s, interpolation=cv2.INTER_AREA)
+        box, lm = self.detect(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        if box is None:
+            return None, None
+        box = tuple(int(round(v / s)) for v in box)
+        lm  = {k: [(x / s, y / s) for x, y in pts] for k, pts in lm.items()}
+        return box, lm
+
+    def _rotation(self, le, re):
+        # compute horizontal and vertical distances between eyes
+        dy, dx = re[1] - le[1], re[0] - le[0]
+        # computes the eye line relative to the horizontal
+        angle  = np.degrees(np.arctan2(dy, dx))
+        # create a matrix to rotate the image, the left eye is the rotation point
+        return cv2.getRotationMatrix2D(tuple(le), angle, 1.0)
+
+    def _rotated_box(self, box, M):
+        #rotate the box corners and take their bounding box
+        pts = np.array([[[box[3], box[0]], [box[1], box[0]], [box[1], box[2]], [box[3], box[2]]]], dtype=np.float32)
+        pts_w = cv2.transform(pts, M)[0]
+        ys, xs = pts_w[:,1], pts_w[:,0]
+        return (int(ys.min()), int(xs.max()), int(ys.max()), int(xs.min()))
+
+    def _crop_bounds(self, box, shape):
+        top, right, bottom, left = box
+        h, w = bottom - top, right - left
+        pad  = int(self.margin * max(h, w))
+        return (max(0, left - pad), max(0, top - pad),
+                min(shape[1], right + pad), min(shape[0], bottom + pad))
+
+    def align_crop(self, img, le, re, box):
+        #rotation, crop and resize folded into one affine, only the output pixels are sampled
+        M = self._rotation(le, re)
+        x1, y1, x2, y2 = self._crop_bounds(self._rotated_box(box, M), img.shape)
+        sx, sy = self.size[0] / (x2 - x1), self.size[1] / (y2 - y1)
+        #same pixel-centre convention as cv2.resize
+        A = np.array([[sx, 0, (0.5 - x1) * sx - 0.5],
+                      [0, sy, (0.5 - y1) * sy - 0.5],
+                      [0, 0, 1]])
+        F = (A @ np.vstack([M, [0, 0, 1]]))[:2]
+
+        #source region that maps into the output, padded for the anti-alias blur
+        k     = 1.0 / min(sx, sy)
+        sigma = (k - 1) / 2 if k > 1 else 0.0
+        pad   = int(np.ceil(3 * sigma)) + 2
+        back  = cv2.transform(np.array([[[x1, y1], [x2, y1], [x2, y2], [x1, y2]]], np.float32),
+                              cv2.invertAffineTransform(M))[0]
+        rx1 = max(0, int(back[:, 0].min()) - pad)
+        ry1 = max(0, int(back[:, 1].min()) - pad)
+        rx2 = min(img.shape[1], int(np.ceil(back[:, 0].max())) + pad)
+        ry2 = min(img.shape[0], int(np.ceil(back[:, 1].max())) + pad)
+        roi = img[ry1:ry2, rx1:rx2]
+        #blur the region instead of relying on INTER_AREA, which warpAffine does not support
+        if sigma > 0:
+            roi = cv2.GaussianBlur(roi, (0, 0), sigma)
+        F[:, 2] += F[:, :2] @ np.array([rx1, ry1])
+        return cv2.warpAffine(roi, F, self.size, flags=cv2.INTER_LINEAR)
+
     def align(self, img, le, re):
         # compute horizontal and vertical distances between eyes
         dy, dx = re[1] - le[1], re[0] - le[0]
@@ -49,56 +118,184 @@ class FacePreprocessor:
     def resize(self, img):
         return cv2.resize(img, self.size, interpolation=cv2.INTER_AREA)
 
+    def output_location(self, box, M, shape):
+        #where the detected face box lands inside the output crop, as (top, right, bottom, left)
+        x1, y1, x2, y2 = self._crop_bounds(self._rotated_box(box, M), shape)
+        sx, sy = self.size[0] / (x2 - x1), self.size[1] / (y2 - y1)
+        top, right, bottom, left = box
+        centre = np.array([[[(left + right) / 2, (top + bottom) / 2]]], np.float32)
+        cx, cy = cv2.transform(centre, M)[0][0]
+        u, v   = (cx - x1) * sx, (cy - y1) * sy
+        hw, hh = (right - left) / 2 * sx, (bottom - top) / 2 * sy
+        w, h   = self.size
+        return (max(0, int(round(v - hh))), min(w, int(round(u + hw))),
+                min(h, int(round(v + hh))), max(0, int(round(u - hw))))
+
+    def process_image(self, img, with_location=False):
+        #takes a bgr snapshot, returns the aligned, cropped and resized bgr face or None
+        #with_location=True also returns the face box inside that crop, so it need not be detected again
+        if self.fast:
+            box, lm = self.detect_scaled(img)
+            if box is None:
+                return (None, None) if with_location else None
+            le = np.mean(lm["left_eye"], axis=0)
+            re = np.mean(lm["right_eye"], axis=0)
+            out = self.align_crop(img, le, re, box)
+            if with_location:
+                return out, self.output_location(box, self._rotation(le, re), img.shape)
+            return out
+
+        #convert from bgr 2 rgb for compatibility with face_recognition
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        #detect box and landmarks
+        box, lm = self.detect(rgb)
+        if box is None:
+            return (None, None) if with_location else None
+        #get coordinates of eyes
+        le = np.mean(lm["left_eye"], axis=0)
+        re = np.mean(lm["right_eye"], axis=0)
+        #align the image
+        aligned,M = self.align(rgb, le, re)
+        #create an array compatible with transform, containing the coordinates of the box
+        pts = np.array([[[box[3], box[0]], [box[1], box[0]], [box[1], box[2]], [box[3], box[2]]]], dtype=np.float32)
+        #rotate the box to match the rotated image
+        pts_w = cv2.transform(pts, M)[0]  # remove dimension, extract only points
+        #extract x and y points
+        ys, xs = pts_w[:,1], pts_w[:,0]
+        #save the coordinates of the new box
+        new_box = (int(ys.min()), int(xs.max()), int(ys.max()), int(xs.min()))
+        #crop the picture
+        face = self.crop(aligned, new_box)
+        #convert back to bgr
+        face_bgr = cv2.cvtColor(face, cv2.COLOR_RGB2BGR)
+        #resize
+        out = self.resize(face_bgr)
+        if with_location:
+            return out, self.output_location(box, M, img.shape)
+        return out
+
+    def signature(self) -> str:
+        #anything that changes the output invalidates previously processed files
+        return f"{self.size}|{self.margin}|{self.model}|{self.fast}|{self.detect_scale}"
+
+    def process_user(self, user: str, raw_root=RAW_FACE_DIR, proc_root=PROC_FACE_DIR, use_manifest=False):
+        #returns a report dict: processed / skipped counts and (file, reason) failures
+        report = {"user": user, "processed": 0, "skipped": 0, "failed": []}
+        person = raw_root / user
+        if not person.is_dir():
+            report["failed"].append((None, "no raw image directory"))
+            return report
+        dst = proc_root / user
+        #create the directory
+        dst.mkdir(parents=True, exist_ok=True)
+
+        manifest_path = dst / MANIFEST_NAME
+        manifest = {}
+        if use_manifest and manifest_path.exists():
+            try:
+                manifest = json.loads(manifest_path.read_text())
+            except ValueError:
+                manifest = {}
+        sig = self.signature()
+
+        #iterate through photos
+        for src in sorted(person.glob("*.jpg")):
+            fn = dst / src.name
+            data = src.read_bytes()
+            digest = hashlib.sha1(data + sig.encode()).hexdigest()
+            if use_manifest and manifest.get(src.name) == digest and fn.exists():
+                report["skipped"] += 1
+                continue
+
+            img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            #skip if the image is unreadable
+            if img is None:
+                report["failed"].append((src.name, "unreadable image"))
+                continue
+            try:
+                out = self.process_image(img)
+            except Exception as e:
+                report["failed"].append((src.name, f"error: {e}"))
+                continue
+            if out is None:
+                report["failed"].append((src.name, "no face detected"))
+                continue
+            #save the image to that path
+            ok = cv2.imwrite(str(fn), out)
+            status = "Success" if ok else "Failed"
+            print(f"{status}: Writing preprocessed images_raw to {fn}")
+            if not ok:
+                report["failed"].append((src.name, "write failed"))
+                continue
+            manifest[src.name] = digest
+            report["processed"] += 1
+
+        if use_manifest:
+            manifest_path.write_text(json.dumps(manifest, indent=1))
+        return report
+
     def process_folder(self, user: str, raw_root=RAW_FACE_DIR, proc_root=PROC_FACE_DIR):
         #go only in the directory of the current user
-        for person in sorted(raw_root.iterdir()):
-            if not person.is_dir() or person.name != user:
-                continue
-            dst = proc_root / person.name
-            #create the directory
-            dst.mkdir(parents=True, exist_ok=True)
-            #iterate through photos
-            for src in person.glob("*.jpg"):
-                img = cv2.imread(str(src))
-                #skip if the image is unreadable
-                if img is None:
-                    continue
-                #convert from bgr 2 rgb for compatibility with face_recognition
-                rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                #detect box and landmarks
-                box, lm = self.detect(rgb)
-                if box is None:
+        return self.process_user(user, raw_root, proc_root)
+
+    def process_many(self, users=None, raw_root=RAW_FACE_DIR, proc_root=PROC_FACE_DIR, workers=None):
+        #bulk re-processing on a process pool, one task per user, unchanged images are skipped by hash
+        if users is None:
+            users = sorted(p.name for p in raw_root.iterdir() if p.is_dir())
+        workers = resources.pool_size(workers)
+        params  = (self.size, self.margin, self.model, self.fast, self.detect_scale)
+
+        summary = {"processed": 0, "skipped": 0, "failed": []}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=params) as pool:
+            futures = {pool.submit(_process_user, u, raw_root, proc_root): u for u in users}
+            for fut in as_completed(futures):
+                user = futures[fut]
+                try:
+                    report = fut.result()
+                except Exception as e:
+                    summary["failed"].append((user, None, f"worker error: {e}"))
                     continue
-                #get coordinates of eyes
-                le = np.mean(lm["left_eye"], axis=0)
-                re = np.mean(lm["right_eye"], axis=0)
-                #align the image
-                aligned,M = self.align(rgb, le, re)
-                #create an array compatible with transform, containing the coordinates of the box
-                pts = np.array([[[box[3], box[0]], [box[1], box[0]], [box[1], box[2]], [box[3], box[2]]]], dtype=np.float32)
-                #rotate the box to match the rotated image
-                pts_w = cv2.transform(pts, M)[0]  # remove dimension, extract only points
-                #extract x and y points
-                ys, xs = pts_w[:,1], pts_w[:,0]
-                #save the coordinates of the new box
-                new_box = (int(ys.min()), int(xs.max()), int(ys.max()), int(xs.min()))
-                #crop the picture
-                face = self.crop(aligned, new_box)
-                #convert back to bgr
-                face_bgr = cv2.cvtColor(face, cv2.COLOR_RGB2BGR)
-                #resize
-                out = self.resize(face_bgr)
-                #declare the filename's path
-                fn = dst / src.name
-                #save the image to that path
-                ok = cv2.imwrite(str(fn), out)
-                status = "Success" if ok else "Failed"
-                print(f"{status}: Writing preprocessed images_raw to {fn}")
+                summary["processed"] += report["processed"]
+                summary["skipped"]   += report["skipped"]
+                summary["failed"].extend((user, f, why) for f, why in report["failed"])
+        return summary
 
 
-if __name__ == "__main__":
-    import sys
-    user = sys.argv[1]
-    FacePreprocessor().process_folder(user)
+MANIFEST_NAME = ".manifest.json"
+
+#one preprocessor per worker process, so dlib's models are loaded once per worker
+_worker = None
+
 
+def _init_worker(*params):
+    global _worker
+    resources.init_worker()
+    _worker = FacePreprocessor(*params)
+
+
+def _process_user(user, raw_root, proc_root):
+    return _worker.process_user(user, raw_root, proc_root, use_manifest=True)
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Align and crop raw face snapshots")
+    ap.add_argument("users", nargs="*", help="users to process (default with --all: every user)")
+    ap.add_argument("--all", action="store_true", help="process every user in the raw image dir")
+    ap.add_argument("--workers", type=int, default=None, help="process pool size")
+    ap.add_argument("--report", default=None, help="write the failure report as json to this path")
+    args = ap.parse_args()
 
+    if len(args.users) == 1 and not args.all and args.workers is None:
+        FacePreprocessor().process_folder(args.users[0])
+    else:
+        if not args.users and not args.all:
+            ap.error("give one or more users or --all")
+        summary = FacePreprocessor().process_many(None if args.all else args.users, workers=args.workers)
+        print(f"processed {summary['processed']}, skipped {summary['skipped']} unchanged, "
+              f"{len(summary['failed'])} failed")
+        for user, fname, why in summary["failed"]:
+            print(f"  {user}/{fname}: {why}")
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump(summary, f, indent=1)
@@ -0,0 +1,73 @@
+import copy
+import numpy as np
+import torch
+from torch import nn
+from resemblyzer import VoiceEncoder
+
+#int8 CPU mode for resemblyzer's speaker encoder: PyTorch dynamic quantization stores the LSTM and
+#linear weights as int8 and quantizes activations on the fly. The result is still a VoiceEncoder,
+#so embed_utterance / embed_speaker are drop-in.
+#the first LSTM layer stays float: its input is the log-mel frame, mostly near zero with a few large
+#bins, and a per-tensor int8 scale over that drops the cosine to the float model to about 0.5;
+#with layer 1 in float the embeddings stay above 0.99 while layers 2-3 and the projection (most of
+#the work) run in int8. Check on real recordings with test/bench_quantized_encoder.py before turning
+#on VOICE_ENCODER_QUANTIZED, the stored templates and thresholds come from the float encoder
+
+QUANT_LAYERS = {nn.LSTM, nn.Linear}
+
+
+class _SplitLSTM(nn.Module):
+    #a multi-layer batch_first LSTM as a 1-layer LSTM followed by the remaining layers, same outputs
+
+    def __init__(self, lstm: nn.LSTM):
+        super().__init__()
+        n, H = lstm.num_layers, lstm.hidden_size
+        self.first = nn.LSTM(lstm.input_size, H, 1, batch_first=True)
+        self.rest  = nn.LSTM(H, H, n - 1, batch_first=True)
+        sd = lstm.state_dict()
+        self.first.load_state_dict({k: v for k, v in sd.items() if k.endswith("_l0")})
+        self.rest.load_state_dict({k[:-1] + str(int(k[-1]) - 1): v for k, v in sd.items()
+                                   if not k.endswith("_l0")})
+
+    def forward(self, x, hidden=None):
+        y, (h0, c0) = self.first(x)
+        y, (h, c)   = self.rest(y)
+        return y, (torch.cat([h0, h]), torch.cat([c0, c]))
+
+
+def _pick_engine():
+    #fbgemm on x86, qnnpack on ARM kiosks
+    engines = torch.backends.quantized.supported_engines
+    for name in ("fbgemm", "x86", "qnnpack"):
+        if name in engines:
+            torch.backends.quantized.engine = name
+            return name
+    raise RuntimeError(f"no int8 quantization engine in this torch build ({engines})")
+
+
+def quantize(encoder: VoiceEncoder) -> VoiceEncoder:
+    #a quantized copy, the float encoder is left as it is
+    if next(encoder.parameters()).device.type != "cpu":
+        raise ValueError("dynamic quantization runs on CPU only")
+    _pick_engine()
+    split = copy.deepcopy(encoder)
+    split.lstm = _SplitLSTM(encoder.lstm)
+    q = torch.quantization.quantize_dynamic(split, QUANT_LAYERS, dtype=torch.qint8)
+    q.lstm.first = split.lstm.first
+    return q.eval()
+
+
+def load_encoder(quantized: bool = False, device=None) -> VoiceEncoder:
+    if not quantized:
+        return VoiceEncoder(device=device)
+    return quantize(VoiceEncoder(device="cpu"))
+
+
+def equivalence(float_encoder, quant_encoder, wavs) -> np.ndarray:
+    #cosine between the float and quantized embedding of every preprocessed wav
+    out = []
+    for wav in wavs:
+        a = float_encoder.embed_utterance(wav)
+        b = quant_encoder.embed_utterance(wav)
+        out.append(float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))))
+    return np.array(out)
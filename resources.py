@@ -0,0 +1,211 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import cv2
+import torch
+from threadpoolctl import threadpool_limits
+
+#one CPU budget for the libraries that bring their own thread pools: torch (intra-op, the voice encoder),
+#OpenCV, BLAS/OpenMP under NumPy and sklearn (through threadpoolctl), and our own process pools
+#profiles are held with a reference count; the highest-priority held profile is the one applied, so an
+#authentication dialog opened while enrollment runs switches everything to "interactive" and the
+#background profile comes back when it closes. Counts <= 0 mean "all cores but that many"
+#across processes: children started through child_env() inherit "background" (training scripts run by
+#an enrollment), and a process holding "interactive" keeps a flag file under models/ fresh; every
+#process polls for other processes' flags (a separate enroll_queue.py worker, the training children)
+#and switches to "interactive" while one is live. Flags not refreshed for FLAG_STALE_SECS are ignored
+#config sets this up, it must not import config (same as model_files)
+
+PRIORITY = ("interactive", "background")   #first held one wins, BASE otherwise
+BASE     = "idle"
+
+ENV_PROFILE     = "AUTH_THREAD_PROFILE"
+FLAG_DIR        = Path(__file__).parent / "models"
+FLAG_PREFIX     = ".interactive."
+POLL_SECS       = 0.5
+FLAG_STALE_SECS = 5.0
+
+_lock      = threading.Lock()
+_released  = threading.Condition(_lock)
+_profiles  = {BASE: {}}
+_held      = dict.fromkeys(PRIORITY, 0)
+_active    = None
+_inherited = None     #profile passed down by the parent process
+_remote    = False    #another process holds "interactive"
+_pinned    = False    #pool worker, stays at one thread per library
+_watcher   = None
+
+
+def cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:   #not on Linux
+        return os.cpu_count() or 1
+
+
+def count(n):
+    #a profile entry as a thread count for this machine
+    c = cores()
+    return min(n, c) if n > 0 else max(1, c + n)
+
+
+def _apply(name):
+    global _active
+    prof = _profiles.get(name, {})
+    if not _pinned:
+        if "torch" in prof:
+            torch.set_num_threads(count(prof["torch"]))
+        if "cv2" in prof:
+            cv2.setNumThreads(count(prof["cv2"]))
+        if "blas" in prof:
+            threadpool_limits(limits=count(prof["blas"]), user_api="blas")
+        if _active is not None and _active != name:
+            print(f"[Resources] {_active} -> {name}: " + ", ".join(f"{k} {count(v)}" for k, v in prof.items()))
+    _active = name
+
+
+def _interactive():
+    return bool(_held["interactive"]) or _remote
+
+
+def _wanted():
+    if _interactive():
+        return "interactive"
+    if _held["background"] or _inherited == "background":
+        return "background"
+    return BASE
+
+
+def _flag():
+    return FLAG_DIR / f"{FLAG_PREFIX}{os.getpid()}"
+
+
+def _set_flag(on):
+    try:
+        if on:
+            FLAG_DIR.mkdir(parents=True, exist_ok=True)
+            _flag().touch()
+        else:
+            _flag().unlink(missing_ok=True)
+    except OSError:
+        pass
+
+
+def _others_interactive():
+    now, own = time.time(), _flag().name
+    try:
+        flags = list(FLAG_DIR.glob(FLAG_PREFIX + "*"))
+    except OSError:
+        return False
+    for f in flags:
+        if f.name == own:
+            continue
+        try:
+            if now - f.stat().st_mtime < FLAG_STALE_SECS:
+                return True
+        except OSError:
+            continue
+    return False
+
+
+def _watch():
+    global _remote
+    while True:
+        time.sleep(POLL_SECS)
+        if _held["interactive"]:
+            _set_flag(True)
+        remote = _others_interactive()
+        with _lock:
+            if remote != _remote:
+                _remote = remote
+                if _wanted() != _active:
+                    _apply(_wanted())
+                _released.notify_all()
+
+
+def setup(profiles):
+    #profiles: {name: {"torch": n, "cv2": n, "blas": n, "pool": n}}, a missing key leaves that library alone
+    global _inherited, _watcher
+    with _lock:
+        _profiles.clear()
+        _profiles.update(profiles)
+        _inherited = os.environ.get(ENV_PROFILE)
+        _apply(_wanted())
+        if _watcher is None:
+            _watcher = threading.Thread(target=_watch, name="resources-watch", daemon=True)
+            _watcher.start()
+
+
+def child_env():
+    #environment for a subprocess doing this process's background work
+    env = dict(os.environ)
+    if _held["background"] or _inherited == "background":
+        env[ENV_PROFILE] = "background"
+    return env
+
+
+def acquire(name):
+    if name not in _held:
+        raise ValueError(f"unknown profile {name!r}, expected one of {PRIORITY}")
+    with _lock:
+        _held[name] += 1
+        if name == "interactive":
+            _set_flag(True)
+        if _wanted() != _active:
+            _apply(_wanted())
+
+
+def release(name):
+    with _lock:
+        if _held[name] <= 0:
+            raise RuntimeError(f"profile {name!r} released more often than acquired")
+        _held[name] -= 1
+        if name == "interactive" and not _held[name]:
+            _set_flag(False)
+        if _wanted() != _active:
+            _apply(_wanted())
+        _released.notify_all()
+
+
+@contextmanager
+def hold(name):
+    acquire(name)
+    try:
+        yield
+    finally:
+        release(name)
+
+
+def current():
+    return _active
+
+
+def yield_to_interactive(max_wait):
+    #background work calls this between steps: waits (at most max_wait seconds) while an
+    #authentication, in this or another process, holds the interactive profile; returns the seconds waited
+    with _lock:
+        if not _interactive():
+            return 0.0
+        t0 = time.monotonic()
+        _released.wait_for(lambda: not _interactive(), timeout=max_wait)
+        return time.monotonic() - t0
+
+
+def pool_size(requested=None, profile=None):
+    #worker processes for a pool started now, an explicit request is only capped at the core count
+    if requested:
+        return count(requested)
+    prof = _profiles.get(profile or _active or BASE, {})
+    return count(prof.get("pool", 0))
+
+
+def init_worker(*_):
+    #process pool initializer: the pool already spreads work over cores, one thread per library each
+    global _pinned
+    _pinned = True
+    torch.set_num_threads(1)
+    cv2.setNumThreads(1)
+    threadpool_limits(limits=1, user_api="blas")
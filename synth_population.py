@@ -0,0 +1,113 @@
+import time
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+from pathlib import Path
+import numpy as np
+
+import db
+import embeddings
+
+#fills a scratch database with synthetic users for scale testing, never point it at the real auth.db
+#each user gets a speaker/face centre, original samples scattered around it and augmented copies close
+#to their original, so thresholds and classifiers see realistic genuine/impostor separation
+#audio is 256-d float32 (resemblyzer), face 128-d float64 (dlib), stored packed as the app writes them
+#or, with legacy=True, as the raw tobytes() rows written before migration 2
+
+AUDIO_DIM = 256
+FACE_DIM  = 128
+METHODS   = ("multimodal", "face_stage", "voice_stage")
+
+
+def _unit(x):
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+
+def _user_rows(rng, n_orig, n_aug):
+    #(modality, orig_id, is_augmented, vector) for one user
+    rows = []
+    #voice embeddings are unit length, cosine ~0.85 within a speaker
+    centre = _unit(rng.standard_normal(AUDIO_DIM)).astype(np.float32)
+    for o in range(1, n_orig + 1):
+        v = _unit(centre + 0.55 * _unit(rng.standard_normal(AUDIO_DIM))).astype(np.float32)
+        rows.append(("audio", f"sample_{o}", 0, v))
+        for _ in range(n_aug):
+            rows.append(("audio", f"sample_{o}", 1,
+                         _unit(v + 0.2 * _unit(rng.standard_normal(AUDIO_DIM))).astype(np.float32)))
+    #face embeddings: centres ~0.9 apart, snapshots ~0.4 from each other (dlib's 0.6 tolerance sits between)
+    centre = rng.normal(0, 0.9 / np.sqrt(2 * FACE_DIM), FACE_DIM)
+    for o in range(1, n_orig + 1):
+        v = centre + rng.normal(0, 0.4 / np.sqrt(2 * FACE_DIM), FACE_DIM)
+        rows.append(("face", f"img_{o}", 0, v))
+        for _ in range(n_aug):
+            rows.append(("face", f"img_{o}", 1, v + rng.normal(0, 0.15 / np.sqrt(2 * FACE_DIM), FACE_DIM)))
+    return rows
+
+
+def _blob(vec, legacy, dtype):
+    return vec.tobytes() if legacy else embeddings.pack(vec, dtype)
+
+
+def populate(db_path, n_users, n_orig=5, n_aug=2, n_logs=5, legacy=False, dtype="float32",
+             seed=0, chunk=1_000, prefix="user"):
+    #returns the usernames written, appends to an existing scratch db
+    db_path = Path(db_path)
+    rng  = np.random.default_rng(seed)
+    conn = sqlite3.connect(db_path)
+    db._create_tables(conn.cursor())
+    conn.commit()
+    if not legacy:
+        db.migrate(conn)
+    #a scratch db does not need durability, this keeps 100k users in the minutes range
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+
+    start = conn.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+    names = [f"{prefix}{start + i}" for i in range(1, n_users + 1)]
+    t0    = datetime(2024, 1, 1)
+    tick  = time.perf_counter()
+    for lo in range(0, n_users, chunk):
+        batch = names[lo:lo + chunk]
+        users, audio, face, logs = [], [], [], []
+        for k, name in enumerate(batch):
+            uid = start + lo + k + 1
+            users.append((uid, name))
+            for modality, orig, aug, vec in _user_rows(rng, n_orig, n_aug):
+                row = (uid, orig, aug, _blob(vec, legacy, dtype))
+                (audio if modality == "audio" else face).append(row)
+            for _ in range(n_logs):
+                ts = t0 + timedelta(seconds=int(rng.integers(0, 365 * 86400)))
+                logs.append((name, METHODS[int(rng.integers(len(METHODS)))],
+                             "granted" if rng.random() < 0.8 else "denied",
+                             ts.strftime("%Y-%m-%d %H:%M:%S")))
+        with conn:
+            conn.executemany("INSERT INTO users(id, username) VALUES (?, ?)", users)
+            conn.executemany("INSERT INTO audio_embeddings(user_id, orig_id, is_augmented, embedding) "
+                             "VALUES (?, ?, ?, ?)", audio)
+            conn.executemany("INSERT INTO face_embeddings(user_id, orig_id, is_augmented, embedding) "
+                             "VALUES (?, ?, ?, ?)", face)
+            conn.executemany("INSERT INTO logs(username, method, status, timestamp) VALUES (?, ?, ?, ?)", logs)
+        done = lo + len(batch)
+        if n_users >= 10 * chunk and done % (10 * chunk) == 0:
+            print(f"[Synth] {done}/{n_users} users, {time.perf_counter() - tick:.0f}s")
+    conn.close()
+    return names
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Fill a scratch database with synthetic users")
+    ap.add_argument("db_path", type=Path, help="scratch database file (created if missing)")
+    ap.add_argument("n_users", type=int)
+    ap.add_argument("--orig", type=int, default=5, help="original samples per user and modality")
+    ap.add_argument("--aug", type=int, default=2, help="augmented rows per original")
+    ap.add_argument("--logs", type=int, default=5, help="log rows per user")
+    ap.add_argument("--dtype", default="float32", choices=sorted(embeddings.DTYPES))
+    ap.add_argument("--legacy", action="store_true", help="write pre-migration raw rows")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    if args.db_path.resolve() == Path(db.DB_PATH).resolve():
+        ap.error("refusing to write synthetic users into the real database")
+    t0 = time.perf_counter()
+    populate(args.db_path, args.n_users, args.orig, args.aug, args.logs, args.legacy, args.dtype, args.seed)
+    print(f"[Synth] {args.n_users} users written to {args.db_path} in {time.perf_counter() - t0:.1f}s")
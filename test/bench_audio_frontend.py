@@ -0,0 +1,67 @@
+import sys
+import time
+import tempfile
+from pathlib import Path
+import numpy as np
+import soundfile as sf
+import librosa
+from resemblyzer import preprocess_wav
+import denoise_audio
+from audio_frontend import AudioFrontEnd
+
+#per-sample preprocessing CPU of the old enrollment chain vs the single-pass front end
+#the encoder calls are identical in both chains and are left out
+#usage (from the repo root): PYTHONPATH=. python test/bench_audio_frontend.py [wav ...]
+N_CANDIDATES = 10     #augmentation candidates embedded per clip
+REPEATS      = 3
+
+
+def synth_clip(secs=5.0, sr=48000):
+    #voiced bursts over background noise, stereo at 48 kHz like a typical usb mic
+    t = np.arange(int(secs * sr)) / sr
+    env = (np.sin(2 * np.pi * 0.7 * t) > 0).astype(np.float32)
+    voice = sum(np.sin(2 * np.pi * f * t) / k for k, f in enumerate((140, 280, 420, 560), start=1))
+    y = 0.2 * env * voice + 0.01 * np.random.randn(len(t))
+    return np.stack([y, y], axis=1).astype(np.float32), sr
+
+
+def old_chain(raw_path, tmp):
+    clean_path = str(Path(tmp) / "clean.wav")
+    denoise_audio.denoise_file(raw_path, clean_path)
+    y, _ = librosa.load(clean_path, sr=denoise_audio.SR)
+    preprocess_wav(clean_path)
+    for _ in range(N_CANDIDATES):
+        preprocess_wav(y, source_sr=denoise_audio.SR)
+
+
+def new_chain(raw_path, fe):
+    fe.clear()
+    fe.load(raw_path)
+    #augmented candidates are embedded as they are, no per-candidate preprocessing
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    paths = sys.argv[1:]
+    if not paths:
+        y, sr = synth_clip()
+        paths = [str(Path(tmp) / "raw.wav")]
+        sf.write(paths[0], y, sr)
+
+    fe = AudioFrontEnd()
+    timings = {"old": [], "new": []}
+    for path in paths:
+        for _ in range(REPEATS):
+            t0 = time.perf_counter()
+            old_chain(path, tmp)
+            timings["old"].append(time.perf_counter() - t0)
+
+            t0 = time.perf_counter()
+            new_chain(path, fe)
+            timings["new"].append(time.perf_counter() - t0)
+
+    old_ms = np.median(timings["old"]) * 1000
+    new_ms = np.median(timings["new"]) * 1000
+    print(f" clips                : {len(paths)} x {REPEATS}")
+    print(f" old chain per sample : {old_ms:.1f} ms")
+    print(f" front end per sample : {new_ms:.1f} ms")
+    print(f" saving               : {old_ms - new_ms:.1f} ms ({(1 - new_ms / old_ms) * 100:.0f} %)")
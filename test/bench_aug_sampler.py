@@ -0,0 +1,86 @@
+import sys
+import time
+import tempfile
+from pathlib import Path
+import numpy as np
+import config
+from aug_sampler import AugSampler
+import augment_data
+
+#encoder calls per accepted augmentation, blind sampling vs the adaptive sampler
+#simulated: every arm of augment_data.VOICE_ARMS gets a fixed acceptance rate (a few good bins, most poor)
+#and clips are augmented with the N_AUG / MAX_TRIES loop; the adaptive run persists its statistics to a
+#scratch file after every clip and is restarted from it halfway, like a second enrollment session
+#real: with wav files or directories as arguments, augment_data.augment_array runs on them both ways
+#usage (from the repo root): PYTHONPATH=. python test/bench_aug_sampler.py [wav or dir ...]
+N_CLIPS = 400
+ARMS    = augment_data.VOICE_ARMS
+#acceptance rate per arm: the outer bins of every type are good, the inner ones poor
+RATES = {(t, i): (0.6 if i in (0, len(bins) - 1) else 0.15) - 0.1 * (t == "noise")
+         for t, bins in ARMS.items() for i in range(len(bins))}
+
+
+def simulate(sampler, rng, n_clips):
+    calls, kept, short = 0, 0, 0
+    for c in range(n_clips):
+        got, tries = 0, 0
+        while got < config.N_AUG and tries < config.MAX_TRIES:
+            tries += 1
+            if sampler is None:
+                #uniform type, uniform value in its range
+                t = list(ARMS)[rng.integers(len(ARMS))]
+                arm = (t, int(rng.integers(len(ARMS[t]))))
+            else:
+                arm = sampler.choose()
+            ok = rng.random() < RATES[arm]
+            got += ok
+            if sampler is not None:
+                sampler.update(arm, ok)
+        calls += tries
+        kept  += got
+        short += got < config.N_AUG
+        if sampler is not None:
+            sampler.save()
+    return calls, kept, short
+
+
+def report(label, calls, kept, short, n_clips):
+    print(f"{label:<10s} {calls / max(kept, 1):6.2f} calls/accepted  {kept / n_clips:5.2f} kept/clip  "
+          f"{short / n_clips:6.1%} clips short of N_AUG")
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    path = Path(tmp) / "aug_sampler_voice.json"
+    np.random.seed(0)
+    rng = np.random.default_rng(0)
+    print(f"simulated, {N_CLIPS} clips, N_AUG={config.N_AUG}, MAX_TRIES={config.MAX_TRIES}, "
+          f"mean arm acceptance {np.mean(list(RATES.values())):.2f}")
+    report("blind", *simulate(None, rng, N_CLIPS), N_CLIPS)
+    first  = simulate(AugSampler("voice", ARMS, path), rng, N_CLIPS // 2)
+    second = simulate(AugSampler("voice", ARMS, path), rng, N_CLIPS // 2)   # restarted from the saved file
+    report("adaptive", *(a + b for a, b in zip(first, second)), N_CLIPS)
+    print(f"{'oracle':<10s} {1 / max(RATES.values()):6.2f} calls/accepted (always the best arm)")
+
+    if len(sys.argv) > 1:
+        from audio_frontend import frontend
+        paths = []
+        for a in map(Path, sys.argv[1:]):
+            paths += sorted(a.rglob("*.wav")) if a.is_dir() else [a]
+        clips = []
+        for p in paths:
+            y, _ = frontend.load(p, denoise=False)
+            clips.append((p.name, y, config.get_encoder().embed_utterance(y)))
+        augment_data.sampler = AugSampler("voice", augment_data.VOICE_ARMS, Path(tmp) / "real.json")
+        embed, calls = augment_data.embed_augmented, [0]
+
+        def counted(*args, **kw):
+            calls[0] += 1
+            return embed(*args, **kw)
+        augment_data.embed_augmented = counted
+        for adaptive in (False, True):
+            config.ADAPTIVE_AUG = adaptive
+            calls[0], kept, t0 = 0, 0, time.perf_counter()
+            for name, y, emb in clips:
+                kept += len(augment_data.augment_array(y, augment_data.SR, emb, name=name))
+            print(f"real {'adaptive' if adaptive else 'blind':<8s} {calls[0] / max(kept, 1):6.2f} calls/accepted, "
+                  f"{kept} kept from {len(clips)} clips in {time.perf_counter() - t0:.0f}s")
@@ -0,0 +1,85 @@
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+from pathlib import Path
+import numpy as np
+import db
+import embeddings
+
+#usage (from the repo root): PYTHONPATH=. python test/bench_db_indexes.py [n_users ...]
+USER_COUNTS   = [int(a) for a in sys.argv[1:]] or [10_000, 100_000]
+ROWS_PER_USER = 3
+N_LOOKUPS     = 500
+EMB_DIM       = 256
+
+LOOKUP_SQL = """
+    SELECT a.embedding
+      FROM audio_embeddings a
+      JOIN users u ON u.id = a.user_id
+     WHERE u.username = ?
+"""
+DELETE_SQL = "DELETE FROM audio_embeddings WHERE user_id = ?"
+
+
+def query_plan(conn, sql, params):
+    rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return [r[-1] for r in rows]
+
+
+def populate(path, n_users):
+    conn = sqlite3.connect(path)
+    db._create_tables(conn.cursor())
+    #the readers filter on migration 4's column; add only that, the "before" timings stay index-free
+    db._m4_template_sets(conn)
+    blob = embeddings.pack(np.random.randn(EMB_DIM))
+    conn.executemany("INSERT INTO users(id, username) VALUES (?, ?)",
+                     ((i, f"user{i}") for i in range(1, n_users + 1)))
+    for table in ("audio_embeddings", "face_embeddings"):
+        conn.executemany(
+            f"INSERT INTO {table}(user_id, orig_id, is_augmented, embedding) VALUES (?, ?, ?, ?)",
+            ((uid, f"sample_{k}", int(k > 0), blob)
+             for uid in range(1, n_users + 1) for k in range(ROWS_PER_USER)))
+    conn.commit()
+    conn.close()
+
+
+def time_lookups(n_users):
+    names = [f"user{random.randint(1, n_users)}" for _ in range(N_LOOKUPS)]
+    t0 = time.perf_counter()
+    for name in names:
+        embs = db.get_audio_embeddings(name)
+        assert len(embs) == ROWS_PER_USER
+    return (time.perf_counter() - t0) / N_LOOKUPS * 1000
+
+
+for n_users in USER_COUNTS:
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "bench.db"
+        populate(db.DB_PATH, n_users)
+
+        conn = sqlite3.connect(db.DB_PATH)
+        before_plan = query_plan(conn, DELETE_SQL, (1,))
+        conn.close()
+        before_ms = time_lookups(n_users)
+
+        #init_db only adds what is missing: migrations on top of existing tables
+        db.init_db()
+
+        conn = sqlite3.connect(db.DB_PATH)
+        assert db.schema_version(conn) == db.SCHEMA_VERSION
+        lookup_plan = query_plan(conn, LOOKUP_SQL, ("user1",))
+        delete_plan = query_plan(conn, DELETE_SQL, (1,))
+        conn.close()
+        after_ms = time_lookups(n_users)
+
+        print(f"\n{n_users:,} users, {n_users * ROWS_PER_USER:,} rows per table")
+        print(f" plan (lookup) : {lookup_plan}")
+        print(f" plan (delete) : {delete_plan} (was {before_plan})")
+        print(f" lookup before : {before_ms:.3f} ms")
+        print(f" lookup after  : {after_ms:.3f} ms")
+
+        assert any("idx_audio_embeddings_user" in d for d in lookup_plan), lookup_plan
+        assert any("idx_audio_embeddings_user" in d for d in delete_plan), delete_plan
+        assert all("SCAN" not in d for d in lookup_plan), lookup_plan
@@ -0,0 +1,45 @@
+import sys
+import time
+from pathlib import Path
+import cv2
+import numpy as np
+import config
+from preprocess_faces import FacePreprocessor
+
+#compares the full-resolution align/crop path with the fast ROI path on raw snapshots
+#usage (from the repo root): PYTHONPATH=. python test/bench_face_align.py [image_dir ...]
+dirs   = [Path(d) for d in sys.argv[1:]] or [config.RAW_FACE_DIR]
+images = sorted(p for d in dirs for p in d.rglob("*.jpg"))
+
+reference = FacePreprocessor(fast=False)
+fast      = FacePreprocessor(fast=True)
+
+t_ref = t_fast = 0.0
+diffs, missed = [], 0
+for path in images:
+    img = cv2.imread(str(path))
+    if img is None:
+        continue
+
+    t0 = time.perf_counter()
+    ref = reference.process_image(img)
+    t1 = time.perf_counter()
+    out = fast.process_image(img)
+    t2 = time.perf_counter()
+    t_ref  += t1 - t0
+    t_fast += t2 - t1
+
+    if ref is None or out is None:
+        missed += (ref is None) != (out is None)
+        continue
+    diffs.append(np.abs(ref.astype(np.int16) - out.astype(np.int16)))
+
+n = max(1, len(images))
+print(f" images            : {len(images)}")
+print(f" reference / image : {t_ref / n * 1000:.1f} ms")
+print(f" fast / image      : {t_fast / n * 1000:.1f} ms")
+print(f" detection differs : {missed}")
+if diffs:
+    d = np.stack(diffs)
+    print(f" mean |diff|       : {d.mean():.2f}")
+    print(f" p99 |diff|        : {np.percentile(d, 99):.1f}")
@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import numpy as np
+from sklearn.pipeline      import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm           import SVC, LinearSVC
+from sklearn.calibration   import CalibratedClassifierCV
+import embeddings
+import face_index
+
+#usage (from the repo root): PYTHONPATH=. python test/bench_face_engines.py [n_users ...]
+#synthetic 128-d embeddings shaped like dlib's: user centres about 0.9 apart, snapshots about 0.4 from each other
+#svm is the production model (one-vs-one SVC, isotonic calibration): calibrating it scores every pairwise
+#classifier on a third of the data at once, which no longer fits in memory past a few hundred users, so it
+#runs up to SVM_MAX_USERS. linsvm is a one-vs-rest LinearSVC behind the same calibration, the SVM that still
+#fits at 1k users, run up to LINSVM_MAX_USERS. Above its cap an engine's fit time and latency are
+#extrapolated from its two largest measured runs (power law in the user count) and printed as such
+USER_COUNTS      = [int(a) for a in sys.argv[1:]] or [100, 300, 1_000, 10_000]
+SVM_MAX_USERS    = int(os.environ.get("SVM_MAX_USERS", 300))
+LINSVM_MAX_USERS = int(os.environ.get("LINSVM_MAX_USERS", 1_000))
+N_ORIG        = 5      #snapshots per user
+N_AUG         = 2      #augmented copies per snapshot
+N_QUERIES     = 300
+N_LATENCY     = 30     #single-frame calls timed per engine
+DIM           = 128
+CENTRE_SIGMA  = 0.9 / np.sqrt(2 * DIM)
+SNAP_SIGMA    = 0.4 / np.sqrt(2 * DIM)
+AUG_SIGMA     = 0.15 / np.sqrt(2 * DIM)
+
+rng = np.random.default_rng(0)
+
+
+def synth(n_users):
+    centres = rng.normal(0, CENTRE_SIGMA, (n_users, DIM))
+    rows, X, y = [], [], []
+    for u in range(n_users):
+        for o in range(N_ORIG):
+            snap = centres[u] + rng.normal(0, SNAP_SIGMA, DIM)
+            for a in range(N_AUG + 1):
+                v = snap if a == 0 else snap + rng.normal(0, AUG_SIGMA, DIM)
+                rows.append((len(rows), f"img_{o}", int(a > 0), f"user{u}", embeddings.pack(v)))
+                X.append(v); y.append(f"user{u}")
+    who = rng.integers(0, n_users, N_QUERIES)
+    queries = centres[who] + rng.normal(0, SNAP_SIGMA, (N_QUERIES, DIM))
+    return rows, np.array(X, np.float32), np.array(y), queries, [f"user{u}" for u in who], centres
+
+
+def per_frame(model, classes, queries, truth):
+    #accuracy over every query in one batch, latency as the capture thread sees it (one face per call)
+    pred = np.argmax(model.predict_proba(queries), axis=1)
+    acc = np.mean([classes[i] == t for i, t in zip(pred, truth)])
+    t0 = time.perf_counter()
+    for q in queries[:N_LATENCY]:
+        model.predict_proba(q.reshape(1, -1))
+    return acc, (time.perf_counter() - t0) / N_LATENCY * 1000
+
+
+def svm(name):
+    if name == "svm":
+        clf = SVC(kernel="linear", probability=False, class_weight="balanced", random_state=42)
+    else:
+        clf = LinearSVC(class_weight="balanced", random_state=42)
+    return CalibratedClassifierCV(make_pipeline(StandardScaler(with_mean=False), clf), method="isotonic", cv=3)
+
+
+def extrapolate(name, n_users):
+    runs = measured[name][-2:]
+    if len(runs) < 2:
+        print(f"  {name:<6s} skipped, needs two measured user counts to extrapolate from")
+        return
+    (n1, f1, m1), (n2, f2, m2) = runs
+    k = np.log(n_users / n2)
+    fe, me = np.log(f2 / f1) / np.log(n2 / n1), np.log(m2 / m1) / np.log(n2 / n1)
+    print(f"  {name:<6s} top-1   n/a  {m2 * np.exp(me * k):7.2f} ms/frame  full fit {f2 * np.exp(fe * k):7.1f}s  "
+          f"EXTRAPOLATED from {n1}/{n2} users (fit ~ users^{fe:.2f}), not run")
+
+
+measured = {"svm": [], "linsvm": []}
+for n_users in USER_COUNTS:
+    rows, X, y, queries, truth, centres = synth(n_users)
+    print(f"\n{n_users} users, {len(rows)} embeddings")
+
+    t0 = time.perf_counter()
+    data = face_index.train(rows)
+    fit_s = time.perf_counter() - t0
+    index = data["model"]
+    acc, ms = per_frame(index, index.classes_, queries, truth)
+
+    #enrolling one more user: templates appended, nothing refitted
+    new = rng.normal(0, CENTRE_SIGMA, DIM) + rng.normal(0, SNAP_SIGMA, (N_ORIG * (N_AUG + 1), DIM))
+    t0 = time.perf_counter()
+    index.add_user("new_user", new)
+    add_ms = (time.perf_counter() - t0) * 1000
+    print(f"  index  top-1 {acc:.3f}  {ms:7.2f} ms/frame  full fit {fit_s:7.1f}s  enroll one user {add_ms:.1f} ms")
+
+    for name, cap in (("svm", SVM_MAX_USERS), ("linsvm", LINSVM_MAX_USERS)):
+        if n_users > cap:
+            if name == "svm":
+                gb = len(X) / 3 * n_users * (n_users - 1) / 2 * 8 / 1e9
+                print(f"  {name:<6s} not run (> SVM_MAX_USERS={cap}), calibration needs a {gb:,.1f} GB decision matrix")
+            extrapolate(name, n_users)
+            continue
+        t0 = time.perf_counter()
+        try:
+            model = svm(name)
+            model.fit(X, y)
+            fit_s = time.perf_counter() - t0
+            acc, ms = per_frame(model, list(model.classes_), queries, truth)
+        except MemoryError as e:
+            print(f"  {name:<6s} out of memory after {time.perf_counter() - t0:.1f}s: {e}")
+            continue
+        measured[name].append((n_users, fit_s, ms))
+        #a new user means a full refit
+        print(f"  {name:<6s} top-1 {acc:.3f}  {ms:7.2f} ms/frame  full fit {fit_s:7.1f}s  enroll one user = full fit")
@@ -0,0 +1,107 @@
+import io
+import sys
+import time
+from pathlib import Path
+import numpy as np
+import torch
+from scipy.signal import lfilter
+from resemblyzer import VoiceEncoder, preprocess_wav
+import config
+import quantized_encoder
+
+#float vs int8 dynamically quantized speaker encoder on this machine's CPU
+#equivalence: cosine between the two embeddings of every utterance, should stay above MIN_COSINE
+#latency: median embed_utterance time per utterance, at the default torch thread count and at one thread
+#memory: serialized weights and resident set growth when the encoder is loaded
+#usage (from the repo root): PYTHONPATH=. python test/bench_quantized_encoder.py [wav or dir ...]
+#without arguments the cleaned enrollment recordings are used, synthetic clips if there are none
+MIN_COSINE = 0.98
+MAX_UTTS   = 50
+REPEATS    = 5
+
+
+def rss_mb():
+    #resident set size on Linux, 0 elsewhere
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def weights_mb(model):
+    buf = io.BytesIO()
+    torch.save(model.state_dict(), buf)
+    return buf.tell() / 1e6
+
+
+def utterances():
+    paths = []
+    for a in map(Path, sys.argv[1:] or [config.CLEAN_VOICE_DIR]):
+        if a.is_dir():
+            paths += sorted(a.rglob("*.wav"))
+        elif a.exists():
+            paths.append(a)
+    if paths:
+        return [preprocess_wav(p) for p in paths[:MAX_UTTS]], f"{min(len(paths), MAX_UTTS)} recordings"
+    #syllable-like bursts: a jittered glottal pulse train (or noise) through three random formant
+    #resonators; no speaker identity, but a log-mel distribution close enough to speech for the check
+    rng = np.random.default_rng(0)
+    clips = []
+    for _ in range(10):
+        out, pos = np.zeros(16000 * 5), 0
+        while pos < len(out):
+            seg = int(rng.uniform(0.08, 0.25) * 16000)
+            f0 = rng.uniform(90, 220) * (1 + 0.05 * np.sin(np.linspace(0, 3, seg)))
+            y = (np.diff(np.floor(np.cumsum(f0 / 16000)), prepend=0) > 0).astype(float)
+            if rng.random() < 0.25:
+                y = 0.3 * rng.standard_normal(seg)
+            for F, B in zip(rng.uniform([300, 900, 2200], [900, 2200, 3200]), (80, 120, 180)):
+                r = np.exp(-np.pi * B / 16000)
+                y = lfilter([1 - r], [1, -2 * r * np.cos(2 * np.pi * F / 16000), r * r], y)
+            out[pos:pos + seg] += (y * np.hanning(seg))[:len(out) - pos]
+            pos += seg + int(rng.uniform(0, 0.1) * 16000)
+        out = 0.5 * out / np.abs(out).max() + 0.003 * rng.standard_normal(len(out))
+        clips.append(preprocess_wav(out.astype(np.float32), source_sr=16000))
+    return clips, "10 synthetic speech-like clips"
+
+
+def latency_ms(encoder, wavs):
+    encoder.embed_utterance(wavs[0])   # warm-up
+    times = []
+    for wav in wavs:
+        t0 = time.perf_counter()
+        for _ in range(REPEATS):
+            encoder.embed_utterance(wav)
+        times.append((time.perf_counter() - t0) / REPEATS * 1000)
+    return float(np.median(times))
+
+
+wavs, source = utterances()
+print(f"{source}, median length {np.median([len(w) for w in wavs]) / 16000:.1f}s, "
+      f"torch {torch.__version__}, {torch.get_num_threads()} threads")
+
+before = rss_mb()
+fenc = VoiceEncoder(device="cpu", verbose=False)
+after_float = rss_mb()
+qenc = quantized_encoder.quantize(fenc)
+after_quant = rss_mb()
+print(f"engine {torch.backends.quantized.engine}")
+print(f"weights: float {weights_mb(fenc):.2f} MB, int8 {weights_mb(qenc):.2f} MB; "
+      f"RSS growth: float {after_float - before:.0f} MB, int8 copy {after_quant - after_float:.0f} MB")
+
+cos = quantized_encoder.equivalence(fenc, qenc, wavs)
+ok = cos.min() >= MIN_COSINE
+print(f"cosine float vs int8: mean {cos.mean():.4f}, min {cos.min():.4f}  "
+      f"{'ok' if ok else f'BELOW {MIN_COSINE}'}")
+
+default_threads = torch.get_num_threads()
+for threads in sorted({default_threads, 1}, reverse=True):
+    torch.set_num_threads(threads)
+    f_ms, q_ms = latency_ms(fenc, wavs), latency_ms(qenc, wavs)
+    print(f"{threads} thread(s): float {f_ms:.1f} ms/utt, int8 {q_ms:.1f} ms/utt ({f_ms / q_ms:.2f}x)")
+torch.set_num_threads(default_threads)
+
+sys.exit(0 if ok else 1)
@@ -0,0 +1,121 @@
+import io
+import os
+import sys
+import time
+import runpy
+import random
+import tempfile
+import contextlib
+from pathlib import Path
+import joblib
+import numpy as np
+import db
+import config
+import emb_cache
+import synth_population
+import compute_voice_thresholds
+import train_classifier_svm
+import face_index
+
+#usage (from the repo root): PYTHONPATH=. python test/bench_scale.py [n_users ...]
+#times every db accessor, threshold computation and training on synthetic populations of growing size;
+#the log-log slope between consecutive sizes is compared with the expected growth of each step
+#(0 for per-user lookups, 1 for whole-table work, 2 for all-pairs scoring) and anything clearly
+#steeper is flagged
+#steps whose projected time exceeds BUDGET_S are skipped at the larger sizes
+USER_COUNTS = [int(a) for a in sys.argv[1:]] or [100, 1_000, 10_000, 100_000]
+BUDGET_S    = float(os.environ.get("BUDGET_S", 120))
+N_CALLS     = 200     #per-user accessors are averaged over this many random users
+SLACK       = 0.3     #slope above expected + SLACK is flagged
+
+
+def quiet(fn, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args)
+
+
+def per_call(fn, names):
+    picks = [random.choice(names) for _ in range(N_CALLS)]
+    t0 = time.perf_counter()
+    for name in picks:
+        fn(name)
+    return (time.perf_counter() - t0) / N_CALLS
+
+
+def run_voice_cosine():
+    runpy.run_path(str(Path(__file__).parent / "test_voice_cosine.py"), run_name="__main__")
+
+
+STEPS = [
+    #(name, expected exponent, callable(names, tmp) -> seconds)
+    ("user_exists",               0, lambda names, tmp: per_call(db.user_exists, names)),
+    ("get_audio_embeddings",      0, lambda names, tmp: per_call(db.get_audio_embeddings, names)),
+    ("get_audio_embedding_blobs", 0, lambda names, tmp: per_call(db.get_audio_embedding_blobs, names)),
+    ("get_face_embedding_blobs",  0, lambda names, tmp: per_call(db.get_face_embedding_blobs, names)),
+    ("log_attempt",               0, lambda names, tmp: per_call(lambda n: db.log_attempt(n, "bench", True), names)),
+    ("get_all_usernames",         1, lambda names, tmp: timed(db.get_all_usernames)),
+    ("get_all_audio_blobs",       1, lambda names, tmp: timed(db.get_all_audio_blobs)),
+    ("get_all_face_rows",         1, lambda names, tmp: timed(db.get_all_face_rows)),
+    ("load_embedding_columns",    1, lambda names, tmp: timed(db.load_embedding_columns, "face_embeddings", 128)),
+    ("emb_cache_warm",            1, lambda names, tmp: warm_cache("face_embeddings", 128)),
+    ("delete_user_data",          0, lambda names, tmp: per_call(db.delete_user_data, names[-N_CALLS:])),
+    #every user's first sample is scored against the whole bank: quadratic by definition
+    ("compute_voice_thresholds",  2, lambda names, tmp: timed(quiet, compute_voice_thresholds.compute_thresholds,
+                                                              tmp / "voice.joblib")),
+    ("test_voice_cosine",         1, lambda names, tmp: timed(quiet, run_voice_cosine)),
+    ("train_face_index",          1, lambda names, tmp: timed(quiet, face_index.train, db.get_all_face_rows())),
+    ("train_classifier_svm",      1, lambda names, tmp: timed(quiet, train_classifier_svm.train,
+                                                              db.get_all_face_rows())),
+]
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+
+def warm_cache(table, dim):
+    quiet(emb_cache.EmbeddingCache(table, dim).load)
+    return timed(quiet, emb_cache.EmbeddingCache(table, dim).load)
+
+
+history = {name: [] for name, _, _ in STEPS}   #[(n_users, seconds)]
+for n_users in USER_COUNTS:
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        db.DB_PATH = tmp / "scale.db"
+        config.EMB_CACHE_DIR = tmp / "cache"
+        t0 = time.perf_counter()
+        names = quiet(synth_population.populate, db.DB_PATH, n_users)
+        size_mb = db.DB_PATH.stat().st_size / 1e6
+        print(f"\n{n_users} users: populated in {time.perf_counter() - t0:.1f}s, {size_mb:.0f} MB")
+        joblib.dump({}, tmp / "voice.joblib")
+
+        for name, expected, step in STEPS:
+            past = history[name]
+            if past:
+                last_n, last_t = past[-1]
+                slope = (np.log(last_t / past[-2][1]) / np.log(last_n / past[-2][0])) if len(past) > 1 else expected
+                projected = last_t * (n_users / last_n) ** max(slope, expected)
+                if projected > BUDGET_S:
+                    print(f"  {name:<26s} skipped, projected {projected:,.0f}s")
+                    past.append((n_users, projected))
+                    continue
+            try:
+                secs = step(names, tmp)
+            except MemoryError as e:
+                print(f"  {name:<26s} out of memory: {e}")
+                past.append((n_users, float("inf")))
+                continue
+            past.append((n_users, secs))
+
+            note = ""
+            if len(past) > 1 and np.isfinite(past[-2][1]):
+                slope = np.log(secs / past[-2][1]) / np.log(n_users / past[-2][0])
+                note = f"slope {slope:+.2f}"
+                if slope > expected + SLACK:
+                    note += f"  SUPER-LINEAR (expected {expected})" if expected else "  GROWS WITH N (expected flat)"
+            unit = "ms/call" if expected == 0 else "s"
+            shown = secs * 1000 if expected == 0 else secs
+            print(f"  {name:<26s} {shown:10.3f} {unit:<8s} {note}")
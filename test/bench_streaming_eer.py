@@ -0,0 +1,116 @@
+import io
+import sys
+import time
+import tempfile
+import contextlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import joblib
+import numpy as np
+from sklearn.metrics import roc_curve
+import db
+import config
+import embeddings
+import synth_population
+import compute_voice_thresholds
+from eer import ScoreHistogram
+
+#usage (from the repo root): PYTHONPATH=. python test/bench_streaming_eer.py [n_users]
+#checks the histogram EER against sklearn's roc_curve on the same scores
+#stated tolerance with BINS bins over [-1, 1] (0.001 wide): EER within TOL_EER of roc_curve's, and the
+#histogram threshold applied to the raw scores gives an error rate within TOL_EER of that EER too
+#(TOL_EER bounds the score mass that can sit in the one bin where FAR and FRR cross)
+BINS     = 2000
+TOL_EER  = 0.002
+SIZES    = [10_000, 100_000, 3_000_000]
+N_CHUNKS = 8
+N_USERS  = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+
+rng = np.random.default_rng(0)
+
+
+def exact(genuine, impostor):
+    #the rule compute_voice_thresholds used before: threshold where |FRR - FAR| is smallest
+    labels = np.concatenate([np.ones(len(genuine)), np.zeros(len(impostor))])
+    fpr, tpr, thr = roc_curve(labels, np.concatenate([genuine, impostor]))
+    i = np.nanargmin(np.abs((1 - tpr) - fpr))
+    return (fpr[i] + 1 - tpr[i]) / 2, thr[i]
+
+
+def chunk_hist(scores):
+    genuine, impostor = scores
+    return ScoreHistogram(bins=BINS).add(genuine, impostor)
+
+
+failed = False
+print("scores        exact EER   hist EER   |dEER|   |dthr|   roc_curve    histogram   hist memory")
+for n in SIZES:
+    #cosine-like scores: genuine ~0.75, impostors ~0.1, overlapping tails
+    genuine  = np.clip(rng.normal(0.75, 0.12, n // 10), -1, 1)
+    impostor = np.clip(rng.normal(0.10, 0.18, n), -1, 1)
+    t0 = time.perf_counter()
+    e_eer, e_thr = exact(genuine, impostor)
+    t_exact = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    h = ScoreHistogram(bins=BINS)
+    for g, i in zip(np.array_split(genuine, N_CHUNKS), np.array_split(impostor, N_CHUNKS)):
+        h.add(g, i)
+    h_eer, h_thr = h.eer()
+    t_hist = time.perf_counter() - t0
+
+    #near the crossing |FAR - FRR| is flat between samples, so the threshold is judged by the error
+    #it gives on the raw scores rather than by its distance from roc_curve's pick
+    at_h = (np.mean(genuine < h_thr) + np.mean(impostor >= h_thr)) / 2
+    ok = abs(h_eer - e_eer) <= TOL_EER and abs(at_h - e_eer) <= TOL_EER
+    failed |= not ok
+    mem = h.genuine.nbytes + h.impostor.nbytes
+    print(f"{len(genuine) + n:>10,d}    {e_eer:8.4f}   {h_eer:8.4f}   {abs(h_eer - e_eer):.4f}   "
+          f"{abs(h_thr - e_thr):.4f}   {t_exact * 1000:8.1f} ms  {t_hist * 1000:8.1f} ms   "
+          f"{mem // 1024} KB  {'ok' if ok else 'OUT OF TOLERANCE'}")
+
+    #merging per-process histograms gives exactly the single-pass counts
+    parts = list(zip(np.array_split(genuine, N_CHUNKS), np.array_split(impostor, N_CHUNKS)))
+    with ProcessPoolExecutor(4) as pool:
+        merged = ScoreHistogram(bins=BINS)
+        for part in pool.map(chunk_hist, parts):
+            merged += part
+    same = np.array_equal(merged.genuine, h.genuine) and np.array_equal(merged.impostor, h.impostor)
+    failed |= not same
+    if not same:
+        print("  merged histogram differs from the single-pass one")
+
+#per-user voice thresholds on a synthetic population, against the old per-user roc_curve loop
+with tempfile.TemporaryDirectory() as tmp:
+    tmp = Path(tmp)
+    db.DB_PATH = tmp / "eer.db"
+    config.EMB_CACHE_DIR = tmp / "cache"
+    with contextlib.redirect_stdout(io.StringIO()):
+        synth_population.populate(db.DB_PATH, N_USERS)
+    joblib.dump({}, tmp / "voice.joblib")
+
+    t0 = time.perf_counter()
+    (mat, scales, _), starts, labels = embeddings.labeled_stack(db.get_all_audio_blobs(), dim=config.VOICE_EMB_DIM)
+    bank = mat.astype(np.float32) * scales[:, None]
+    bank /= np.linalg.norm(bank, axis=1, keepdims=True)
+    ends = np.append(starts[1:], len(bank))
+    old = {}
+    for u, user in enumerate(labels):
+        own = bank[starts[u]:ends[u]]
+        i, j = np.triu_indices(len(own), 1)
+        mask = np.ones(len(bank), bool)
+        mask[starts[u]:ends[u]] = False
+        _, old[user] = exact(np.sum(own[i] * own[j], axis=1), bank[mask] @ own[0])
+    t_old = time.perf_counter() - t0
+
+    for workers in (1, 4):
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            new = compute_voice_thresholds.compute_thresholds(tmp / "voice.joblib", workers=workers)
+        t_new = time.perf_counter() - t0
+        diff = np.array([abs(new[u] - old[u]) for u in old])
+        #per-user curves are coarse (a few dozen genuine pairs), the crossing can move by a few bins
+        print(f"\n{N_USERS} users, {workers} worker(s): per-user thresholds max |dthr| {diff.max():.4f}, "
+              f"median {np.median(diff):.4f}; exact loop {t_old:.2f}s, streaming {t_new:.2f}s")
+
+sys.exit(1 if failed else 0)
@@ -0,0 +1,63 @@
+import sys
+import time
+import numpy as np
+from voice_index import VoiceIndex, exact_search
+
+#usage (from the repo root): PYTHONPATH=. python test/bench_voice_index.py [n_users ...]
+#recall@1 is the share of queries whose top user matches exact search over every row
+USER_COUNTS   = [int(a) for a in sys.argv[1:]] or [1_000, 10_000]
+ROWS_PER_USER = 20
+N_QUERIES     = 300
+EMB_DIM       = 256
+SPREAD        = 0.35   #within-speaker spread relative to the unit speaker centre
+NPROBES       = [1, 2, 4, 8, 16, 32]
+
+rng = np.random.default_rng(0)
+
+
+def unit(x):
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+
+def synth(n_users):
+    #speaker centres on the sphere, utterances scattered around them
+    centres = unit(rng.standard_normal((n_users, EMB_DIM)).astype(np.float32))
+    vecs = unit(np.repeat(centres, ROWS_PER_USER, axis=0)
+                + SPREAD * rng.standard_normal((n_users * ROWS_PER_USER, EMB_DIM)).astype(np.float32)
+                / np.sqrt(EMB_DIM))
+    labels = [f"user{i}" for i in range(n_users) for _ in range(ROWS_PER_USER)]
+    who = rng.integers(0, n_users, N_QUERIES)
+    queries = unit(centres[who] + SPREAD * rng.standard_normal((N_QUERIES, EMB_DIM)).astype(np.float32)
+                   / np.sqrt(EMB_DIM))
+    return vecs, labels, queries
+
+
+for n_users in USER_COUNTS:
+    vecs, labels, queries = synth(n_users)
+    print(f"\n{n_users} users, {len(vecs)} rows")
+
+    t0 = time.perf_counter()
+    truth = [exact_search(q, vecs, labels, k=1, normalized=True)[0][0] for q in queries]
+    exact_ms = (time.perf_counter() - t0) / N_QUERIES * 1000
+    print(f"  exact       {exact_ms:8.2f} ms/query  recall@1 1.000")
+
+    t0 = time.perf_counter()
+    half = len(vecs) // 2
+    index = VoiceIndex().build(vecs[:half], labels[:half])
+    build_s = time.perf_counter() - t0
+    #the second half goes in through the incremental path, as enrollments would
+    t0 = time.perf_counter()
+    for start in range(half, len(vecs), ROWS_PER_USER):
+        index.add(vecs[start:start + ROWS_PER_USER], labels[start:start + ROWS_PER_USER])
+    add_ms = (time.perf_counter() - t0) / ((len(vecs) - half) / ROWS_PER_USER) * 1000
+    print(f"  build {build_s:.1f}s for half the rows, then {add_ms:.2f} ms per enrolled user, "
+          f"{len(index.centroids)} lists")
+
+    for nprobe in NPROBES:
+        if nprobe > len(index.centroids):
+            break
+        t0 = time.perf_counter()
+        got = [index.search(q, k=1, nprobe=nprobe)[0][0] for q in queries]
+        ms = (time.perf_counter() - t0) / N_QUERIES * 1000
+        recall = np.mean([g == t for g, t in zip(got, truth)])
+        print(f"  nprobe={nprobe:<4d} {ms:8.2f} ms/query  recall@1 {recall:.3f}  ({exact_ms / ms:.1f}x)")
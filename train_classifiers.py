@@ -0,0 +1,226 @@
+import time
+import argparse
+import collections
+from pathlib import Path
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.pipeline      import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm           import SVC
+from sklearn.linear_model  import LogisticRegression
+from sklearn.ensemble      import RandomForestClassifier
+from sklearn.calibration   import CalibratedClassifierCV
+from sklearn.metrics       import classification_report, confusion_matrix
+import config
+import embeddings
+import emb_cache
+import model_files
+import resources
+from eer import ScoreHistogram, column_thresholds
+
+#face classifier training in one place: the embeddings are loaded once (through the embedding cache),
+#split by original snapshot, and every requested estimator from the registry is fitted and scored in
+#parallel under a CPU budget; train_classifier_svm.py and test/train_classifier_lr.py / _rf.py
+#are thin wrappers around it
+#usage: python train_classifiers.py [svm lr rf ...] [--jobs N] [--no-save] [--no-cache] [--out table.txt]
+
+DIM_FACE       = 128
+ZERO_DIV       = 0
+N_VAL_PER_USER = 2
+MIN_TRAIN_ROWS = 3      #every user needs a row in each of the 3 calibration folds
+N_LATENCY      = 30     #single-frame predict calls timed per model
+
+Estimator  = collections.namedtuple("Estimator", "build model_file key max_threshold")
+ESTIMATORS = {}
+
+
+def register(name, model_file, key=None, max_threshold=1.0):
+    #decorator for build(n_jobs) -> unfitted classifier with predict_proba
+    def wrap(build):
+        ESTIMATORS[name] = Estimator(build, Path(model_file), key or name, max_threshold)
+        return build
+    return wrap
+
+
+@register("svm", config.FACE_MODEL_FILE, max_threshold=0.95)
+def _svm(n_jobs):
+    base = make_pipeline(StandardScaler(with_mean=False),
+                         SVC(kernel="linear", probability=False, class_weight="balanced", random_state=42))
+    return CalibratedClassifierCV(base, method="isotonic", cv=3, n_jobs=n_jobs)
+
+
+@register("lr", config.MODELS_DIR / "face_lr_model.joblib")
+def _lr(n_jobs):
+    base = make_pipeline(StandardScaler(),
+                         LogisticRegression(max_iter=500, class_weight="balanced", random_state=42))
+    return CalibratedClassifierCV(base, method="isotonic", cv=3, n_jobs=n_jobs)
+
+
+@register("rf", config.MODELS_DIR / "face_rf_model.joblib")
+def _rf(n_jobs):
+    base = make_pipeline(StandardScaler(),
+                         RandomForestClassifier(n_estimators=100, class_weight="balanced", random_state=42))
+    return CalibratedClassifierCV(base, method="isotonic", cv=3, n_jobs=n_jobs)
+
+
+def decode(blob, dim=DIM_FACE):
+    try:
+        v = embeddings.unpack(blob)
+    except ValueError:
+        return None
+    if v.size != dim or np.any(~np.isfinite(v)):
+        return None
+    return v
+
+
+def _decode_rows(rows):
+    orig, aug, users, X = [], [], [], []
+    for _, orig_id, is_aug, user, blob in rows:
+        v = decode(blob)
+        if v is None:
+            continue
+        orig.append(orig_id); aug.append(is_aug); users.append(user); X.append(v)
+    X = np.stack(X) if X else np.empty((0, DIM_FACE), np.float32)
+    return np.array(orig, str), np.array(aug, np.int8), np.array(users, str), X
+
+
+def load_data(rows=None, use_cache=True):
+    #(orig_ids, is_augmented, users, X) for every decodable face row; without rows the table is read
+    #through the memory-mapped embedding cache, which does not touch SQLite when the db is unchanged
+    if rows is not None:
+        return _decode_rows(rows)
+    cols = emb_cache.load_columns("face_embeddings", DIM_FACE, use_cache)
+    return (np.array(cols.origs, str)[cols.orig_codes], cols.augmented.astype(np.int8),
+            np.array(cols.users, str)[cols.user_idx], cols.X)
+
+
+def eer_threshold(genuine, impostor):
+    #(threshold, eer) for calibrated probabilities, exact to one bin (0.001)
+    eer, thr = ScoreHistogram(0.0, 1.0, 1000).add(genuine, impostor).eer()
+    return thr, eer
+
+
+def split(data, seed=None):
+    #up to N_VAL_PER_USER original snapshots per user are held out; their augmented copies are dropped
+    #entirely so they cannot leak into training. Every other row trains, also augmented rows whose
+    #original is not in the template set and centroid rows, and a user is held out fewer snapshots
+    #rather than left with less than MIN_TRAIN_ROWS training rows
+    orig, aug, users, X = data
+    rng = np.random.default_rng(seed)
+    rows  = collections.defaultdict(collections.Counter)   #user -> orig_id -> rows
+    origs = collections.defaultdict(set)                   #user -> orig_ids with the original row stored
+    for o, a, u in zip(orig, aug, users):
+        rows[u][o] += 1
+        if a == 0:
+            origs[u].add(o)
+    val_pairs = set()
+    for u, o in origs.items():
+        o = sorted(o)
+        rng.shuffle(o)
+        left = sum(rows[u].values())
+        for oid in o[:N_VAL_PER_USER]:
+            if left - rows[u][oid] < MIN_TRAIN_ROWS:
+                break
+            left -= rows[u][oid]
+            val_pairs.add((oid, u))
+    held = np.array([k in val_pairs for k in zip(orig, users)], bool)
+    tr = ~held
+    vl = held & (aug == 0)
+    if not tr.any() or not vl.any():
+        raise RuntimeError("Not enough data after splitting!")
+    return X[tr], users[tr], X[vl], users[vl]
+
+
+def evaluate(name, Xtr, ytr, Xvl, yvl, n_jobs=1, verbose=False):
+    #fits one registry entry, returns (model dict as stored in its model file, metrics, report text)
+    est = ESTIMATORS[name]
+    clf = est.build(n_jobs)
+    t0 = time.perf_counter()
+    clf.fit(Xtr, ytr)
+    fit_s = time.perf_counter() - t0
+
+    classes = list(clf.classes_)
+    pvl = clf.predict_proba(Xvl)
+    col = {c: i for i, c in enumerate(classes)}
+    true_idx = np.array([col[t] for t in yvl])
+    rows = np.arange(len(pvl))
+    genuine = pvl[rows, true_idx]
+    others = pvl.copy()
+    others[rows, true_idx] = -np.inf
+    global_thr, eer = eer_threshold(genuine, others.max(axis=1))
+    _, thr_c = column_thresholds(pvl, true_idx)
+    class_thresholds = {c: min(est.max_threshold, float(t)) for c, t in zip(classes, thr_c) if np.isfinite(t)}
+
+    t0 = time.perf_counter()
+    for x in Xvl[:N_LATENCY]:
+        clf.predict_proba(x.reshape(1, -1))
+    predict_ms = (time.perf_counter() - t0) / min(N_LATENCY, len(Xvl)) * 1000
+
+    pred = np.array(classes)[np.argmax(pvl, axis=1)]
+    metrics = {"fit_s": fit_s, "predict_ms": predict_ms, "accuracy": float(np.mean(pred == yvl)),
+               "eer": eer, "threshold": global_thr}
+    report = ""
+    if verbose:
+        report = ("Validation report:\n"
+                  + classification_report(yvl, pred, labels=classes, target_names=classes, zero_division=ZERO_DIV)
+                  + f"Confusion matrix:\n{confusion_matrix(yvl, pred, labels=classes)}\n"
+                  + f"Equal-Error Rate = {eer:.3f}  |  threshold = {global_thr:.3f}\n")
+    data = {est.key: clf, "classes": classes, "global_threshold": global_thr, "class_thresholds": class_thresholds}
+    return data, metrics, report
+
+
+def train(names=("svm",), rows=None, n_jobs=None, use_cache=True, verbose=True, seed=None):
+    #{name: (model dict, metrics)}; candidates run side by side, each gets an equal share of n_jobs cores
+    #for its calibration folds
+    for name in names:
+        if name not in ESTIMATORS:
+            raise ValueError(f"unknown estimator {name!r}, registered: {', '.join(ESTIMATORS)}")
+    Xtr, ytr, Xvl, yvl = split(load_data(rows, use_cache), seed)
+    print(f"[Train] {len(Xtr)} training rows, {len(Xvl)} validation rows, {len(set(ytr))} users")
+
+    budget = resources.pool_size(n_jobs)
+    outer  = max(1, min(len(names), budget))
+    inner  = max(1, budget // outer)
+    if outer > 1:
+        out = Parallel(n_jobs=outer)(delayed(evaluate)(n, Xtr, ytr, Xvl, yvl, inner, verbose) for n in names)
+    else:
+        out = [evaluate(n, Xtr, ytr, Xvl, yvl, inner, verbose) for n in names]
+
+    results = {}
+    for name, (data, metrics, report) in zip(names, out):
+        if report:
+            print(f"\n[{name}] {report}")
+        results[name] = (data, metrics)
+    return results
+
+
+def comparison_table(results):
+    lines = [f"{'model':<8s} {'fit s':>9s} {'predict ms':>11s} {'accuracy':>9s} {'EER':>7s} {'threshold':>10s}"]
+    for name, (_, m) in results.items():
+        lines.append(f"{name:<8s} {m['fit_s']:9.2f} {m['predict_ms']:11.2f} {m['accuracy']:9.3f} "
+                     f"{m['eer']:7.3f} {m['threshold']:10.3f}")
+    return "\n".join(lines)
+
+
+def main(argv=None, default=("svm",)):
+    ap = argparse.ArgumentParser(description="Train and compare face classifiers")
+    ap.add_argument("names", nargs="*", default=list(default), help=f"any of: {', '.join(ESTIMATORS)}")
+    ap.add_argument("--jobs", type=int, default=None, help="CPU budget shared by all candidates")
+    ap.add_argument("--no-save", action="store_true", help="compare only, do not publish the models")
+    ap.add_argument("--no-cache", action="store_true", help="decode the db rows again")
+    ap.add_argument("--out", type=Path, help="also write the comparison table here")
+    args = ap.parse_args(argv)
+
+    results = train(args.names, n_jobs=args.jobs, use_cache=not args.no_cache)
+    for name, (data, _) in results.items():
+        if not args.no_save:
+            model_files.publish(data, ESTIMATORS[name].model_file)
+            print(f"Saved {name} model with per-class thresholds →", ESTIMATORS[name].model_file)
+    table = comparison_table(results)
+    print("\n" + table)
+    if args.out:
+        args.out.write_text(table + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
 from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLabel, QMessageBox
 from PyQt5.QtGui    import QPixmap, QImage
-from PyQt5.QtCore   import Qt, pyqtSlot
+from PyQt5.QtCore   import Qt, pyqtSlot, QTimer
+import time
 import numpy as np
 from ui.threads.face_capture import FaceCaptureThread
 from ui.threads.voice_capture import VoiceCaptureThread
 import config
-from scipy.spatial.distance import cosine
+import embeddings
+import resources
 import cv2
 
 
@@ -32,12 +34,19 @@ class MultiModalAuthDialog(QDialog):
         self.global_threshold = parent.global_threshold
         self.class_thresholds = parent.class_thresholds
 
+        #interactive thread budget until done(), enrollment running meanwhile gets the leftovers
+        resources.acquire("interactive")
+        self._holds_cpu = True
+
         self.setWindowTitle("Face + Voice Authentication")
         self.setModal(True)
         self.resize(400, 400)
 
+        #either modality may finish first, the decision is taken once both are in
         self.face_result    = None
-        self.voice_result   = None
+        self.voice_scores   = None
+        self._kept          = {}    #modality -> monotonic deadline of a result carried over a retry
+        self._face_missing  = 0
         self._last_border   = "gray"
         self._border_locked = False
         self.voice_live     = True
@@ -70,14 +79,20 @@ class MultiModalAuthDialog(QDialog):
 
         main.addLayout(voice_col)
 
+        self._start_face()
+        self._start_voice()
+
+    def _start_face(self):
         self.face_thr = FaceCaptureThread(self, config.CAM_DEVICE,
                                           config.FRAME_SCALE)
         self.face_thr.processing_signal.connect(
             lambda: self.face_text.setText("Processing…"))
         self.face_thr.frame_signal.connect(self._update_camera)
+        self.face_thr.detect_signal.connect(self._on_face_presence)
         self.face_thr.result_signal.connect(self._on_face)
         self.face_thr.start()
 
+    def _start_voice(self):
         self.voice_thr = VoiceCaptureThread(self.parent(),
                                             required_speech=config.RECORD_SEC)
         self.voice_thr.speech_signal.connect(self._set_voice_dot)
@@ -90,52 +105,111 @@ class MultiModalAuthDialog(QDialog):
     def _on_face(self, name, score, probs):
         self.face_text.hide()
 
-        print("[FaceAuth] class probabilities:")
-        for cls, p in zip(self.face_classes, probs):
-            print(f"    {cls}: {p:.3f}")
+        print("[FaceAuth] top class probabilities:")
+        for i in np.argsort(probs)[::-1][:5]:
+            print(f"    {self.face_classes[i]}: {probs[i]:.3f}")
 
         thr = self.class_thresholds.get(name, self.global_threshold)
         print(f"[FaceAuth] using threshold={thr:.3f} for {name}")
 
         if score < thr:
             config.db.log_attempt(name, "face_stage", False)
-            return self._generic_fail()
+            return self._generic_fail("face")
 
         self.face_result = (name, score)
+        self._face_missing = 0
+        self._try_finish()
+
+    @pyqtSlot(bool)
+    def _on_face_presence(self, found):
+        #the face stream keeps running after a result, a face that leaves the frame takes its result with it
+        if self.face_result is None:
+            return
+        self._face_missing = 0 if found else self._face_missing + 1
+        if self._face_missing >= config.FACE_LOST_FRAMES:
+            print("[FaceAuth] face left the frame, recapturing")
+            self._recapture_face()
 
     @pyqtSlot(np.ndarray)
     def _on_voice_embedding(self, test_emb: np.ndarray):
-        if not self.face_result:
+        #scored against every enrolled user right away, the face result only picks the entry to check
+        p = self.parent()
+        sims = embeddings.cosine_sims(test_emb, p.voice_bank)
+        best = embeddings.best_per_label(sims, p.voice_starts)
+        self.voice_scores = dict(zip(p.voice_users, best.tolist()))
+        if self.voice_scores:
+            top = max(self.voice_scores, key=self.voice_scores.get)
+            print(f"[VoiceAuth] closest voice={top} ({self.voice_scores[top]:.3f})")
+        if config.VOICE_FIRST_ID and p.voice_index is not None:
+            #camera obstructed or nobody holding still: identify by voice alone after a grace period
+            emb, scores = test_emb, self.voice_scores
+            QTimer.singleShot(config.VOICE_ID_WAIT_MS, lambda: self._voice_only(emb, scores))
+        self._try_finish()
+
+    def _voice_only(self, test_emb, scores):
+        #skipped when the face arrived meanwhile or this sample was replaced by a retry
+        if self.face_result is not None or self.voice_scores is not scores or not self.isVisible():
+            return
+        #the IVF index proposes VOICE_ID_CANDIDATES users from VOICE_ID_NPROBE lists, they are re-ranked
+        #by their exact best score so the decision agrees with the face-claimed path in this dialog
+        cands = self.parent().voice_index.search(test_emb, k=config.VOICE_ID_CANDIDATES,
+                                                 nprobe=config.VOICE_ID_NPROBE)
+        hits = sorted(((n, scores.get(n, s)) for n, s in cands), key=lambda kv: kv[1], reverse=True)[:2]
+        if not hits:
+            return
+        name, sim = hits[0]
+        runner_up = hits[1][1] if len(hits) > 1 else -1.0
+        #VOICE_MARGIN is only a fallback next to a matched face, one factor needs a computed threshold
+        thr = self.parent().voice_thresholds.get(name)
+        if thr is None:
+            print(f"[VoiceAuth] voice-only: no threshold for {name}, refusing")
+            config.db.log_attempt(name, "voice_only", False)
+            return self._generic_fail("voice")
+        print(f"[VoiceAuth] voice-only: {name} ({sim:.3f}), runner-up {runner_up:.3f}, threshold {thr:.3f}")
+        if sim < thr or sim - runner_up < config.VOICE_ID_MARGIN:
+            config.db.log_attempt(name, "voice_only", False)
+            return self._generic_fail("voice")
+
+        self.auth_name    = name
+        self.auth_method  = "voice_only"
+        self.auth_success = True
+        self._stop_threads()
+        self.accept()
+
+    def _try_finish(self):
+        if self.face_result is None or self.voice_scores is None:
             return
 
+        #a result kept from the previous attempt is only trusted for RETRY_KEEP_SECS
+        now = time.monotonic()
+        if self._kept.get("face", now) < now:
+            return self._recapture_face()
+        if self._kept.get("voice", now) < now:
+            return self._recapture_voice()
+
         claimed_name, _ = self.face_result
         thr = self.parent().voice_thresholds.get(
             claimed_name, config.VOICE_MARGIN)
         print(f"[VoiceAuth] using voice threshold={thr:.3f} for {claimed_name}")
 
-        genuine = config.db.get_audio_embeddings(claimed_name,
-                                                 emb_dim=test_emb.size)
-        if not genuine:
-            return self._generic_fail()
-
-        best_sim = max(1 - cosine(test_emb, emb) for emb in genuine)
+        best_sim = self.voice_scores.get(claimed_name)
+        if best_sim is None:
+            #claimed user has no voice templates, a voice-only retry could never pass
+            print(f"[VoiceAuth] no voice templates for {claimed_name}")
+            return self._generic_fail(None)
         print(f"[VoiceAuth] best genuine={best_sim:.3f}")
 
         if best_sim < thr:
             config.db.log_attempt(claimed_name, "voice_stage", False)
-            return self._generic_fail()
-
-        self.voice_result = (claimed_name, best_sim)
-        self._try_finish()
+            return self._generic_fail("voice")
 
-    def _try_finish(self):
-        if self.face_result and self.voice_result:
-            self.auth_name    = self.face_result[0]
-            self.auth_success = True
-            self._stop_threads()
-            self.accept()
+        self.auth_name    = claimed_name
+        self.auth_method  = "multimodal"
+        self.auth_success = True
+        self._stop_threads()
+        self.accept()
 
-    def _generic_fail(self):
+    def _generic_fail(self, failed=None):
         self.voice_live = False
         self._set_voice_dot(False)
 
@@ -154,47 +228,66 @@ class MultiModalAuthDialog(QDialog):
         mbox.exec_()
 
         if mbox.clickedButton() is retry:
-            self._restart_capture()
+            self._restart_capture(failed)
         else:
             self.reject()
-    def _restart_capture(self):
-        for thr in (getattr(self, "face_thr", None),
-                    getattr(self, "voice_thr", None)):
-            if thr and thr.isRunning():
-                thr.requestInterruption()
-                thr.wait()
 
+    def _recapture_face(self):
+        self._kept.pop("face", None)
+        self.face_result   = None
+        self._face_missing = 0
         self.face_text.setText("Hold still…")
         self.face_text.show()
-        self.voice_live = True
-        self._set_voice_dot(False)
-        self.voice_text.setText("Waiting for speech…")
         self._set_border("gray")
         self._last_border   = "gray"
         self._border_locked = False
+        if self.face_thr.isRunning():
+            #same thread and camera stream, only stabilization and scoring start over
+            self.face_thr.rearm()
+        else:
+            self._start_face()
+
+    def _recapture_voice(self):
+        self._kept.pop("voice", None)
+        self.voice_scores = None
+        if self.voice_thr.isRunning():
+            self.voice_thr.requestInterruption()
+            self.voice_thr.wait()
+        self.voice_live = True
+        self._set_voice_dot(False)
+        self.voice_text.setText("Waiting for speech…")
+        self._start_voice()
 
-        self.face_result = self.voice_result = None
+    def _restart_capture(self, failed=None):
+        #only the modality that failed is captured again, a passing one is kept for RETRY_KEEP_SECS
+        #a modality still being captured just carries on
+        deadline = time.monotonic() + config.RETRY_KEEP_SECS
 
-        self.face_thr = FaceCaptureThread(self, config.CAM_DEVICE,
-                                          config.FRAME_SCALE)
-        self.face_thr.processing_signal.connect(
-            lambda: self.face_text.setText("Processing…"))
-        self.face_thr.frame_signal.connect(self._update_camera)
-        self.face_thr.result_signal.connect(self._on_face)
-        self.face_thr.start()
+        if failed in ("face", None):
+            self._recapture_face()
+        elif self.face_result is not None:
+            self._kept["face"] = deadline
+            print("[Auth] retry keeps the face result")
 
-        self.voice_thr = VoiceCaptureThread(self.parent(),
-                                            required_speech=config.RECORD_SEC)
-        self.voice_thr.speech_signal.connect(self._set_voice_dot)
-        self.voice_thr.processing_signal.connect(
-            lambda: self.voice_text.setText("Processing…"))
-        self.voice_thr.result_signal.connect(self._on_voice_embedding)
-        self.voice_thr.start()
+        if failed in ("voice", None):
+            self._recapture_voice()
+        else:
+            self.voice_live = True
+            if self.voice_scores is not None:
+                self._kept["voice"] = deadline
+                print("[Auth] retry keeps the voice result")
 
     def reject(self):
         self._stop_threads()
         super().reject()
 
+    def done(self, r):
+        #accept() and reject() both end here
+        if self._holds_cpu:
+            self._holds_cpu = False
+            resources.release("interactive")
+        super().done(r)
+
     def closeEvent(self, ev):
         self.reject()
         ev.accept()
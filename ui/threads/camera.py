@@ -0,0 +1,77 @@
+import threading
+import cv2
+from PyQt5.QtCore import QThread
+
+
+class CameraService(QThread):
+    #owns the VideoCapture for one device and keeps it streaming, consumers only ever read the latest frame
+    #the device is opened and warmed up once per app run, on this thread instead of the GUI thread
+    #frames are never written to after publication, subscribers may hold on to them but must copy to modify
+
+    _instances = {}
+
+    @classmethod
+    def instance(cls, device):
+        cam = cls._instances.get(device)
+        if cam is None:
+            cam = cls._instances[device] = cls(device)
+            cam.start()
+        return cam
+
+    @classmethod
+    def shutdown_all(cls):
+        for cam in cls._instances.values():
+            cam.stop()
+        cls._instances.clear()
+
+    def __init__(self, device, width=1280, height=720, warmup=15):
+        super().__init__()
+        self.device   = device
+        self.width    = width
+        self.height   = height
+        self.warmup   = warmup
+        self._cond    = threading.Condition()
+        self._frame   = None
+        self._frame_id = 0
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.device)
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH,  self.width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE,   2) #the buffer holds 2 frames the camera has already captured
+        for _ in range(self.warmup):
+            cap.read() #avoid the first laggy frames
+        return cap
+
+    def run(self):
+        cap = self._open()
+        while not self.isInterruptionRequested():
+            if not cap.isOpened():
+                print(f"[Camera] device {self.device} not available, retrying")
+                self.msleep(1000)
+                cap = self._open()
+                continue
+            ok, frame = cap.read() #blocks until the next frame, which paces this loop
+            if not ok:
+                continue
+            with self._cond:
+                self._frame = frame
+                self._frame_id += 1
+                self._cond.notify_all()
+        cap.release()
+
+    def latest(self):
+        #(frame id, frame), frame is None until the first one arrives
+        with self._cond:
+            return self._frame_id, self._frame
+
+    def wait_frame(self, after_id=0, timeout=1.0):
+        #blocks until a frame newer than after_id exists, returns (frame id, frame) or (after_id, None)
+        with self._cond:
+            if self._cond.wait_for(lambda: self._frame_id > after_id, timeout):
+                return self._frame_id, self._frame
+            return after_id, None
+
+    def stop(self):
+        self.requestInterruption()
+        self.wait()
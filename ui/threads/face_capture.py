@@ -3,6 +3,9 @@ import cv2
 import numpy as np
 from PyQt5.QtCore import QThread, pyqtSignal
 import face_recognition
+import config
+import face_encoding
+from ui.threads.camera import CameraService
 
 
 class FaceCaptureThread(QThread):
@@ -13,7 +16,7 @@ class FaceCaptureThread(QThread):
     detect_signal     = pyqtSignal(bool)
 
     def __init__(self, parent, cam_device, frame_scale,
-                 required_stable=5, pos_tol=20, size_tol=20, poll_hz=30):
+                 required_stable=5, pos_tol=20, size_tol=20, poll_hz=30, multi_face=None):
         super().__init__(parent)
         self.parent_ref       = parent
         self.cam_device       = cam_device
@@ -22,24 +25,92 @@ class FaceCaptureThread(QThread):
         self.pos_tol          = pos_tol
         self.size_tol         = size_tol
         self.poll_interval    = 1.0 / poll_hz
+        self.multi_face       = config.MULTI_FACE if multi_face is None else multi_face
 
-        self.cap = cv2.VideoCapture(self.cam_device)
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH,  1280)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-        self.cap.set(cv2.CAP_PROP_BUFFERSIZE,   2) #the buffer holds 2 frames the camera has already captured
-
-        for _ in range(15):
-            self.cap.read() #avoid the first laggy frames
+        #the device is already open and streaming, nothing to initialize per dialog or retry
+        self.camera         = CameraService.instance(self.cam_device)
+        self._frame_id      = 0
 
         self._processed     = False
         self._stability     = 0
         self._last_center   = None
         self._last_size     = None
+        self._tracks        = [] #multi-face mode: one stability counter per face in view
+        self._rearm         = False #set from the GUI thread, the reset itself runs in run()
+
+    def rearm(self):
+        #score again from the next stable face, the thread and the camera stream keep running
+        #called from the GUI thread, so only the request is recorded here and run() does the reset
+        self._rearm = True
+
+    def _reset(self):
+        self._rearm       = False
+        self._processed   = False
+        self._stability   = 0
+        self._last_center = self._last_size = None
+        self._tracks      = []
+
+    def _match_tracks(self, locs):
+        #greedy nearest-centre matching of this frame's faces to the previous frame's tracks
+        tracks, free = [], list(self._tracks)
+        for loc in locs:
+            top, right, bottom, left = loc
+            w, h = right - left, bottom - top
+            cx, cy = left + w / 2, top + h / 2
+            best, best_d = None, None
+            for t in free:
+                dx, dy = abs(cx - t["center"][0]), abs(cy - t["center"][1])
+                dw, dh = abs(w - t["size"][0]), abs(h - t["size"][1])
+                if dx < self.pos_tol and dy < self.pos_tol and dw < self.size_tol and dh < self.size_tol:
+                    if best is None or dx + dy < best_d:
+                        best, best_d = t, dx + dy
+            if best is not None:
+                free.remove(best)
+                tracks.append({"loc": loc, "center": (cx, cy), "size": (w, h),
+                               "stability": best["stability"] + 1})
+            else:
+                tracks.append({"loc": loc, "center": (cx, cy), "size": (w, h), "stability": 1})
+        self._tracks = tracks
+
+    def _pick(self, tracks, frame_shape):
+        #prefer the largest face, discounted by its distance from the frame centre
+        fh, fw = frame_shape[:2]
+        diag = np.hypot(fw, fh) / 2
+        def weight(t):
+            area = t["size"][0] * t["size"][1]
+            off = np.hypot(t["center"][0] - fw / 2, t["center"][1] - fh / 2) / diag
+            return area * (1.0 - 0.5 * off)
+        return max(range(len(tracks)), key=lambda i: weight(tracks[i]))
+
+    def _step_tracks(self, rgb, locs):
+        self._match_tracks(locs)
+        best = max(t["stability"] for t in self._tracks)
+        self.stable_update.emit(best, self.required_stable)
+
+        stable = [t for t in self._tracks if t["stability"] >= self.required_stable]
+        if not stable or self._processed:
+            return
+        self.processing_signal.emit()
+
+        #all stable faces go through the encoder and the classifier in one batch each
+        embs  = face_encoding.encode_faces(rgb, [t["loc"] for t in stable])
+        probs = self.parent_ref.face_svm.predict_proba(np.stack(embs))
+        chosen = self._pick(stable, rgb.shape)
+        idx = int(np.argmax(probs[chosen]))
+        name = self.parent_ref.face_classes[idx]
+        score = float(probs[chosen][idx])
+        print(f"[FaceAuth] {len(stable)} stable faces in view, using face #{chosen}")
+
+        self.result_signal.emit(name, score, probs[chosen])
+        self._processed = True
 
     def run(self):
         while not self.isInterruptionRequested():
-            ok, frame = self.cap.read()
-            if not ok:
+            if self._rearm:
+                self._reset()
+            #only frames newer than the last one handled, so a slow detector never sees a frame twice
+            self._frame_id, frame = self.camera.wait_frame(self._frame_id, timeout=0.5)
+            if frame is None:
                 continue
 
             small = cv2.resize(
@@ -57,6 +128,12 @@ class FaceCaptureThread(QThread):
             if not face_found:
                 self._stability = 0 #restart stability counter
                 self._last_center = self._last_size = None #resets the memory of the last face's position and size
+                self._tracks = []
+                time.sleep(self.poll_interval)
+                continue
+
+            if self.multi_face:
+                self._step_tracks(rgb, locs)
                 time.sleep(self.poll_interval)
                 continue
 
@@ -97,7 +174,3 @@ class FaceCaptureThread(QThread):
                 self._processed = True
 
             time.sleep(self.poll_interval)
-
-        if self.cap and self.cap.isOpened():
-            self.cap.release()
-            self.cap = None
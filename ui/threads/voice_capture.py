@@ -65,7 +65,7 @@ class VoiceCaptureThread(QThread):
         audio = np.concatenate(self.buffer, axis=0).flatten()
 
         try:
-            emb = config.encoder.embed_utterance(audio.astype(np.float32))
+            emb = config.get_encoder().embed_utterance(audio.astype(np.float32))
             self.result_signal.emit(emb) #emit to the authentication page the voice embedding
         except Exception:
             self.no_voice.emit()
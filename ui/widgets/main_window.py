@@ -6,13 +6,17 @@ from PyQt5.QtCore import QTimer, Qt
 from PyQt5.QtGui import QImage, QPixmap
 import face_recognition
 import config
+import embeddings
+from voice_index import VoiceIndex
 from config import (
     VOICE_MODEL_FILE, FACE_MODEL_FILE, RAW_VOICE_DIR,
     CLEAN_VOICE_DIR, AUG_VOICE_DIR, RAW_FACE_DIR,  PROC_FACE_DIR, AUG_FACE_DIR, RECORD_SEC, FRAME_SCALE, db,
     CAM_DEVICE
 )
-from ui.threads.enrollment import EnrollmentPipelineThread
+import enroll_queue
+from ui.threads.enrollment import EnrollmentPipelineThread, EnrollQueueThread
 from ui.threads.recorder import RecorderThread
+from ui.threads.camera import CameraService
 from ui.dialogs.processing import ProcessingDialog
 from ui.dialogs.authentication import MultiModalAuthDialog
 from .login_page import LoginPage
@@ -44,20 +48,41 @@ class MainWindow(QMainWindow):
         #"Snapshot 1 of 5"
         self._face_count = 1
         self._pending_username = None
+        #job id -> username of background enrollments submitted from this kiosk
+        self._enroll_jobs = {}
 
         self.load_models()
         self.show_login_page()
 
+        #opened and warmed up once in the background, shared by the auth dialog and the enrollment preview
+        self.camera = CameraService.instance(CAM_DEVICE)
+
+        self._queue_worker = None
+        if config.ENROLL_IN_BACKGROUND:
+            if config.ENROLL_WORKER_IN_APP:
+                self._queue_worker = EnrollQueueThread(parent=self)
+                self._queue_worker.start()
+            self._job_timer = QTimer(self)
+            self._job_timer.timeout.connect(self._poll_enroll_jobs)
+            self._job_timer.start(config.ENROLL_STATUS_POLL_MS)
+
     #the models are loaded only once, when the app starts
     #each dialog or thread that needs the model can grab it directly
     def load_models(self):
+        self._models_stamp = self._model_stamp()
+        config.get_encoder() #loaded here rather than on the first authentication
         vd = joblib.load(VOICE_MODEL_FILE)
         self.voice_clf = vd["svm"]
         self.voice_classes = vd["classes"]
         self.voice_thresholds = vd.get("voice_thresholds", {})
+        #every enrolled voice in one matrix, so a voice sample can be scored against all users at once
+        self.voice_bank, self.voice_starts, self.voice_users = embeddings.labeled_stack(
+            db.get_all_audio_blobs(), dim=config.VOICE_EMB_DIM)
+        self.voice_index = VoiceIndex.load() if config.VOICE_FIRST_ID else None
 
-        fd = joblib.load(FACE_MODEL_FILE)
-        self.face_svm = fd["svm"]
+        #both engines expose predict_proba over face_classes, the capture thread does not tell them apart
+        fd = joblib.load(config.FACE_INDEX_FILE if config.FACE_ENGINE == "index" else FACE_MODEL_FILE)
+        self.face_svm = fd.get("model", fd.get("svm"))
         self.face_classes = fd["classes"]
         self.global_threshold = fd.get("global_threshold", fd.get("threshold"))
         self.class_thresholds = fd.get("class_thresholds", {})
@@ -65,6 +90,10 @@ class MainWindow(QMainWindow):
     def closeEvent(self, event):
         if getattr(self, "_pending_username", None):
             self.cancel_enroll()
+        if self._queue_worker is not None:
+            self._queue_worker.stop()
+            self._queue_worker.wait()
+        CameraService.shutdown_all()
         super().closeEvent(event) #built-in closeEvent that destroys the windows, signals etc
 
 
@@ -86,7 +115,6 @@ class MainWindow(QMainWindow):
         self._face_count = 1
         self.face_page.snap_lbl.setText("Snapshot 1 of 5")
         self.face_page.snap_btn.setEnabled(True)
-        self.cap = cv2.VideoCapture(CAM_DEVICE)
         self.timer = QTimer(self) #creates a timer object and it stops once the window stops (self)
         self.timer.timeout.connect(self._update_preview)
         self.timer.start(30) #smooth preview of the camera update
@@ -99,8 +127,6 @@ class MainWindow(QMainWindow):
     def cancel_enroll(self):
         if hasattr(self, 'timer') and self.timer.isActive():
             self.timer.stop()
-        if hasattr(self, 'cap') and self.cap.isOpened():
-            self.cap.release()
         u = getattr(self, "_pending_username", None)
         if u:
             db.delete_user_data(u)
@@ -123,7 +149,7 @@ class MainWindow(QMainWindow):
             if not name:
                 QMessageBox.warning(self, "Error", "Please enter a username first.")
                 return
-            if db.user_exists(name):
+            if db.user_exists(name) or db.enroll_pending(name):
                 QMessageBox.warning(self, "Oops", f"User '{name}' already exists.")
                 return
             self._pending_username = name
@@ -156,8 +182,8 @@ class MainWindow(QMainWindow):
             self.show_enroll_face_page()
 
     def _update_preview(self):
-        ret, frame = self.cap.read()
-        if not ret: #failed to grab a frame
+        _, frame = self.camera.latest()
+        if frame is None: #no frame yet
             return
         rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         h, w, ch = rgb.shape #ch=3 (R,G,B)
@@ -167,8 +193,8 @@ class MainWindow(QMainWindow):
         self.face_page.face_preview.setPixmap(pix)
 
     def _capture_snapshot(self):
-        ret, frame = self.cap.read()
-        if not ret:
+        _, frame = self.camera.latest()
+        if frame is None:
             QMessageBox.warning(self, "Error", "Failed to grab frame")
             return
         small = cv2.resize(frame, (0, 0), fx=FRAME_SCALE, fy=FRAME_SCALE)
@@ -188,13 +214,49 @@ class MainWindow(QMainWindow):
             self.face_page.snap_lbl.setText(f"Snapshot {self._face_count} of 5")
         else:
             self.timer.stop()
-            self.cap.release()
+            if config.ENROLL_IN_BACKGROUND:
+                self._submit_enrollment()
+                return
             proc_dlg = ProcessingDialog(self)
             thread = EnrollmentPipelineThread(self._pending_username, parent=self)
             thread.result.connect(lambda ok, dlg=proc_dlg: self._on_pipeline_finished(ok, dlg))
             thread.start()
             proc_dlg.exec_()
 
+    def _submit_enrollment(self):
+        username = self._pending_username
+        job_id = enroll_queue.submit(username)
+        if job_id is None:
+            QMessageBox.critical(self, "Enrollment failed", f"User '{username}' is already being enrolled.")
+            self.cancel_enroll()
+            return
+        self._enroll_jobs[job_id] = username
+        #the raw captures now belong to the job, cancel_enroll must not delete them
+        self._pending_username = None
+        self.statusBar().showMessage(f"Enrolling '{username}' in the background…")
+        self.show_login_page()
+
+    @staticmethod
+    def _model_stamp():
+        files = (VOICE_MODEL_FILE, FACE_MODEL_FILE, config.FACE_INDEX_FILE, config.VOICE_INDEX_FILE)
+        return tuple(f.stat().st_mtime_ns if f.exists() else 0 for f in files)
+
+    def _poll_enroll_jobs(self):
+        #models published by another kiosk or worker are picked up too
+        if self._model_stamp() != self._models_stamp:
+            self.load_models()
+        for job_id, username in list(self._enroll_jobs.items()):
+            state, error = enroll_queue.status(job_id)
+            if state in ("queued", "running"):
+                continue
+            del self._enroll_jobs[job_id]
+            if state == "done":
+                self.statusBar().showMessage(f"User '{username}' has been enrolled!", 10000)
+            else:
+                print(f"[Enroll] job {job_id} for {username}: {error}")
+                self.statusBar().showMessage(
+                    f"Enrollment of '{username}' failed, please enroll again.", 10000)
+
     def _on_pipeline_finished(self, ok: bool, proc_dlg):
         proc_dlg.accept()
         if not ok:
@@ -218,7 +280,7 @@ class MainWindow(QMainWindow):
         dlg = MultiModalAuthDialog(self)
         success = dlg.exec_() == dlg.Accepted and dlg.auth_success
         if success:
-            config.db.log_attempt(dlg.auth_name, "multimodal", True)
+            config.db.log_attempt(dlg.auth_name, dlg.auth_method, True)
             self.show_welcome_page(dlg.auth_name)
 
 
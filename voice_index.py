@@ -0,0 +1,173 @@
+import time
+import joblib
+import numpy as np
+
+import config
+import embeddings
+import model_files
+
+#approximate 1:N voice search (IVF): spherical k-means splits the normalized embeddings into lists,
+#a query only visits the nprobe lists whose centroids are closest and re-ranks those rows exactly
+#new users are appended to their nearest lists, the partition is rebuilt once the index has doubled
+
+
+def _normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)
+
+
+def _kmeans(x, k, iters=20, seed=0):
+    #spherical k-means on unit vectors, centroids are re-normalized means
+    rng  = np.random.default_rng(seed)
+    cent = x[rng.choice(len(x), size=k, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(x @ cent.T, axis=1)
+        sums = np.zeros_like(cent)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        #an empty list takes a random point so k stays fixed
+        sums[empty] = x[rng.choice(len(x), size=int(empty.sum()))]
+        cent = _normalize(sums)
+    return cent
+
+
+class VoiceIndex:
+
+    def __init__(self, dim=config.VOICE_EMB_DIM, nprobe=8):
+        self.dim       = dim
+        self.nprobe    = nprobe
+        self.labels    = []     #label id -> username
+        self._ids      = {}
+        self.centroids = np.empty((0, dim), np.float32)
+        self.lists     = []     #per list: (vectors (n, dim), label ids (n,))
+        self.built_n   = 0
+
+    def __len__(self):
+        return sum(len(l) for _, l in self.lists)
+
+    def _label_ids(self, labels):
+        return np.array([self._ids.setdefault(l, len(self._ids)) for l in labels], np.int64)
+
+    def build(self, vecs, labels, n_lists=None, seed=0):
+        x = _normalize(vecs)
+        self.labels, self._ids = [], {}
+        lab = self._label_ids(labels)
+        self.labels = list(self._ids)
+        #about sqrt(n) lists keeps both the centroid scan and the probed lists short
+        k = n_lists or max(1, min(len(x), int(np.sqrt(len(x)))))
+        self.centroids = _kmeans(x, k, seed=seed) if len(x) else np.empty((0, self.dim), np.float32)
+        assign = np.argmax(x @ self.centroids.T, axis=1) if len(x) else np.empty(0, np.int64)
+        self.lists = [(x[assign == i], lab[assign == i]) for i in range(len(self.centroids))]
+        self.built_n = len(x)
+        return self
+
+    def add(self, vecs, labels):
+        #incremental insert, returns True when the index was re-partitioned
+        x = _normalize(vecs)
+        if not len(x):
+            return False
+        if not len(self.centroids):
+            self.build(x, labels)
+            return True
+        lab = self._label_ids(labels)
+        self.labels = list(self._ids)
+        assign = np.argmax(x @ self.centroids.T, axis=1)
+        for i in np.unique(assign):
+            v, l = self.lists[i]
+            self.lists[i] = (np.vstack([v, x[assign == i]]), np.concatenate([l, lab[assign == i]]))
+        #lists drift from the centroids as they grow, rebuild the partition once the index has doubled
+        if len(self) > 2 * self.built_n:
+            self.rebuild()
+            return True
+        return False
+
+    def rebuild(self):
+        vecs = [v for v, _ in self.lists if len(v)]
+        labs = [l for _, l in self.lists if len(l)]
+        if not vecs:
+            return
+        names = [self.labels[i] for i in np.concatenate(labs)]
+        self.build(np.vstack(vecs), names)
+
+    def remove(self, label):
+        lid = self._ids.get(label)
+        if lid is None:
+            return
+        self.lists = [(v[l != lid], l[l != lid]) for v, l in self.lists]
+
+    def search(self, query, k=5, nprobe=None):
+        #returns [(username, cosine)] for the k best users, each user scored by its best row
+        q = _normalize(query).ravel()
+        if not len(self.centroids):
+            return []
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probe  = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+        vecs = [self.lists[i][0] for i in probe if len(self.lists[i][1])]
+        if not vecs:
+            return []
+        labs = np.concatenate([self.lists[i][1] for i in probe if len(self.lists[i][1])])
+        sims = np.vstack(vecs) @ q
+        #best row per user: sort by score once and keep the first hit of every label
+        order = np.argsort(-sims)
+        _, first = np.unique(labs[order], return_index=True)
+        top = order[np.sort(first)][:k]
+        return [(self.labels[labs[i]], float(sims[i])) for i in top]
+
+    def save(self, path=None):
+        model_files.publish(self, path or config.VOICE_INDEX_FILE)
+
+    @staticmethod
+    def load(path=None):
+        path = path or config.VOICE_INDEX_FILE
+        return joblib.load(path) if path.exists() else None
+
+
+def exact_search(query, vecs, labels, k=5, normalized=False):
+    #brute force over every row, the reference for recall
+    q = _normalize(query).ravel()
+    sims = (vecs if normalized else _normalize(vecs)) @ q
+    order = np.argsort(-sims)
+    labs = np.asarray(labels)[order]
+    _, first = np.unique(labs, return_index=True)
+    top = order[np.sort(first)][:k]
+    return [(labels[i], float(sims[i])) for i in top]
+
+
+def _user_rows(rows):
+    names = []
+    (mat, scales, _), starts, users = embeddings.labeled_stack(rows, dim=config.VOICE_EMB_DIM)
+    bounds = list(starts) + [len(mat)]
+    for u, a, b in zip(users, bounds[:-1], bounds[1:]):
+        names += [u] * (b - a)
+    vecs = mat.astype(np.float32) * scales[:, None]
+    return vecs, names
+
+
+def build_from_db():
+    vecs, names = _user_rows(config.db.get_all_audio_blobs())
+    return VoiceIndex().build(vecs, names)
+
+
+def index_user(username):
+    #called at enrollment once the user's voice rows are stored, the caller holds the models/ lock
+    index = VoiceIndex.load()
+    if index is None:
+        index = build_from_db()
+    else:
+        index.remove(username)
+        vecs, names = _user_rows([(username, b) for b in config.db.get_audio_embedding_blobs(username)])
+        index.add(vecs, names)
+    index.save()
+    print(f"[VoiceIndex] {len(index)} rows in {len(index.centroids)} lists after adding {username}")
+    return index
+
+
+if __name__ == "__main__":
+    #python voice_index.py  -> rebuild the index from every stored voice embedding
+    t0 = time.perf_counter()
+    with model_files.locked():
+        index = build_from_db()
+        index.save()
+    print(f"[VoiceIndex] built {len(index)} rows, {len(index.labels)} users, "
+          f"{len(index.centroids)} lists in {time.perf_counter() - t0:.1f}s")